@@ -0,0 +1,458 @@
+"""
+Caching helpers:
+
+    LRUCache - A bounded, thread-safe mapping that evicts the least recently used entries
+        (with optional per-entry expiration).
+    LocalMemcache - An in-process stand-in for the App Engine memcache API - for local testing,
+        benchmarking, and running without App Engine.
+    Cache - The cache facade used by the rest of the stack: a shared backend (memcache)
+        with an optional in-process LRU tier in front of it, and per-namespace statistics.
+
+Usage:
+
+    cacheScripts = cache.get_cache('scripts', local_items=50, local_secs=3600)
+    sScript = cacheScripts.get(sKey)
+
+Optional settings.py values:
+
+    CACHE_BACKEND = 'memcache'      # or 'local' (in-process - also used when the App Engine
+                                    # memcache API is not available)
+    CACHE_LOCAL_MAX_BYTES = 0       # Size of the 'local' backend (0 is unbounded)
+"""
+
+import threading
+import time
+import cPickle as pickle
+
+# Offsets into an LRUCache list node
+PREV, NEXT, KEY, VALUE, EXPIRES, SIZE = range(6)
+
+class LRUCache(object):
+    """
+    Bounded mapping with least-recently-used eviction.
+
+    Usage:
+
+        lru = LRUCache(1000)
+        lru.set('key', value, time=60)
+        value = lru.get('key')
+
+    Entries are kept in a circular, doubly-linked list in order of use; get() and set() move
+    an entry to the front, and entries are evicted from the back when more than max_items
+    are stored.  An expiration time (in seconds) of 0 means the entry never expires.
+
+    If max_bytes is given, entries are also evicted to keep the total size of all values
+    (as measured by sizeof - default len) within max_bytes.
+
+    Counters: hits, misses, evictions
+    """
+    def __init__(self, max_items=1000, max_bytes=0, sizeof=len, clock=time.time):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.clock = clock
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._map = {}
+        self._root = [None, None, None, None, 0, 0]
+        self._root[PREV] = self._root[NEXT] = self._root
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            node = self._lookup(key)
+            if node is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(node)
+            self._link_front(node)
+            return node[VALUE]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, time=0):
+        self._lock.acquire()
+        try:
+            expires = 0
+            if time:
+                expires = self.clock() + time
+            size = 0
+            if self.max_bytes:
+                size = self.sizeof(value)
+                if size > self.max_bytes:
+                    self.delete(key)
+                    return False
+            node = self._map.get(key)
+            if node is not None:
+                self._unlink(node)
+                self.bytes -= node[SIZE]
+                node[VALUE] = value
+                node[EXPIRES] = expires
+                node[SIZE] = size
+            else:
+                node = [None, None, key, value, expires, size]
+                self._map[key] = node
+            self.bytes += size
+            self._link_front(node)
+
+            while len(self._map) > self.max_items or \
+                  (self.max_bytes and self.bytes > self.max_bytes):
+                self._evict(self._root[PREV])
+            return True
+        finally:
+            self._lock.release()
+
+    def add(self, key, value, time=0):
+        """ Set the value only if the key is not already present. """
+        self._lock.acquire()
+        try:
+            if self._lookup(key) is not None:
+                return False
+            return self.set(key, value, time)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            node = self._map.pop(key, None)
+            if node is None:
+                return False
+            self._remove(node)
+            return True
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map.clear()
+            self._root[PREV] = self._root[NEXT] = self._root
+            self.bytes = 0
+        finally:
+            self._lock.release()
+
+    def keys(self):
+        """ Return keys in order of most to least recently used. """
+        self._lock.acquire()
+        try:
+            keys = []
+            node = self._root[NEXT]
+            while node is not self._root:
+                keys.append(node[KEY])
+                node = node[NEXT]
+            return keys
+        finally:
+            self._lock.release()
+
+    def __contains__(self, key):
+        self._lock.acquire()
+        try:
+            return self._lookup(key) is not None
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._map)
+
+    def stats(self):
+        return {'items': len(self._map), 'bytes': self.bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def _lookup(self, key):
+        # Return the (unexpired) node for key - or None
+        node = self._map.get(key)
+        if node is None:
+            return None
+        if node[EXPIRES] and node[EXPIRES] <= self.clock():
+            del self._map[key]
+            self._remove(node)
+            return None
+        return node
+
+    def _evict(self, node):
+        del self._map[node[KEY]]
+        self._remove(node)
+        self.evictions += 1
+
+    def _remove(self, node):
+        self._unlink(node)
+        self.bytes -= node[SIZE]
+
+    def _link_front(self, node):
+        root = self._root
+        node[PREV] = root
+        node[NEXT] = root[NEXT]
+        root[NEXT][PREV] = node
+        root[NEXT] = node
+
+    @staticmethod
+    def _unlink(node):
+        node[PREV][NEXT] = node[NEXT]
+        node[NEXT][PREV] = node[PREV]
+
+class LocalMemcache(object):
+    """
+    In-process implementation of (a subset of) the google.appengine.api.memcache module API.
+
+    Values are pickled on the way in and out (as they are by memcache), so callers
+    never share mutable objects through the cache.  Memory use can be bounded by
+    number of items and by total (pickled) size.
+    """
+    DELETE_NETWORK_FAILURE = 0
+    DELETE_ITEM_MISSING = 1
+    DELETE_SUCCESSFUL = 2
+
+    def __init__(self, max_items=10000, max_bytes=0, clock=time.time):
+        self._lru = LRUCache(max_items, max_bytes, clock=clock)
+        self._lock = threading.RLock()
+
+    def get(self, key, namespace=None):
+        s = self._lru.get(self._key(key, namespace))
+        if s is None:
+            return None
+        return pickle.loads(s)
+
+    def set(self, key, value, time=0, min_compress_len=0, namespace=None):
+        return self._lru.set(self._key(key, namespace), pickle.dumps(value, 2), time)
+
+    def add(self, key, value, time=0, min_compress_len=0, namespace=None):
+        return self._lru.add(self._key(key, namespace), pickle.dumps(value, 2), time)
+
+    def replace(self, key, value, time=0, min_compress_len=0, namespace=None):
+        self._lock.acquire()
+        try:
+            if self._key(key, namespace) not in self._lru:
+                return False
+            return self.set(key, value, time, namespace=namespace)
+        finally:
+            self._lock.release()
+
+    def delete(self, key, seconds=0, namespace=None):
+        if self._lru.delete(self._key(key, namespace)):
+            return self.DELETE_SUCCESSFUL
+        return self.DELETE_ITEM_MISSING
+
+    def add_multi(self, mapping, time=0, key_prefix='', min_compress_len=0, namespace=None):
+        """ Returns the keys which were not added (already present) """
+        return [key for key, value in mapping.items()
+                if not self.add(key_prefix + key, value, time, namespace=namespace)]
+
+    def get_multi(self, keys, key_prefix='', namespace=None):
+        results = {}
+        for key in keys:
+            value = self.get(key_prefix + key, namespace)
+            if value is not None:
+                results[key] = value
+        return results
+
+    def set_multi(self, mapping, time=0, key_prefix='', min_compress_len=0, namespace=None):
+        for key, value in mapping.items():
+            self.set(key_prefix + key, value, time, namespace=namespace)
+        return []
+
+    def delete_multi(self, keys, seconds=0, key_prefix='', namespace=None):
+        for key in keys:
+            self.delete(key_prefix + key, namespace=namespace)
+        return True
+
+    def incr(self, key, delta=1, namespace=None, initial_value=None):
+        # As memcache - the delta can't be negative (use decr)
+        if delta < 0:
+            raise ValueError("Delta must not be negative.")
+        return self._add_delta(key, delta, namespace, initial_value)
+
+    def decr(self, key, delta=1, namespace=None, initial_value=None):
+        if delta < 0:
+            raise ValueError("Delta must not be negative.")
+        return self._add_delta(key, -delta, namespace, initial_value)
+
+    def _add_delta(self, key, delta, namespace, initial_value):
+        self._lock.acquire()
+        try:
+            value = self.get(key, namespace)
+            if value is None:
+                if initial_value is None:
+                    return None
+                value = initial_value
+            value = max(0, long(value) + delta)
+            self.set(key, value, namespace=namespace)
+            return value
+        finally:
+            self._lock.release()
+
+    def flush_all(self):
+        self._lru.clear()
+        return True
+
+    def get_stats(self):
+        stats = self._lru.stats()
+        return {'items': stats['items'], 'hits': stats['hits'], 'misses': stats['misses'],
+                'bytes': stats['bytes'], 'byte_hits': 0, 'oldest_item_age': 0}
+
+    @staticmethod
+    def _key(key, namespace):
+        if namespace:
+            return '%s:%s' % (namespace, key)
+        return key
+
+class Cache(object):
+    """
+    Cache facade: a shared client (the App Engine memcache module or a LocalMemcache) with an
+    optional in-process LRU tier (of local_items entries, each kept up to local_secs).
+
+    The local tier returns the same object to every caller - only use it for values which are
+    never modified (strings, numbers, tuples); values written by other instances are seen
+    after (up to) local_secs.  incr() and decr() always go to the shared client.
+
+    The namespace names the cache in stats() - keys are passed to the client unchanged.
+
+    Counters: local_hits, hits, misses, sets
+    """
+    def __init__(self, namespace, local_items=0, local_secs=60, client=None, clock=time.time):
+        if client is None:
+            client = get_client()
+        self.namespace = namespace
+        self.client = client
+        self.local_secs = local_secs
+        self.local = None
+        if local_items:
+            self.local = LRUCache(local_items, clock=clock)
+        self.local_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+
+    def get(self, key):
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                self.local_hits += 1
+                return value
+        value = self.client.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._set_local(key, value)
+        return value
+
+    def get_multi(self, keys, key_prefix=''):
+        results = {}
+        if self.local is not None:
+            for key in keys:
+                value = self.local.get(key_prefix + key)
+                if value is not None:
+                    results[key] = value
+            self.local_hits += len(results)
+            keys = [key for key in keys if key not in results]
+            if not keys:
+                return results
+        mFound = self.client.get_multi(keys, key_prefix=key_prefix)
+        self.hits += len(mFound)
+        self.misses += len(keys) - len(mFound)
+        for key, value in mFound.items():
+            self._set_local(key_prefix + key, value)
+        results.update(mFound)
+        return results
+
+    def set(self, key, value, time=0):
+        self.sets += 1
+        self._set_local(key, value, time)
+        return self.client.set(key, value, time)
+
+    def set_multi(self, mapping, time=0, key_prefix=''):
+        self.sets += len(mapping)
+        for key, value in mapping.items():
+            self._set_local(key_prefix + key, value, time)
+        return self.client.set_multi(mapping, time, key_prefix=key_prefix)
+
+    def add(self, key, value, time=0):
+        self.sets += 1
+        fAdded = self.client.add(key, value, time)
+        if fAdded:
+            self._set_local(key, value, time)
+        return fAdded
+
+    def add_multi(self, mapping, time=0, key_prefix=''):
+        """ Returns the keys which were not added (already present) """
+        self.sets += len(mapping)
+        rgNotAdded = self.client.add_multi(mapping, time, key_prefix=key_prefix)
+        if self.local is not None:
+            setNotAdded = set(rgNotAdded)
+            for key, value in mapping.items():
+                if key not in setNotAdded:
+                    self._set_local(key_prefix + key, value, time)
+        return rgNotAdded
+
+    def incr(self, key, delta=1, initial_value=None):
+        if self.local is not None:
+            self.local.delete(key)
+        return self.client.incr(key, delta, initial_value=initial_value)
+
+    def decr(self, key, delta=1, initial_value=None):
+        if self.local is not None:
+            self.local.delete(key)
+        return self.client.decr(key, delta, initial_value=initial_value)
+
+    def delete(self, key):
+        if self.local is not None:
+            self.local.delete(key)
+        return self.client.delete(key)
+
+    def stats(self):
+        mStats = {'local_hits': self.local_hits, 'hits': self.hits, 'misses': self.misses,
+                  'sets': self.sets}
+        if self.local is not None:
+            mStats['local_items'] = len(self.local)
+            mStats['local_evictions'] = self.local.evictions
+        return mStats
+
+    def _set_local(self, key, value, time=0):
+        if self.local is None:
+            return
+        secs = self.local_secs
+        if time and time < secs:
+            secs = time
+        self.local.set(key, value, secs)
+
+def get_client():
+    """
+    Return the shared cache client - the App Engine memcache module, or a process-wide
+    LocalMemcache if so configured (or App Engine is not available).
+    """
+    global _client
+    if _client is None:
+        import settings
+        if getattr(settings, 'CACHE_BACKEND', 'memcache') == 'memcache':
+            try:
+                from google.appengine.api import memcache
+                _client = memcache
+            except ImportError:
+                pass
+        if _client is None:
+            _client = LocalMemcache(max_bytes=getattr(settings, 'CACHE_LOCAL_MAX_BYTES', 0))
+    return _client
+
+def get_cache(namespace, local_items=0, local_secs=60):
+    """ Return the (process-wide) Cache for a namespace - created on first use """
+    _lock.acquire()
+    try:
+        cache = _caches.get(namespace)
+        if cache is None:
+            cache = _caches[namespace] = Cache(namespace, local_items, local_secs)
+        return cache
+    finally:
+        _lock.release()
+
+def stats():
+    """ Return the statistics of each namespace """
+    return dict([(namespace, cache.stats()) for namespace, cache in _caches.items()])
+
+_client = None
+_caches = {}
+_lock = threading.Lock()
@@ -1,14 +1,40 @@
+"""
+Global application variables, counters and id allocation.
+
+Optional settings.py values:
+
+    GLOBALS_ID_BLOCK = 10           # Ids reserved at a time by each process (IdNameNext)
+    GLOBALS_COUNTER_SHARDS = 20     # Shards per counter (CountIncr) - may be raised, never lowered
+    GLOBALS_COUNTER_SECS = 60       # Time a counter total is cached
+"""
+
+import random
+import threading
+
 from google.appengine.ext import db
-from google.appengine.api import memcache
 
+import settings
+import cache
 import util
 
+# Global strings are read on (nearly) every request - keep them in-process, too
+cacheStrings = cache.get_cache('global', local_items=100, local_secs=60)
+cacheCounts = cache.get_cache('global.count')
+
 class Globals(db.Model):
     """
     Global application variables (stored in the database)
     Each model can store an incrementable integer or string.
     
-    TODO: Use memcache and sharded counters for performance
+    Ids (IdNameNext) are reserved in blocks of GLOBALS_ID_BLOCK per process, so most calls
+    need no transaction.  Ids are unique, but are not handed out in order across processes, and
+    the unused part of a block is skipped when a process exits.
+    
+    IdGet returns the highest id reserved so far - not (as before blocks were reserved) the last
+    id handed out: ids up to GLOBALS_ID_BLOCK-1 less (in each process) may not be handed out
+    yet.  It is an upper bound of the ids in use (idMin-1 if none have been).
+    
+    High-volume counters should use CountIncr/CountGet (sharded) rather than Ids.
     """
     idNext = db.IntegerProperty(default=0)
     s = db.StringProperty()
@@ -17,26 +43,42 @@ class Globals(db.Model):
     def SGet(name, sDefault=""):
         # Global strings are constant valued - can only be updated in the store
         # via admin console 
-        s = memcache.get('global.%s' % name)
+        s = cacheStrings.get('global.%s' % name)
         if s is not None:
             return s
         glob = Globals.get_or_insert(key_name=name, s=sDefault)
         # Since we can't bounce the server, force refresh each 60 seconds
-        memcache.add('global.%s' % name, glob.s, time=60)
+        cacheStrings.add('global.%s' % name, glob.s, time=60)
         return glob.s
         
     @staticmethod
-    @util.run_in_transaction
     def IdNameNext(name, idMin=1):
-        # Increment and return a global counter - starts at idMin
+        # Return the next (unique) id of a global counter - starts at idMin
+        _lockIds.acquire()
+        try:
+            block = _mIdBlocks.get(name)
+            if block is None or block[0] > block[1] or block[0] < idMin:
+                cBlock = getattr(settings, 'GLOBALS_ID_BLOCK', 10)
+                idLast = Globals._IdReserve(name, idMin, cBlock)
+                block = _mIdBlocks[name] = [idLast - cBlock + 1, idLast]
+            idNext = block[0]
+            block[0] += 1
+            return idNext
+        finally:
+            _lockIds.release()
+    
+    @staticmethod
+    @util.run_in_transaction
+    def _IdReserve(name, idMin, cBlock):
+        # Reserve the next cBlock ids - returns the last one
         glob = Globals._IdLookup(name, idMin)
-        glob.idNext = glob.idNext + 1
+        glob.idNext = glob.idNext + cBlock
         glob.put()
         return glob.idNext
     
     @staticmethod
     def IdGet(name, idMin=1):
-        # Return value of a global counter - starts at idMin
+        # Return the highest id reserved (by any process) - idMin-1 before the first IdNameNext
         glob = Globals._IdLookup(name, idMin)
         return glob.idNext
     
@@ -47,4 +89,57 @@ class Globals(db.Model):
             glob = Globals(key_name=name)
         if glob.idNext < idMin-1:
             glob.idNext = idMin-1
-        return glob      
\ No newline at end of file
+        return glob
+    
+    @staticmethod
+    def CountIncr(name, delta=1):
+        # Add delta to a sharded counter - one (random) shard is updated
+        GlobalShard.Incr(name, random.randrange(_shards()), delta)
+        # Keep the cached total (if any) current - memcache incr only takes a non-negative delta
+        sKey = _sCountKey(name)
+        if delta >= 0:
+            cacheCounts.incr(sKey, delta)
+        elif cacheCounts.decr(sKey, -delta) == 0:
+            # decr stops at 0 - the total may be less
+            cacheCounts.delete(sKey)
+        
+    @staticmethod
+    def CountGet(name):
+        # Return the total of a sharded counter (cached for GLOBALS_COUNTER_SECS)
+        count = cacheCounts.get(_sCountKey(name))
+        if count is not None:
+            return count
+        shards = GlobalShard.get_by_key_name([GlobalShard.KeyName(name, i) for i in range(_shards())])
+        count = sum([shard.count for shard in shards if shard is not None])
+        cacheCounts.add(_sCountKey(name), count, time=getattr(settings, 'GLOBALS_COUNTER_SECS', 60))
+        return count
+
+class GlobalShard(db.Model):
+    """
+    One shard of a sharded counter (see Globals.CountIncr)
+    """
+    count = db.IntegerProperty(default=0)
+    
+    @staticmethod
+    def KeyName(name, i):
+        return "%s~%d" % (name, i)
+    
+    @staticmethod
+    @util.run_in_transaction
+    def Incr(name, i, delta):
+        sKey = GlobalShard.KeyName(name, i)
+        shard = GlobalShard.get_by_key_name(sKey)
+        if shard is None:
+            shard = GlobalShard(key_name=sKey)
+        shard.count += delta
+        shard.put()
+        
+def _shards():
+    return getattr(settings, 'GLOBALS_COUNTER_SHARDS', 20)
+
+def _sCountKey(name):
+    return 'global.count.%s' % name
+
+# name -> [idNext, idLast] - ids reserved by this process
+_mIdBlocks = {}
+_lockIds = threading.Lock()
@@ -0,0 +1,47 @@
+"""
+Minifier throughput - jsmin.jsmin (character at a time) vs. minify.minify (buffer based),
+over the concatenated scripts of the test corpus (those jsmin can minify).
+
+Usage (from the jscomposer directory):
+
+    python bench.py [repeat]
+"""
+
+import sys
+import time
+
+import jsmin
+import minify
+import test
+
+def throughput(fn, js, repeat):
+    """ Return MB per second (best of repeat runs) """
+    secsBest = None
+    for i in xrange(repeat):
+        secsStart = time.time()
+        fn(js)
+        secs = time.time() - secsStart
+        if secsBest is None or secs < secsBest:
+            secsBest = secs
+    return len(js) / secsBest / 1e6
+
+def main(repeat=3):
+    rgScripts = []
+    for sPath in test.corpus():
+        file = open(sPath, 'rb')
+        try:
+            js = file.read()
+        finally:
+            file.close()
+        if not test.minified(jsmin.jsmin, js).startswith('Unterminated'):
+            rgScripts.append(js)
+    js = '\n'.join(rgScripts)
+    print "Corpus: %d files, %d bytes" % (len(rgScripts), len(js))
+    for sName, fn in (("jsmin.jsmin", jsmin.jsmin), ("minify.minify", minify.minify)):
+        print "%-20s %8.2f MB/sec" % (sName, throughput(fn, js, repeat))
+
+if __name__ == '__main__':
+    repeat = 3
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+    main(repeat)
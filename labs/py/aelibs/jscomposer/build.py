@@ -0,0 +1,116 @@
+"""
+Build-time script bundling for jscomposer.
+
+Minifies each SCRIPT_ALIASES bundle into SCRIPT_BUILD_DIR as <alias>-<content hash>.js, and
+writes manifest.json (alias -> file name) for ScriptIncludes.  Built files from earlier builds
+are removed.  With SCRIPT_SOURCE_MAP set, each bundle's source map is written next to it
+(<alias>-<content hash>.js.map).
+
+Usage (from the application directory, so settings can be imported):
+
+    python jscomposer/build.py [alias ...]
+    python jscomposer/build.py --watch [alias ...]
+
+With --watch, the bundles are built and then rebuilt whenever one of their files changes
+(every SCRIPT_WATCH_SECS seconds, default 1) - only the changed files are minified again.
+"""
+
+import os
+import sys
+import time
+import logging
+from hashlib import sha1
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+sys.path.insert(0, os.getcwd())
+
+import settings
+import simplejson
+
+try:
+    # The jscomposer package (in the application directory) - its module has the build functions
+    from jscomposer import jscomposer
+except ImportError:
+    # Run from the jscomposer directory
+    import jscomposer
+
+cchHash = 12
+
+def built_name(alias, sScript):
+    """ File name of a bundle - changes whenever its content does """
+    return "%s-%s.js" % (alias, sha1(sScript).hexdigest()[:cchHash])
+
+def build(aliases=None, dirBuild=None):
+    """ Build the bundles (default: all SCRIPT_ALIASES) - returns the manifest """
+    if dirBuild is None:
+        dirBuild = jscomposer.build_dir()
+    if not os.path.isdir(dirBuild):
+        os.makedirs(dirBuild)
+
+    if aliases is None:
+        aliases = sorted(settings.SCRIPT_ALIASES.keys())
+        mManifest = {}
+    else:
+        # A partial build keeps the other bundles
+        mManifest = dict(jscomposer.manifest(reload=True))
+    for alias in aliases:
+        secsStart = time.time()
+        if getattr(settings, 'SCRIPT_SOURCE_MAP', False):
+            sScript, smap = jscomposer.compose_map(settings.SCRIPT_ALIASES[alias], None)
+            sFile = built_name(alias, sScript)
+            smap.sFile = sFile
+            write_file(os.path.join(dirBuild, sFile + '.map'), smap.dumps(sScript))
+            sScript += jscomposer.SCRIPT_MAP_COMMENT % (sFile + '.map')
+        else:
+            sScript = jscomposer.compose(settings.SCRIPT_ALIASES[alias])
+            sFile = built_name(alias, sScript)
+        write_file(os.path.join(dirBuild, sFile), sScript)
+        mManifest[alias] = sFile
+        logging.info("Built %s (%d bytes, %.2f secs)" % (sFile, len(sScript), time.time() - secsStart))
+
+    # Remove bundles no longer in the manifest
+    setBuilt = set(mManifest.values())
+    for sFile in os.listdir(dirBuild):
+        if sFile.endswith('.js.map') and sFile[:-4] not in setBuilt or \
+           sFile.endswith('.js') and sFile not in setBuilt:
+            os.remove(os.path.join(dirBuild, sFile))
+
+    write_file(os.path.join(dirBuild, 'manifest.json'), simplejson.dumps(mManifest, sort_keys=True, indent=2))
+    return mManifest
+
+def write_file(sPath, s):
+    file = open(sPath, 'wb')
+    try:
+        file.write(s)
+    finally:
+        file.close()
+
+def watch(aliases=None, dirBuild=None, secs=None):
+    """ Build the bundles, then rebuild each one when any of its files change (until interrupted) """
+    if secs is None:
+        secs = getattr(settings, 'SCRIPT_WATCH_SECS', 1.0)
+    build(aliases, dirBuild)
+    if aliases is None:
+        aliases = sorted(settings.SCRIPT_ALIASES.keys())
+    while True:
+        time.sleep(secs)
+        setChanged = set()
+        for alias in aliases:
+            setChanged.update(jscomposer.changed_files(settings.SCRIPT_ALIASES[alias]))
+        if not setChanged:
+            continue
+        logging.info("Changed: %s" % ', '.join(sorted(setChanged)))
+        build([alias for alias in aliases if setChanged.intersection(settings.SCRIPT_ALIASES[alias])],
+              dirBuild)
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    rgArgs = sys.argv[1:]
+    if '--watch' in rgArgs:
+        rgArgs.remove('--watch')
+        try:
+            watch(rgArgs or None)
+        except KeyboardInterrupt:
+            pass
+    else:
+        build(rgArgs or None)
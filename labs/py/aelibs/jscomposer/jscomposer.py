@@ -7,7 +7,7 @@ jscomposer - Manage JavaScript includes and composing multiple files into one.
     
     - Generates <script> includes with version stamps to avoid cache conflicts.
     - You can define aliases for multiple javascript files to be included into one file
-    - Minifies JavaScript files when not in DEBUG mode
+    - Minifies JavaScript files when not in DEBUG mode (minify.py - same output as jsmin.py)
     - Stores minified script files in memcache for faster serving
     
 Usage:
@@ -68,23 +68,110 @@ Usage:
     versions.
     
     Note that the base name of a script file CANNOT have a '-' character embedded in it.
+    
+Build-time bundles:
+
+    Each SCRIPT_ALIASES bundle can be minified ahead of time (from the application directory):
+    
+        python jscomposer/build.py
+        
+    This writes <alias>-<content hash>.js files and a manifest.json to SCRIPT_BUILD_DIR (default
+    SCRIPT_DIR/build).  When SCRIPT_COMBINE is set (and SCRIPT_DEBUG is not) and the manifest
+    exists, script_includes refers to the built files (under SCRIPT_BUILD_URL - default
+    /scripts/build/).  Their names change whenever their content does, so they can be served
+    as static files that never expire - in app.yaml (before the scripts handler):
+    
+        - url: /scripts/build
+          static_dir: scripts/build
+          expiration: 365d
+
+Per-file minification:
+
+    Minified files are kept (in each instance) by path, and re-minified only when the file's
+    modification time AND content have changed - combined scripts are joined from these pieces.
+    Minified text is also cached in memcache (for a week) by content hash, so instances (and
+    new versions) re-use pieces for unchanged files.  During development:
+    
+        python jscomposer/build.py --watch
+        
+    rebuilds the bundles containing each changed file (re-minifying only that file) - checked
+    every SCRIPT_WATCH_SECS (default 1) seconds.
+
+Conditional and compressed responses:
+
+    Each script is cached with a gzip-compressed copy and a strong ETag (a hash of the
+    script).  Requests with a matching If-None-Match get a 304 (Not Modified) response, and
+    clients which accept gzip get the compressed copy.  Set SCRIPT_GZIP = False if the server
+    (or a middleware) compresses responses itself.
+
+Source maps:
+
+    Set SCRIPT_SOURCE_MAP = True to map minified (and combined) scripts back to their files -
+    browsers then show the original file, line and column (e.g., in stack traces) while the
+    minified script is served.  Each minified script ends with a sourceMappingURL comment
+    for name-<version>-0.js.map (including the original files) - in urls.py add:
+
+        (jscomposer.ScriptMapPattern(), jscomposer.ScriptMap),
+
+    ScriptMap raises Http404 unless SCRIPT_SOURCE_MAP is set.  A script and its map are made
+    by the same minification, and cached (SCRIPT_CACHE) together.  Each file's minified text
+    and map are kept (and cached by content hash) as for minified files.  Built bundles get an
+    <alias>-<content hash>.js.map file next to them.
 
 """
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
 from django.http import Http404
 from django.utils import safestring
-
-from google.appengine.api import memcache
+from django.utils.http import http_date
 
 import os.path
+import time
+import zlib
 import logging
+import simplejson
+from hashlib import sha1
 
 import settings
-import jsmin
+import cache
+import minify
+import sourcemap
 
 # Script url names use the base name, version number, and debug mode
 SCRIPT_INC_PATTERN = r'<script src="/scripts/%s-%s-%d.js"></script>'
 SCRIPT_URL_PATTERN = r'^scripts/(?P<name>%s)(-(?P<version>.+)-(?P<debug>[01]))?.js$'
+SCRIPT_BUILT_PATTERN = r'<script src="%s%s"></script>'
+SCRIPT_MAP_URL_PATTERN = r'^scripts/(?P<name>%s)-(?P<version>.+)-0.js.map$'
+SCRIPT_MAP_COMMENT = '\n//# sourceMappingURL=%s\n'
+
+# Limit memcache to 1 hour in case script version not incremented!  (Clients keep scripts and
+# their maps for 30 days)
+SCRIPT_CACHE_SECS = 3600
+
+# Part of the (memcache) key of minified files - increment when minify's output changes
+MINIFY_VERSION = 1
+FILE_CACHE_SECS = 7*24*3600
+
+def build_dir():
+    return getattr(settings, 'SCRIPT_BUILD_DIR', os.path.join(settings.SCRIPT_DIR, 'build').replace('\\', '/'))
+
+def build_url():
+    return getattr(settings, 'SCRIPT_BUILD_URL', '/scripts/build/')
+
+def manifest(reload=False):
+    """ Return the build manifest (alias -> built file name) - empty if there is no build """
+    global _manifest
+    if _manifest is None or reload:
+        try:
+            file = open(os.path.join(build_dir(), 'manifest.json'), 'r')
+            try:
+                _manifest = simplejson.loads(file.read())
+            finally:
+                file.close()
+        except IOError:
+            _manifest = {}
+    return _manifest
+
+_manifest = None
 
 def GetContext(req):
     """ Add script_includes variable to render context. """
@@ -95,8 +182,18 @@ class ScriptIncludes():
     Return <script> tag(s) to include the file or alias.
 
     {{ script_includes.alias }}} -> <script src="/scripts/alias-V-D.js"></script>
+    
+    or, for a built bundle:
+    
+    {{ script_includes.alias }}} -> <script src="/scripts/build/alias-HASH.js"></script>
     """
     def __getattr__(self, alias):
+        # Debug scripts are never the (minified) built bundles
+        if settings.SCRIPT_COMBINE and not settings.SCRIPT_DEBUG:
+            sFile = manifest().get(alias)
+            if sFile is not None:
+                return safestring.SafeString(SCRIPT_BUILT_PATTERN % (build_url(), sFile))
+            
         if settings.SCRIPT_COMBINE or alias not in settings.SCRIPT_ALIASES:
             s = SCRIPT_INC_PATTERN % (alias, settings.SCRIPT_VERSION, settings.SCRIPT_DEBUG)
             return safestring.SafeString(s)
@@ -112,6 +209,12 @@ def ScriptPattern(name=None):
         name = r'[a-zA-Z0-9_]+'
     return SCRIPT_URL_PATTERN % name
     
+def ScriptMapPattern(name=None):
+    """ For use in urls.py for source map url patterns. """
+    if name is None:
+        name = r'[a-zA-Z0-9_]+'
+    return SCRIPT_MAP_URL_PATTERN % name
+
 def ScriptFile(req, debug=None, version=None, name=None, files=None):
     """ Return the body of the selected script file (or alias)
     
@@ -130,47 +233,258 @@ def ScriptFile(req, debug=None, version=None, name=None, files=None):
     if version is None:
         version = settings.SCRIPT_VERSION
     
-    sMemKey = 'jscompose-%s-%s-%d' % (name, version, debug)
-    
-    if files is None:
-        # Found an alias - include component files
-        if name in settings.SCRIPT_ALIASES:
-            files = settings.SCRIPT_ALIASES[name]
-        # No alias - assume this is a singe javascript file
-        else:
-            files = [name]
+    sMemKey = 'bundle-%s-%s-%d' % (name, version, debug)
+    files = script_files(name, files)
     
-    sScript = None
+    entry = None
     if settings.SCRIPT_CACHE:
         req.SetCacheTime(30*24*3600)
-        sScript = memcache.get(sMemKey)
+        entry = _cache().get(sMemKey)
     else:
         req.SetCacheTime(0)
     
-    if sScript is None:
+    if entry is None:
         # We only have the latest version of the script available if not already in memcache
         if version != settings.SCRIPT_VERSION:
             raise Http404
-        sMemKey = 'jscompose-%s-%s-%d' % (name, settings.SCRIPT_VERSION, debug)
-        sScript = ''    
-        for name in files:
+        if not debug and getattr(settings, 'SCRIPT_SOURCE_MAP', False):
+            entry, sMap = compose_entries(name, files)
+        else:
+            entry = script_entry(compose(files, debug))
+            if settings.SCRIPT_CACHE:
+                sMemKey = 'bundle-%s-%s-%d' % (name, settings.SCRIPT_VERSION, debug)
+                logging.info("caching script %s" % sMemKey)
+                _cache().set(sMemKey, entry, SCRIPT_CACHE_SECS)
+
+    return script_response(req, entry)
+
+def ScriptMap(req, version=None, name=None, files=None):
+    """ Return the source map of the minified script file (or alias) """
+    # The map includes the original files - only served when enabled
+    if not getattr(settings, 'SCRIPT_SOURCE_MAP', False):
+        raise Http404
+
+    if version is None:
+        version = settings.SCRIPT_VERSION
+
+    sMemKey = 'map-%s-%s' % (name, version)
+    files = script_files(name, files)
+
+    sMap = None
+    if settings.SCRIPT_CACHE:
+        req.SetCacheTime(30*24*3600)
+        sMap = _cache().get(sMemKey)
+    else:
+        req.SetCacheTime(0)
+
+    if sMap is None:
+        if version != settings.SCRIPT_VERSION:
+            raise Http404
+        entry, sMap = compose_entries(name, files)
+
+    return HttpResponse(sMap, mimetype="application/json")
+
+def compose_entries(name, files):
+    """
+    Return the (minified) script entry and the source map of a script - from one minification,
+    and cached together (so a script is never served with the map of another).
+    """
+    sScript, smap = compose_map(files, '%s-%s-0.js' % (name, settings.SCRIPT_VERSION))
+    sMap = smap.dumps(sScript)
+    entry = script_entry(sScript + SCRIPT_MAP_COMMENT % map_name(name, settings.SCRIPT_VERSION))
+    if settings.SCRIPT_CACHE:
+        sMemKey = 'bundle-%s-%s-0' % (name, settings.SCRIPT_VERSION)
+        logging.info("caching script %s (and source map)" % sMemKey)
+        _cache().set_multi({sMemKey: entry,
+                            'map-%s-%s' % (name, settings.SCRIPT_VERSION): sMap},
+                           SCRIPT_CACHE_SECS)
+    return entry, sMap
+
+def script_files(name, files=None):
+    """ The files of a script - listed in urls.py, an alias or the single named file """
+    if files is not None:
+        return files
+    # Found an alias - include component files
+    if name in settings.SCRIPT_ALIASES:
+        return settings.SCRIPT_ALIASES[name]
+    # No alias - assume this is a singe javascript file
+    return [name]
+
+def map_name(name, version):
+    return '%s-%s-0.js.map' % (name, version)
+
+def script_entry(sScript):
+    """ Return the cached form of a script: (script, gzipped script or None, ETag, modified time) """
+    sGzip = None
+    if getattr(settings, 'SCRIPT_GZIP', True):
+        # zlib (rather than gzip.GzipFile) - no time stamp in the header, so the bytes (and ETag)
+        # are the same on every instance
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        sGzip = compressor.compress(sScript) + compressor.flush()
+    return (sScript, sGzip, '"%s"' % sha1(sScript).hexdigest(), time.time())
+
+def script_response(req, entry):
+    """ Return the script - compressed if accepted, or 304 if the client has it already """
+    sScript, sGzip, sETag, secsModified = entry
+    fGzip = sGzip is not None and accepts_gzip(req)
+    if fGzip:
+        # Each encoding is a different representation - with its own strong ETag
+        sETag = sETag[:-1] + '-gz"'
+
+    rgETags = etags_from_header(req.META.get('HTTP_IF_NONE_MATCH', ''))
+    if sETag in rgETags or '*' in rgETags:
+        resp = HttpResponseNotModified()
+    elif fGzip:
+        resp = HttpResponse(sGzip, mimetype="application/x-javascript")
+        resp['Content-Encoding'] = 'gzip'
+    else:
+        resp = HttpResponse(sScript, mimetype="application/x-javascript")
+    resp['ETag'] = sETag
+    resp['Last-Modified'] = http_date(secsModified)
+    if sGzip is not None:
+        resp['Vary'] = 'Accept-Encoding'
+    return resp
+
+def accepts_gzip(req):
+    """ True if the Accept-Encoding header includes gzip (without q=0) """
+    for sPart in req.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        rgParams = [sParam.strip() for sParam in sPart.split(';')]
+        if rgParams[0].lower() not in ('gzip', 'x-gzip'):
+            continue
+        for sParam in rgParams[1:]:
+            if sParam.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                return False
+        return True
+    return False
+
+def etags_from_header(sHeader):
+    """ Return the list of ETags in an If-None-Match header (any weak prefix removed) """
+    rgETags = []
+    for sETag in sHeader.split(','):
+        sETag = sETag.strip()
+        if sETag.startswith('W/'):
+            sETag = sETag[2:]
+        if sETag:
+            rgETags.append(sETag)
+    return rgETags
+
+def compose(files, debug=False):
+    """ Return the combined script of the named files (minified unless debug) """
+    rgScripts = []
+    for name in files:
+        if debug:
+            rgScripts.append("/* ---------- %s.js ---------- */\n" % name)
+        try:
             if debug:
-                sScript += "/* ---------- %s.js ---------- */\n" % name
-            try:
-                file = open(os.path.join(settings.SCRIPT_DIR, '%s.js' % name).replace('\\', '/'), 'r')
-                sT = file.read() + '\n'
+                sT = read_file(name)
+            else:
+                sT = minified_file(name)
+            rgScripts.append(sT)
+        except Exception, e:
+            rgScripts.append("/* Error loading file: %s.js (%r) */\n" % (name, e))
+    return ''.join(rgScripts)
 
-                if not debug:
-                    sT  = jsmin.jsmin(sT)
-                sScript += sT
-                file.close()
-            except Exception, e:
-                sScript += "/* Error loading file: %s.js (%r) */\n" % (name, e)
+def compose_map(files, sFile):
+    """ Return the minified script of the named files, and its sourcemap.SourceMap """
+    smap = sourcemap.SourceMap(sFile)
+    rgScripts = []
+    offset = 0
+    for name in files:
+        try:
+            sT, sMin, rgMap = minified_map_file(name)
+            smap.add('%s.js' % name, sT, rgMap, offset, len(sMin))
+        except Exception, e:
+            sMin = "/* Error loading file: %s.js (%r) */\n" % (name, e)
+        rgScripts.append(sMin)
+        offset += len(sMin)
+    return ''.join(rgScripts), smap
+
+def script_path(name):
+    return os.path.join(settings.SCRIPT_DIR, '%s.js' % name).replace('\\', '/')
+
+def read_file(name):
+    file = open(script_path(name), 'r')
+    try:
+        return file.read() + '\n'
+    finally:
+        file.close()
+
+def minified_file(name):
+    """ Return the minified script file - minified again only if its content has changed """
+    return _file_entry(name, False)[2]
+
+def minified_map_file(name):
+    """ Return the script file, its minified script and map (see minify.minify_map) - as minified_file """
+    entry = _file_entry(name, True)
+    return entry[3], entry[2], entry[4]
+
+def _file_entry(name, fMap):
+    # Return the _mMinified entry of a file (with its source and map, if fMap)
+    sPath = script_path(name)
+    mtime = os.path.getmtime(sPath)
+    entry = _mMinified.get(sPath)
+    if entry is None or entry[0] != mtime or fMap and not _has_map(entry):
+        sT = read_file(name)
+        sHash = sha1(sT).hexdigest()
+        if entry is not None and entry[1] == sHash and (not fMap or _has_map(entry)):
+            entry = (mtime,) + entry[1:]
+        else:
+            value = _minify_file(name, sT, sHash, fMap)
+            if fMap and not isinstance(value, Exception):
+                entry = (mtime, sHash, value[0], sT, value[1])
+            else:
+                entry = (mtime, sHash, value, None, None)
+        _mMinified[sPath] = entry
+    # A file which can't be minified is not tried again until it changes
+    if isinstance(entry[2], Exception):
+        raise entry[2]
+    return entry
+
+def _has_map(entry):
+    return entry[4] is not None or isinstance(entry[2], Exception)
+
+def _minify_file(name, sT, sHash, fMap=False):
+    # Return the minified script (and its map, if fMap) - or the exception raised minifying it
+    if fMap:
+        sKey = 'jsmap-%d-%s' % (MINIFY_VERSION, sHash)
+    else:
+        sKey = 'jsmin-%d-%s' % (MINIFY_VERSION, sHash)
+    value = _cache_files().get(sKey)
+    if value is None:
+        secsStart = time.time()
+        try:
+            if fMap:
+                value = minify.minify_map(sT)
+                sMin = value[0]
+            else:
+                value = sMin = minify.minify(sT)
+        except Exception, e:
+            logging.warning("can't minify %s.js (%r)" % (name, e))
+            return e
+        logging.info("minified %s.js (%d bytes, %.3f secs)" % (name, len(sMin), time.time() - secsStart))
+        _cache_files().set(sKey, value, FILE_CACHE_SECS)
+    return value
+
+def changed_files(files):
+    """ Return the names of the files modified since they were last minified """
+    rgChanged = []
+    for name in files:
+        entry = _mMinified.get(script_path(name))
+        try:
+            if entry is None or entry[0] != os.path.getmtime(script_path(name)):
+                rgChanged.append(name)
+        except OSError:
+            rgChanged.append(name)
+    return rgChanged
+
+# Script path -> (mtime, content hash, minified script or the exception minifying it,
+#                 source and map - None until a source map is made)
+_mMinified = {}
 
-        if settings.SCRIPT_CACHE:
-            logging.info("caching script %s" % sMemKey)
-            # Limit memcache to 1 hour in case script version not incremented!
-            memcache.set(sMemKey, sScript, 3600)
-            # Keep the file in client caches for 30 days
+def _cache():
+    # Script bodies don't change for a given version - serve them from memory
+    return cache.get_cache('jscompose', local_items=50, local_secs=3600)
 
-    return HttpResponse(sScript, mimetype="application/x-javascript")
+def _cache_files():
+    # Minified files by content hash - the same for every version
+    return cache.get_cache('jscompose.file')
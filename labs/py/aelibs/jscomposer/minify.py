@@ -0,0 +1,208 @@
+"""
+Buffer-based JavaScript minifier - output is identical to jsmin.jsmin.
+
+jsmin.JavascriptMinify reads one character at a time from a StringIO and makes several
+method calls per character.  This engine runs the same state machine over the whole
+source string (control characters are translated up front), but:
+
+    - string literals, regular expression literals and comments are matched with compiled
+      regular expressions (or str.find) in one step
+    - runs of characters which are copied unchanged (identifiers, numbers, punctuation) are
+      copied as one slice
+    - output is collected in a list and joined once
+
+Usage:
+
+    import minify
+    sMin = minify.minify(sScript)
+    sMin, rgMap = minify.minify_map(sScript)
+
+minify_map also returns the source offset of the minified text: a list of (output offset,
+source offset) pairs - each starting a run of output copied from consecutive source
+characters (see sourcemap.py).
+
+The jsmin exceptions (UnterminatedComment, UnterminatedStringLiteral,
+UnterminatedRegularExpression) are raised for the same inputs.
+"""
+
+import re
+import string
+
+import jsmin
+
+# Carriage return -> linefeed, other control characters -> space (as jsmin._get)
+_table = ''.join([chr(i) < ' ' and (chr(i) == '\r' and '\n' or chr(i) == '\n' and '\n' or ' ')
+                  or chr(i) for i in range(256)])
+
+EOF = '\000'
+
+# The body of a string (after the opening quote) up to and including the closing quote
+_regStrings = {
+    "'": re.compile(r"((?:[^'\\\n\000]|\\[\s\S])*)'"),
+    '"': re.compile(r'((?:[^"\\\n\000]|\\[\s\S])*)"'),
+    }
+
+# The body of a regular expression literal (after the opening /) and the closing /
+_regRegExp = re.compile(r"((?:[^/\\\n\000]|\\[\s\S])*)/")
+
+# Characters copied unchanged when between two other such characters
+_regRun = re.compile(r"[^ \n/'\"\000]*")
+
+# Characters after which a / starts a regular expression
+_setRegExpPrefix = frozenset('(,=:[?!&|;{}\n')
+
+# Characters which (after a linefeed) keep the linefeed
+_setKeepAfter = frozenset('{[(+-')
+_setKeepBefore = frozenset('}])+-"\'')
+
+_setAlphanum = frozenset(string.ascii_letters + string.digits + '_$\\' +
+                         ''.join([chr(i) for i in range(127, 256)]))
+
+def minify(js):
+    """ Return the minified script (same as jsmin.jsmin) """
+    if not isinstance(js, str):
+        return jsmin.jsmin(js)
+    rgOut, rgPos = _minify(js)
+    sMin = ''.join(rgOut)
+    if sMin[:1] == '\n':
+        sMin = sMin[1:]
+    return sMin
+
+def minify_map(js):
+    """ Return the minified script and its (output offset, source offset) map """
+    rgOut, rgPos = _minify(js)
+    sMin = ''.join(rgOut)
+    offset = 0
+    if sMin[:1] == '\n':
+        sMin = sMin[1:]
+        offset = -1
+    rgMap = []
+    for s, pos in zip(rgOut, rgPos):
+        if s:
+            # Start a new run unless this text directly follows the previous run in the source
+            if offset >= 0 and (not rgMap or offset - rgMap[-1][0] != pos - rgMap[-1][1]):
+                rgMap.append((offset, pos))
+            offset += len(s)
+    return sMin, rgMap
+
+def _minify(js):
+    # Return the list of output strings - and the source offset of each
+    text = js.translate(_table) + EOF
+    n = len(text)
+    rgOut = []
+    rgPos = []
+    out = rgOut.append
+    pos = rgPos.append
+    setAlphanum = _setAlphanum
+    matchRun = _regRun.match
+
+    def next(A, i):
+        # The next character (a comment is returned as ' ', or the linefeed ending it) - the
+        # returned character is at (or, for a comment, ends at) i - 1
+        if i >= n:
+            return EOF, i
+        c = text[i]
+        i += 1
+        if c == '/' and A != '\\':
+            p = text[i:i+1]
+            if p == '/':
+                k = text.find('\n', i)
+                if k < 0:
+                    return EOF, n
+                return '\n', k + 1
+            if p == '*':
+                k = text.find('*/', i + 1)
+                if k < 0:
+                    raise jsmin.UnterminatedComment()
+                return ' ', k + 2
+        return c, i
+
+    def regexp(A, iA, i):
+        # Copy a regular expression literal (B is the opening /) - returns A, iA, B and i
+        out(A)
+        pos(iA)
+        out('/')
+        pos(i - 1)
+        m = _regRegExp.match(text, i)
+        if m is None:
+            raise jsmin.UnterminatedRegularExpression()
+        out(m.group(1))
+        pos(i)
+        B, i = next('/', m.end())
+        return '/', m.end() - 1, B, i
+
+    # iA is the source offset of A
+    A = '\n'
+    iA = 0
+    B, i = next(A, 0)
+    if B == '/' and A in _setRegExpPrefix:
+        A, iA, B, i = regexp(A, iA, i)
+
+    while A != EOF:
+        # Choose the action (as jsmin._jsmin)
+        if A == ' ':
+            if B in setAlphanum:
+                action = 1
+            else:
+                action = 2
+        elif A == '\n':
+            if B in _setKeepAfter:
+                action = 1
+            elif B == ' ':
+                action = 3
+            elif B in setAlphanum:
+                action = 1
+            else:
+                action = 2
+        elif B == ' ':
+            if A in setAlphanum:
+                action = 1
+            else:
+                action = 3
+        elif B == '\n':
+            if A in _setKeepBefore or A in setAlphanum:
+                action = 1
+            else:
+                action = 3
+        else:
+            action = 1
+            if B not in '\'"/\000':
+                # Both A and B are copied - so is the run of ordinary characters after B
+                m = matchRun(text, i)
+                end = m.end()
+                if end > i:
+                    out(A)
+                    pos(iA)
+                    out(B)
+                    pos(i - 1)
+                    out(text[i:end - 1])
+                    pos(i)
+                    A = text[end - 1]
+                    iA = end - 1
+                    B, i = next(A, end)
+                    if B == '/' and A in _setRegExpPrefix:
+                        A, iA, B, i = regexp(A, iA, i)
+                    continue
+
+        # Perform the action (as jsmin._action)
+        if action == 1:
+            out(A)
+            pos(iA)
+        if action <= 2:
+            A = B
+            iA = i - 1
+            if A == "'" or A == '"':
+                m = _regStrings[A].match(text, i)
+                if m is None:
+                    raise jsmin.UnterminatedStringLiteral()
+                out(A)
+                pos(iA)
+                out(m.group(1))
+                pos(i)
+                i = m.end()
+                iA = i - 1
+        B, i = next(A, i)
+        if B == '/' and A in _setRegExpPrefix:
+            A, iA, B, i = regexp(A, iA, i)
+
+    return rgOut, rgPos
@@ -0,0 +1,131 @@
+"""
+Source maps (revision 3) for minified and combined scripts.
+
+Usage:
+
+    smap = sourcemap.SourceMap('bundle.js')
+    for each source file:
+        sMin, rgMap = minify.minify_map(sSource)
+        smap.add('file.js', sSource, rgMap, offset, len(sMin))    # offset of sMin in the bundle
+    sJSON = smap.dumps(sBundle)
+
+Each (output offset, source offset) pair in rgMap starts a run of output copied from
+consecutive source characters - runs are split at each line of the bundle.  The original
+files are included (sourcesContent), so no other files need to be served.
+
+Columns are counted in characters of the (byte string) script - the same as UTF-16 columns
+for ASCII scripts.
+"""
+
+import re
+import bisect
+
+import simplejson
+
+BASE64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+_regNewline = re.compile(r'\r\n|\r|\n')
+
+# simplejson writes '<' as \x3c (for JSON in <script> tags) - not valid JSON (an escaped
+# backslash before 'x3c' is left alone)
+_regHexEscape = re.compile(r'(?<!\\)((?:\\\\)*)\\x3c')
+
+def vlq(n):
+    """ Base 64 VLQ encoding of an integer (sign in the lowest bit) """
+    if n < 0:
+        n = ((-n) << 1) | 1
+    else:
+        n <<= 1
+    rgDigits = []
+    while True:
+        digit = n & 31
+        n >>= 5
+        if n:
+            digit |= 32
+        rgDigits.append(BASE64[digit])
+        if not n:
+            return ''.join(rgDigits)
+
+def line_starts(s):
+    """ Offsets of the first character of each line (ended by \\n, \\r\\n or \\r) """
+    rgStarts = [0]
+    for m in _regNewline.finditer(s):
+        rgStarts.append(m.end())
+    return rgStarts
+
+def position(rgStarts, offset):
+    """ (line, column) - from 0 - of an offset, given the line_starts """
+    line = bisect.bisect_right(rgStarts, offset) - 1
+    return line, offset - rgStarts[line]
+
+class SourceMap(object):
+    def __init__(self, sFile):
+        self.sFile = sFile
+        self.rgSources = []
+        self.rgContents = []
+        # (iSource, source text, [(bundle offset, source offset)...], end offset in bundle)
+        self.rgMaps = []
+
+    def add(self, sSource, sContent, rgMap, offset, cch):
+        """
+        Add a source file, whose minified text (of cch characters, with map rgMap from
+        minify.minify_map) is at offset in the bundle.
+        """
+        self.rgSources.append(sSource)
+        self.rgContents.append(sContent)
+        self.rgMaps.append((len(self.rgSources) - 1, sContent,
+                            [(offset + offsetOut, offsetSource) for offsetOut, offsetSource in rgMap],
+                            offset + cch))
+
+    def segments(self, sGenerated):
+        """ Return the sorted (line, column, iSource, source line, source column) segments """
+        rgGenStarts = line_starts(sGenerated)
+        rgSegments = []
+        for iSource, sContent, rgMap, offsetEnd in self.rgMaps:
+            rgSourceStarts = line_starts(sContent)
+            for i, (offsetOut, offsetSource) in enumerate(rgMap):
+                if i + 1 < len(rgMap):
+                    offsetNext = rgMap[i + 1][0]
+                else:
+                    offsetNext = offsetEnd
+                # The run continues at the start of each following line (up to the next run)
+                rgOffsets = [offsetOut]
+                iLine = bisect.bisect_right(rgGenStarts, offsetOut)
+                while iLine < len(rgGenStarts) and rgGenStarts[iLine] < offsetNext:
+                    rgOffsets.append(rgGenStarts[iLine])
+                    iLine += 1
+                for offset in rgOffsets:
+                    rgSegments.append(position(rgGenStarts, offset) + (iSource,) +
+                                      position(rgSourceStarts, offsetSource + offset - offsetOut))
+        rgSegments.sort()
+        return rgSegments
+
+    def mappings(self, sGenerated):
+        """ The encoded mappings field """
+        rgLines = []
+        rgLine = []
+        lineLast = 0
+        colLast = sourceLast = sourceLineLast = sourceColLast = 0
+        for line, col, iSource, sourceLine, sourceCol in self.segments(sGenerated):
+            while lineLast < line:
+                rgLines.append(','.join(rgLine))
+                rgLine = []
+                lineLast += 1
+                colLast = 0
+            rgLine.append(vlq(col - colLast) + vlq(iSource - sourceLast) +
+                          vlq(sourceLine - sourceLineLast) + vlq(sourceCol - sourceColLast))
+            colLast, sourceLast, sourceLineLast, sourceColLast = col, iSource, sourceLine, sourceCol
+        rgLines.append(','.join(rgLine))
+        return ';'.join(rgLines)
+
+    def dumps(self, sGenerated):
+        """ The source map (JSON) for the generated script """
+        sJSON = simplejson.dumps({'version': 3,
+                                 'file': self.sFile,
+                                 'sources': self.rgSources,
+                                 'sourcesContent': [sContent.decode('utf-8', 'replace')
+                                                    for sContent in self.rgContents],
+                                 'names': [],
+                                 'mappings': self.mappings(sGenerated),
+                                 })
+        return _regHexEscape.sub(r'\1\\u003c', sJSON)
@@ -0,0 +1,329 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import unittest
+
+# simplejson (for sourcemap) is in the parent (aelibs) directory
+sys.path.insert(0, '..')
+
+import jsmin
+import minify
+import sourcemap
+
+# Scripts in the repository (labs) are the golden corpus
+dirCorpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+
+def corpus():
+    rgPaths = []
+    for dirPath, rgDirs, rgFiles in os.walk(dirCorpus):
+        for sFile in rgFiles:
+            if sFile.endswith('.js'):
+                rgPaths.append(os.path.join(dirPath, sFile))
+    rgPaths.sort()
+    return rgPaths
+
+def minified(fn, js):
+    # Output - or the name of the exception raised
+    try:
+        return fn(js)
+    except Exception, e:
+        return e.__class__.__name__
+
+class TestMinify(unittest.TestCase):
+    def assertSame(self, js):
+        self.assertEqual(minified(minify.minify, js), minified(jsmin.jsmin, js), repr(js))
+
+    def test_corpus(self):
+        rgPaths = corpus()
+        self.assert_(len(rgPaths) > 0)
+        for sPath in rgPaths:
+            file = open(sPath, 'rb')
+            try:
+                js = file.read()
+            finally:
+                file.close()
+            # (a few scripts use regular expressions jsmin can't parse - both engines must raise)
+            self.assertEqual(minified(minify.minify, js), minified(jsmin.jsmin, js), sPath)
+
+    def test_cases(self):
+        for js in ["", "\n", "a", "var a = 1;\r\nvar b\t= 2;\n",
+                   "x = 'it''s' + \"a \\\"b\\\"\";",
+                   "s = 'line \\\ncontinued';",
+                   "a = b / c / d; r = /[a-z]+\\//g.test(s);",
+                   "f(/x/, a ? /y/ : /z/); return\n/re/;",
+                   "a = 1 // comment\n+ 2; /* block ** comment */ b = a++ + ++c;",
+                   "a = b - -c + +d; e = f\n(g)",
+                   "if (x) {\n  y();\n}\nelse z();",
+                   "\\u0061b = 1; a\\/*not a comment*/",
+                   "s = '\x80\xff'; \x01\x00a",
+                   ]:
+            self.assertSame(js)
+
+    def test_errors(self):
+        for js, cls in [("a = 'unterminated\n';", jsmin.UnterminatedStringLiteral),
+                        ("a = \"unterminated", jsmin.UnterminatedStringLiteral),
+                        ("a = 1; /* unterminated *", jsmin.UnterminatedComment),
+                        ("a = (/unterminated\n/);", jsmin.UnterminatedRegularExpression),
+                        ]:
+            self.assertRaises(cls, jsmin.jsmin, js)
+            self.assertRaises(cls, minify.minify, js)
+
+    def test_random(self):
+        random.seed(21)
+        chars = "ab1 \n\r\t/*'\"\\()=,;{}+-.[]!\x00\x80"
+        for i in xrange(20000):
+            self.assertSame(''.join([random.choice(chars) for j in xrange(random.randint(0, 20))]))
+
+class TestSourceMap(unittest.TestCase):
+    def test_vlq(self):
+        self.assertEqual([sourcemap.vlq(n) for n in (0, 1, -1, 15, 16, -16, 123456)],
+                         ['A', 'C', 'D', 'e', 'gB', 'hB', 'gkxH'])
+
+    def test_runs(self):
+        # Each run of minified text is copied from the source at its offset
+        js = "var a = 1; // one\n/* two */ var b = 'x' + a;\r\nif (b) {\n  c(/re/g);\n}\n"
+        sMin, rgMap = minify.minify_map(js)
+        self.assertEqual(sMin, minify.minify(js))
+        rgEnds = [offset for offset, offsetSource in rgMap[1:]] + [len(sMin)]
+        for (offset, offsetSource), offsetEnd in zip(rgMap, rgEnds):
+            sRun = sMin[offset:offsetEnd]
+            self.assertEqual(sRun, js[offsetSource:offsetSource + len(sRun)])
+
+    def test_segments(self):
+        js = "a = 1\n\n  b = 2\n"
+        sMin, rgMap = minify.minify_map(js)
+        smap = sourcemap.SourceMap('x.js')
+        smap.add('x.js', js, rgMap, 0, len(sMin))
+        # a (line 0) and b (line 2, column 2) start lines 0 and 1 of "a=1\nb=2"
+        self.assertEqual(sMin, "a=1\nb=2")
+        rgSegments = smap.segments(sMin)
+        self.assert_((0, 0, 0, 0, 0) in rgSegments)
+        self.assert_((1, 0, 0, 2, 2) in rgSegments)
+        self.assertEqual(smap.mappings(sMin).split(';')[0][:4], 'AAAA')
+
+class ScriptDirTest(unittest.TestCase):
+    """
+    A temporary SCRIPT_DIR, an empty file cache and counted minify calls - jscomposer needs
+    Django and the application settings (on the path), imported by these tests only.
+    """
+    rgSettings = ('SCRIPT_DIR', 'SCRIPT_ALIASES', 'SCRIPT_SOURCE_MAP')
+
+    def setUp(self):
+        import settings
+        import cache
+        import build
+        self.settings = settings
+        self.build = build
+        self.jscomposer = build.jscomposer
+        self.mSaved = dict([(sName, getattr(settings, sName, _missing)) for sName in self.rgSettings])
+        self.dirScripts = tempfile.mkdtemp()
+        settings.SCRIPT_DIR = self.dirScripts
+        settings.SCRIPT_SOURCE_MAP = False
+
+        self.cacheFiles = cache.Cache('jscompose.file', client=cache.LocalMemcache())
+        self.rgRestore = [(self.jscomposer, '_cache_files', self.jscomposer._cache_files)]
+        self.jscomposer._cache_files = lambda: self.cacheFiles
+        self.jscomposer._mMinified.clear()
+
+        # Source text of each call of minify.minify and minify.minify_map
+        self.rgMinified = []
+        for sName in ('minify', 'minify_map'):
+            self.rgRestore.append((self.jscomposer.minify, sName, getattr(self.jscomposer.minify, sName)))
+            setattr(self.jscomposer.minify, sName, self.counted(getattr(self.jscomposer.minify, sName)))
+
+    def tearDown(self):
+        for obj, sName, value in self.rgRestore:
+            setattr(obj, sName, value)
+        for sName, value in self.mSaved.items():
+            if value is _missing:
+                if hasattr(self.settings, sName):
+                    delattr(self.settings, sName)
+            else:
+                setattr(self.settings, sName, value)
+        self.jscomposer._mMinified.clear()
+        shutil.rmtree(self.dirScripts)
+
+    def counted(self, fn):
+        def _counted(js):
+            self.rgMinified.append(js)
+            return fn(js)
+        return _counted
+
+    def write_script(self, name, js, mtime=None):
+        sPath = os.path.join(self.dirScripts, name + '.js')
+        self.build.write_file(sPath, js)
+        if mtime is not None:
+            os.utime(sPath, (mtime, mtime))
+
+    def read(self, sPath):
+        file = open(sPath, 'rb')
+        try:
+            return file.read()
+        finally:
+            file.close()
+
+_missing = object()
+
+class TestBuild(ScriptDirTest):
+    rgScripts = ["var a = 1; // one\n", "function b(x) {\n  return x + a;\n}\n"]
+
+    def setUp(self):
+        ScriptDirTest.setUp(self)
+        for sName, js in zip(['a', 'b'], self.rgScripts):
+            self.write_script(sName, js, 1000)
+        self.settings.SCRIPT_ALIASES = {'ab': ['a', 'b']}
+        self.dirBuild = os.path.join(self.dirScripts, 'build')
+
+    def test_build(self):
+        import simplejson
+
+        mManifest = self.build.build(dirBuild=self.dirBuild)
+        sFile = mManifest['ab']
+        self.assertEqual(sorted(os.listdir(self.dirBuild)), sorted(['manifest.json', sFile]))
+        self.assertEqual(self.read(os.path.join(self.dirBuild, sFile)),
+                         ''.join([jsmin.jsmin(js + '\n') for js in self.rgScripts]))
+        self.assertEqual(simplejson.loads(self.read(os.path.join(self.dirBuild, 'manifest.json'))),
+                         mManifest)
+
+    def test_build_source_map(self):
+        import simplejson
+        self.settings.SCRIPT_SOURCE_MAP = True
+
+        sFile = self.build.build(dirBuild=self.dirBuild)['ab']
+        self.assertEqual(sorted(os.listdir(self.dirBuild)), sorted(['manifest.json', sFile, sFile + '.map']))
+        sScript = self.read(os.path.join(self.dirBuild, sFile))
+        self.assert_(sScript.startswith(''.join([jsmin.jsmin(js + '\n') for js in self.rgScripts])))
+        mMap = simplejson.loads(self.read(os.path.join(self.dirBuild, sFile + '.map')))
+        self.assertEqual(mMap['sources'], ['a.js', 'b.js'])
+        self.assertEqual(len(self.rgMinified), 2)
+
+        # The files (and maps) are kept - watch sees no changes, and a rebuild minifies nothing
+        self.assertEqual(self.jscomposer.changed_files(['a', 'b']), [])
+        self.build.build(dirBuild=self.dirBuild)
+        self.assertEqual(len(self.rgMinified), 2)
+
+    def test_watch(self):
+        self.settings.SCRIPT_SOURCE_MAP = True
+        rgBuilds = []
+        fnBuild = self.build.build
+        def build(aliases=None, dirBuild=None):
+            rgBuilds.append(aliases)
+            return fnBuild(aliases, dirBuild)
+        rgTicks = []
+        def sleep(secs):
+            rgTicks.append(secs)
+            if len(rgTicks) == 3:
+                self.write_script('b', "var b = 2;\n", 2000)
+            elif len(rgTicks) == 5:
+                raise KeyboardInterrupt()
+        self.rgRestore.extend([(self.build, 'build', fnBuild), (self.build.time, 'sleep', time.sleep)])
+        self.build.build = build
+        self.build.time.sleep = sleep
+
+        self.assertRaises(KeyboardInterrupt, self.build.watch, None, self.dirBuild, 1)
+        # The first build, and one (of only the changed file) after it changed
+        self.assertEqual(rgBuilds, [None, ['ab']])
+        self.assertEqual(self.rgMinified, [js + '\n' for js in self.rgScripts] + ["var b = 2;\n\n"])
+
+class TestMinifiedFile(ScriptDirTest):
+    def test_mtime(self):
+        self.write_script('a', "var a = 1;", 1000)
+        self.assertEqual(self.jscomposer.minified_file('a'), "var a=1;")
+        self.assertEqual(self.jscomposer.minified_file('a'), "var a=1;")
+        self.assertEqual(len(self.rgMinified), 1)
+        # A changed file is minified again
+        self.write_script('a', "var a = 2;", 2000)
+        self.assertEqual(self.jscomposer.changed_files(['a']), ['a'])
+        self.assertEqual(self.jscomposer.minified_file('a'), "var a=2;")
+        self.assertEqual(self.jscomposer.changed_files(['a']), [])
+        self.assertEqual(len(self.rgMinified), 2)
+
+    def test_same_content(self):
+        self.write_script('a', "var a = 1;", 1000)
+        sMin = self.jscomposer.minified_file('a')
+        # Touched (same content) - the minified text is kept
+        self.write_script('a', "var a = 1;", 2000)
+        self.assertEqual(self.jscomposer.changed_files(['a']), ['a'])
+        self.assertEqual(self.jscomposer.minified_file('a'), sMin)
+        self.assertEqual(self.jscomposer.changed_files(['a']), [])
+        self.assertEqual(len(self.rgMinified), 1)
+
+    def test_file_cache(self):
+        # Another instance (or version) finds the minified text by content hash
+        self.write_script('a', "var a = 1;", 1000)
+        sMin = self.jscomposer.minified_file('a')
+        self.jscomposer._mMinified.clear()
+        self.assertEqual(self.jscomposer.minified_file('a'), sMin)
+        self.assertEqual(len(self.rgMinified), 1)
+        self.assertEqual(self.cacheFiles.stats()['hits'], 1)
+
+    def test_changed_files(self):
+        self.write_script('a', "var a = 1;", 1000)
+        # Never minified, and missing files are changed
+        self.assertEqual(self.jscomposer.changed_files(['a', 'missing']), ['a', 'missing'])
+        self.jscomposer.minified_file('a')
+        self.assertEqual(self.jscomposer.changed_files(['a', 'missing']), ['missing'])
+
+    def test_minify_error(self):
+        self.write_script('bad', "a = 'unterminated\n';")
+        self.assertRaises(jsmin.UnterminatedStringLiteral, self.jscomposer.minified_file, 'bad')
+        # The failure is kept - not minified again (e.g., by build --watch) until the file changes
+        self.assertEqual(self.jscomposer.changed_files(['bad']), [])
+        self.assertRaises(jsmin.UnterminatedStringLiteral, self.jscomposer.minified_file, 'bad')
+        self.assertEqual(len(self.rgMinified), 1)
+        # ... until it is fixed
+        self.write_script('bad', "a = 'terminated';", 2000)
+        self.assertEqual(self.jscomposer.minified_file('bad'), "a='terminated';")
+
+class Request(object):
+    def __init__(self, **mMeta):
+        self.META = mMeta
+
+class TestResponse(unittest.TestCase):
+    # jscomposer needs Django and the application settings (on the path) - imported by these tests only
+    def setUp(self):
+        import build
+        self.jscomposer = build.jscomposer
+        self.entry = self.jscomposer.script_entry("var a=1;" * 100)
+
+    def test_gzip(self):
+        import gzip
+        import StringIO
+        resp = self.jscomposer.script_response(Request(HTTP_ACCEPT_ENCODING='gzip, deflate'), self.entry)
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        self.assertEqual(resp['Vary'], 'Accept-Encoding')
+        self.assertEqual(resp['ETag'], self.entry[2][:-1] + '-gz"')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO.StringIO(resp.content)).read(), "var a=1;" * 100)
+        # The same bytes each time
+        self.assertEqual(self.jscomposer.script_entry("var a=1;" * 100)[1], self.entry[1])
+
+    def test_no_gzip(self):
+        for sAccept in ('', 'deflate', 'gzip;q=0', 'gzip; q=0.0, deflate'):
+            resp = self.jscomposer.script_response(Request(HTTP_ACCEPT_ENCODING=sAccept), self.entry)
+            self.failIf(resp.has_header('Content-Encoding'), sAccept)
+            self.assertEqual(resp.content, "var a=1;" * 100)
+            self.assertEqual(resp['ETag'], self.entry[2])
+
+    def test_not_modified(self):
+        sETag = self.entry[2]
+        for sHeader in (sETag, 'W/' + sETag, '"other", ' + sETag, '*'):
+            resp = self.jscomposer.script_response(Request(HTTP_IF_NONE_MATCH=sHeader), self.entry)
+            self.assertEqual(resp.status_code, 304, sHeader)
+            self.assertEqual(resp['ETag'], sETag)
+        resp = self.jscomposer.script_response(Request(HTTP_IF_NONE_MATCH='"other"'), self.entry)
+        self.assertEqual(resp.status_code, 200)
+        # The gzip representation has its own ETag
+        resp = self.jscomposer.script_response(Request(HTTP_IF_NONE_MATCH=sETag,
+                                                       HTTP_ACCEPT_ENCODING='gzip'), self.entry)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_etags_from_header(self):
+        self.assertEqual(self.jscomposer.etags_from_header(''), [])
+        self.assertEqual(self.jscomposer.etags_from_header(' "a" , W/"b",*'), ['"a"', '"b"', '*'])
+
+if __name__ == '__main__':
+    unittest.main()
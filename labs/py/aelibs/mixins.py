@@ -8,18 +8,25 @@ Mixin models for generic Model functions:
 import logging
 import os
 import threading
+import time
+import zlib
 
 from google.appengine.ext import db
-from google.appengine.api import memcache
 
 import util
+import cache
+import writebehind
 import reqfilter
+from reqfilter import timing
 import settings
 import timescore
 
 DEBUG = settings.DEBUG
 DEBUG = False
 
+# Models are mutable - no local tier (the request-local store serves same-request reads)
+cacheModels = cache.get_cache('models')
+
 class Moderatable(db.Model):
     """
     A (mix-in) model which has content which can be reported and moderated.  This adds a single
@@ -31,6 +38,12 @@ class Moderatable(db.Model):
     0 .. reports_min-1: neither banned nor approved - still displaying
     reports_min .. reports_max-1: reported (but not moderated) - not displaying w/o speedbump
     reports_max: set by moderator to be banned - display only after speedbump, not suggested
+    
+    A (sharded) ModerationIndex per kind holds the count of models in each state and the most
+    reported models - updated as models are reported, banned and allowed.  Each change is
+    made to the stored model (its mod_reports only) in a transaction, and the change read
+    there is applied to the index - so concurrent reports of a model are each counted once.
+    The model must have been put.
     """
     reports_min = 2
     reports_max = 100
@@ -39,26 +52,67 @@ class Moderatable(db.Model):
     
     def report(self):
         # Already approved by moderation - can't be reported
-        if self.mod_reports < 0 or self.mod_reports >= self.reports_max-1:
+        if not self._can_report():
             return
 
         req = reqfilter.get_request()
-        sKey = str(self.key())
-        if not req.once_per_user("report.%s" % sKey):
+        if not req.FOnce("report.%s" % self.key()):
             return
         
-        self.mod_reports += 1
+        self._change_reports(_report)
+        
+    @classmethod
+    def report_multi(cls, models):
+        """
+        Report a batch of models (one memcache call and one index update) - returns
+        the models that were changed.
+        """
+        models = [model for model in models if model._can_report()]
+        if not models:
+            return []
+        
+        req = reqfilter.get_request()
+        mModels = dict([("report.%s" % model.key(), model) for model in models])
+        models = [mModels[sKey] for sKey in req.FOnceMulti(mModels.keys())]
+        
+        changes = []
+        models_changed = []
+        for model in models:
+            change = _change_stored_reports(model.key(), _report)
+            if change is not None:
+                model._set_mod_reports(change[2])
+                changes.append(change)
+                models_changed.append(model)
+        ModerationIndex.apply(cls, changes)
+        return models_changed
+    
+    def _can_report(self):
+        return self.mod_reports >= 0 and self.mod_reports < self.reports_max-1
+    
+    def _change_reports(self, fn):
+        change = _change_stored_reports(self.key(), fn)
+        if change is None:
+            return
+        ModerationIndex.apply(type(self), [change])
+        self._set_mod_reports(change[2])
+        
+    def _set_mod_reports(self, mod_reports):
+        # The stored model is written - bring this copy (and a cached one) up to date
+        self.mod_reports = mod_reports
+        if isinstance(self, Cacheable):
+            self._is_memcached = False
+            self.ensure_cached()
     
     def safe_to_display(self, query):
         return self.all().filter('mod_reports <', self.reports_min)
     
     @reqfilter.admin_only
     def ban(self):
-        self.mod_reports = reports_max
+        self._change_reports(lambda model: model.reports_max)
         
     @reqfilter.admin_only
     def allow(self):
-        self.mod_reports = -1
+        self._change_reports(lambda model: -1)
                    
     @reqfilter.admin_only
     def moderation_queue(self):
@@ -67,6 +121,214 @@ class Moderatable(db.Model):
             filter('mod_reports >', 0).\
             order('-mod_reports')
     
+    @classmethod
+    @reqfilter.admin_only
+    def moderation_top(cls):
+        """ Return the most reported (unmoderated) models from the index - most reported first """
+        index = ModerationIndex.lookup(cls)
+        return [model for model in db.get(index.top_keys) if model is not None]
+    
+    @classmethod
+    @reqfilter.admin_only
+    def moderation_counts(cls):
+        """ Return the number of models in each moderation state """
+        return ModerationIndex.lookup(cls).counts()
+    
+    @classmethod
+    @reqfilter.admin_only
+    def rebuild_moderation_index(cls, cursor=None, secs_max=20):
+        """
+        Re-build the index from a scan of the reported and moderated models - returns the
+        cursor to call again with (None when done).  See ModerationIndex.rebuild.
+        """
+        return ModerationIndex.rebuild(cls, cursor, secs_max=secs_max)
+        
+    @classmethod
+    def moderation_state(cls, mod_reports):
+        """ Return the (indexed) state name for a report count - None if never reported """
+        if mod_reports < 0:
+            return 'allowed'
+        if mod_reports == 0:
+            return None
+        if mod_reports < cls.reports_min:
+            return 'pending'
+        if mod_reports < cls.reports_max:
+            return 'reported'
+        return 'banned'
+        
+def _report(model):
+    # The reported mod_reports of a (stored) model - None if it can't be reported
+    if not model._can_report():
+        return None
+    return model.mod_reports + 1
+
+@util.run_in_transaction
+def _change_stored_reports(key, fn):
+    """
+    Set the stored model's mod_reports to fn(model) (None for no change) - returns the change
+    (key, mod_reports_old, mod_reports_new), or None.
+    """
+    model = db.get(key)
+    if model is None:
+        return None
+    mod_reports = fn(model)
+    if mod_reports is None or mod_reports == model.mod_reports:
+        return None
+    change = (str(key), model.mod_reports, mod_reports)
+    model.mod_reports = mod_reports
+    # (db.put - the caller brings its (cached) copy up to date)
+    db.put(model)
+    return change
+        
+class ModerationIndex(db.Model):
+    """
+    Moderation summary of a Moderatable kind - in MODERATION_INDEX_SHARDS entities (key name
+    is <kind>~<shard>).  Each model is counted in one shard (by a hash of its key), so reports
+    of different models are (mostly) written to different entity groups.  Each shard holds:
+    
+        count of models in each state (pending, reported, banned, allowed)
+        top_keys/top_reports - the (up to) MODERATION_INDEX_SIZE most reported models awaiting
+            moderation (in order)
+    
+    lookup() returns the (unsaved) sum of the shards.  Shards are cached for cache_secs - a
+    changed shard's cached copy is deleted.
+    
+    Optional settings.py values:
+    
+        MODERATION_INDEX_SIZE = 100
+        MODERATION_INDEX_SHARDS = 10        # rebuild the indexes after changing this
+        
+    Note that models which drop out of the top reported list are not re-added until they
+    are reported again (or the index is rebuilt).
+    """
+    states = ('pending', 'reported', 'banned', 'allowed')
+    
+    # Limits how long a copy cached (by a reader) while a shard was being changed is used
+    cache_secs = 60
+    
+    pending = db.IntegerProperty(default=0)
+    reported = db.IntegerProperty(default=0)
+    banned = db.IntegerProperty(default=0)
+    allowed = db.IntegerProperty(default=0)
+    top_keys = db.StringListProperty()
+    top_reports = db.ListProperty(int)
+    
+    def counts(self):
+        return dict([(state, getattr(self, state)) for state in self.states])
+    
+    @classmethod
+    def lookup(cls, cls_model):
+        rgKeyNames = cls._key_names(cls_model)
+        rgCacheKeys = [cls._cache_key(sKeyName) for sKeyName in rgKeyNames]
+        secsStart = time.time()
+        mCached = cacheModels.get_multi(rgCacheKeys)
+        timing.add('cache', time.time() - secsStart)
+        rgShards = [mCached.get(sCacheKey) for sCacheKey in rgCacheKeys]
+        
+        rgMissing = [i for i in range(len(rgShards)) if rgShards[i] is None]
+        if rgMissing:
+            mSet = {}
+            for i, shard in zip(rgMissing, cls.get_by_key_name([rgKeyNames[i] for i in rgMissing])):
+                if shard is None:
+                    shard = cls(key_name=rgKeyNames[i])
+                rgShards[i] = shard
+                mSet[rgCacheKeys[i]] = shard
+            cacheModels.set_multi(mSet, cls.cache_secs)
+        
+        index = cls(key_name=cls_model.kind())
+        mReports = {}
+        for shard in rgShards:
+            for state in cls.states:
+                setattr(index, state, getattr(index, state) + getattr(shard, state))
+            mReports.update(zip(shard.top_keys, shard.top_reports))
+        index._set_top(mReports)
+        return index
+    
+    @classmethod
+    def apply(cls, cls_model, changes):
+        """ Update the index for a list of changes: (key, mod_reports_old, mod_reports_new) """
+        mChanges = {}
+        for change in changes:
+            mChanges.setdefault(cls._shard_key_name(cls_model, change[0]), []).append(change)
+        for sKeyName, rgShardChanges in mChanges.items():
+            cls._apply(cls_model, sKeyName, rgShardChanges)
+            cacheModels.delete(cls._cache_key(sKeyName))
+        
+    @staticmethod
+    @util.run_in_transaction
+    def _apply(cls_model, sKeyName, changes):
+        shard = ModerationIndex.get_by_key_name(sKeyName)
+        if shard is None:
+            shard = ModerationIndex(key_name=sKeyName)
+        mReports = dict(zip(shard.top_keys, shard.top_reports))
+        for sKey, reports_old, reports_new in changes:
+            state_old = cls_model.moderation_state(reports_old)
+            state_new = cls_model.moderation_state(reports_new)
+            if state_old is not None:
+                setattr(shard, state_old, max(getattr(shard, state_old) - 1, 0))
+            if state_new is not None:
+                setattr(shard, state_new, getattr(shard, state_new) + 1)
+            if state_new in ('pending', 'reported'):
+                mReports[sKey] = reports_new
+            else:
+                mReports.pop(sKey, None)
+        shard._set_top(mReports)
+        shard.put()
+    
+    @classmethod
+    def rebuild(cls, cls_model, cursor=None, page_size=100, secs_max=20):
+        """
+        Re-build the index from a scan of the reported and moderated models - a page at a
+        time, until done or secs_max have elapsed.  Returns the cursor to call again with (None
+        when done).  The shards are reset by the first call (cursor None) - counts are partial
+        until the rebuild is done (and changes made during it may be counted twice).
+        """
+        if cursor is None:
+            db.put([cls(key_name=sKeyName) for sKeyName in cls._key_names(cls_model)])
+            for sKeyName in cls._key_names(cls_model):
+                cacheModels.delete(cls._cache_key(sKeyName))
+            cursor = '>~'
+        
+        # (!= queries can't be continued with a cursor) - the reported (> 0), then the allowed (< 0)
+        secsStart = time.time()
+        while True:
+            sOp, sCursor = cursor.split('~', 1)
+            query = cls_model.all().filter('mod_reports %s' % sOp, 0)
+            if sCursor:
+                query.with_cursor(sCursor)
+            models = query.fetch(page_size)
+            # Each model is added (as a change from 0) to its shard
+            cls.apply(cls_model, [(str(model.key()), 0, model.mod_reports) for model in models])
+            if len(models) == page_size:
+                cursor = '%s~%s' % (sOp, query.cursor())
+            elif sOp == '>':
+                cursor = '<~'
+            else:
+                return None
+            if time.time() - secsStart >= secs_max:
+                return cursor
+        
+    def _set_top(self, mReports):
+        rgTop = sorted(mReports.items(), key=lambda item: item[1], reverse=True)
+        del rgTop[getattr(settings, 'MODERATION_INDEX_SIZE', 100):]
+        self.top_keys = [sKey for sKey, reports in rgTop]
+        self.top_reports = [reports for sKey, reports in rgTop]
+    
+    @staticmethod
+    def _key_names(cls_model):
+        return ["%s~%d" % (cls_model.kind(), iShard)
+                for iShard in range(getattr(settings, 'MODERATION_INDEX_SHARDS', 10))]
+    
+    @staticmethod
+    def _shard_key_name(cls_model, sKey):
+        # crc32 (not hash) - the same shard on every instance
+        iShard = (zlib.crc32(sKey) & 0xffffffff) % getattr(settings, 'MODERATION_INDEX_SHARDS', 10)
+        return "%s~%d" % (cls_model.kind(), iShard)
+    
+    @staticmethod
+    def _cache_key(sKeyName):
+        return "moderation~%s~%s" % (sKeyName, os.environ['CURRENT_VERSION_ID'])
+    
     
 class Migratable(db.Model):
     """
@@ -80,18 +342,29 @@ class Migratable(db.Model):
         Note: Automatically called after each get_by_key_name and get_or_insert.
         
     update_schema_batch() - Migrates a group (default up to 100) Models at once.
+    
+    MigrationRunner(cls).run() - Migrates all the stale Models, a page at a time (resumable).
+    
+    Set schema_write_on_read = False to only migrate (in memory) on read, and leave the
+    writes to a MigrationRunner.
     """
     schema_current = 1
+    schema_write_on_read = True
     schema = db.IntegerProperty(default=1)
     
     @classmethod
     def get_by_key_name(cls, key_name, parent=None):
         """
         override the Model.get_by_key_name method, to ensure the schema version is current after a read
+        
+        If given a list of key_names (as Cacheable), a list of models is returned - any
+        migrated models are written in one batch.
         """
         model = super(Migratable, cls).get_by_key_name(key_name, parent)
-        if model is not None:
-            model.update_schema()
+        if isinstance(key_name, (list, tuple)):
+            cls._update_schema_on_read_multi(model)
+        elif model is not None:
+            model._update_schema_on_read()
 
         return model
     
@@ -100,41 +373,128 @@ class Migratable(db.Model):
         # Look in cache first
         model = super(Migratable, cls).get_or_insert(key_name, **kwargs)
         if model is not None:
-            model.update_schema()
+            model._update_schema_on_read()
             
         return model
 
     def update_schema(self):
+        if self.migrate_schema():
+            self.put()
+        
+    def _update_schema_on_read(self):
+        if self.schema_write_on_read:
+            self.update_schema()
+        else:
+            self.migrate_schema()
+
+    @classmethod
+    def _update_schema_on_read_multi(cls, models):
+        models = [model for model in models if model is not None and model.migrate_schema()]
+        if cls.schema_write_on_read:
+            put_models(models)
+        
+    def migrate_schema(self):
+        """
+        Migrate (in memory) to the current schema version - returns True if the model
+        needs to be written.
+        """
         schema_old = self.schema
-        if schema_old == self.schema_current:
-            return
+        if schema_old >= self.schema_current:
+            return False
         
-        while db.schema < self.schema_current:
+        while self.schema < self.schema_current:
             self.migrate(self.schema+1)
             self.schema += 1
             
-        self.put()
         logging.info("Updating %s[%s] schema (%d -> %d)" % (
                 self.kind(),
                 self.key().id_or_name(),
                 schema_old,
                 self.schema))
+        return True
         
     @classmethod
     def update_schema_batch(cls, n=100):
         """
-        Migrate models in batch.
-        
-        TODO: Deferred migration support via callback.
+        Migrate (up to n) models, written in one batch - returns the number migrated.
         """
         models = cls.all().filter('schema <', cls.schema_current).fetch(n)
-        for model in models:
-            model.update_schema()
+        models = [model for model in models if model.migrate_schema()]
+        put_models(models)
         return len(models)
 
     def migrate(self, schemaNext):
         raise reqfilter.Error("Application error - missing migration for %s" % type(self).__name__)
     
+class MigrationCheckpoint(db.Model):
+    """
+    Progress of a MigrationRunner (key name: "<kind>~<schema_current>")
+    """
+    cursor = db.TextProperty()
+    count = db.IntegerProperty(default=0)
+    secs = db.FloatProperty(default=0.0)
+    done = db.BooleanProperty(default=False)
+    
+class MigrationRunner(object):
+    """
+    Migrate all the stale models of a Migratable class.
+    
+    Usage (e.g. from a cron or task handler):
+    
+        runner = MigrationRunner(MyModel)
+        mStats = runner.run(secs_max=20)
+        if not mStats['done']:
+            ... call again (it resumes from the last page written)
+    
+    Stale models are read a page at a time (following a query cursor), migrated in memory
+    and written with one batch put per page (put_models - so Cacheable copies are current).
+    The cursor is checkpointed after each page.
+    """
+    def __init__(self, cls, page_size=100):
+        self.cls = cls
+        self.page_size = page_size
+        self.checkpoint = MigrationCheckpoint.get_or_insert(
+            "%s~%d" % (cls.kind(), cls.schema_current))
+        
+    def run(self, secs_max=20):
+        """
+        Migrate pages until done, or secs_max have elapsed - returns a dictionary of
+        progress: migrated (this run), total (all runs), secs, per_sec, done
+        """
+        secsStart = time.time()
+        count = 0
+        while not self.checkpoint.done and time.time() - secsStart < secs_max:
+            count += self.run_page()
+            
+        secs = time.time() - secsStart
+        mStats = {'migrated': count,
+                  'total': self.checkpoint.count,
+                  'secs': secs,
+                  'per_sec': secs and count / secs,
+                  'done': self.checkpoint.done}
+        logging.info("Migrated %d %s to schema %d (%.1f/sec, %d total)%s" % (
+                count, self.cls.kind(), self.cls.schema_current, mStats['per_sec'],
+                self.checkpoint.count, mStats['done'] and " - done" or ""))
+        return mStats
+        
+    def run_page(self):
+        """ Migrate one page of models - returns the number migrated """
+        secsStart = time.time()
+        query = self.cls.all().filter('schema <', self.cls.schema_current)
+        if self.checkpoint.cursor:
+            query.with_cursor(self.checkpoint.cursor)
+        models = query.fetch(self.page_size)
+        
+        models_changed = [model for model in models if model.migrate_schema()]
+        put_models(models_changed)
+        
+        self.checkpoint.cursor = query.cursor()
+        self.checkpoint.count += len(models_changed)
+        self.checkpoint.secs += time.time() - secsStart
+        self.checkpoint.done = len(models) < self.page_size
+        self.checkpoint.put()
+        return len(models_changed)
+
 class Dated(db.Model):
     """
     Standardized dating information for models.
@@ -156,8 +516,9 @@ class Cacheable(db.Model):
             
     these are over-ridden methods of Model:
             
-        get_by_key_name(key_name, parent)
-            retreives model from cache if possible
+        get_by_key_name(key_name(s), parent)
+            retreives model(s) from cache if possible - a list of key names is read
+            with one memcache and one store round-trip
         put()
             write-through cache and put to store
         get_or_insert(key_name, **kwds)
@@ -168,6 +529,7 @@ class Cacheable(db.Model):
             a write to store on exit, the later throttles to one write per second
             for this model
         deferred_put() - writes the model to store if dirty
+        put_multi(models) - (classmethod) write models to store in one batch
         ensure_cached() - return a cached instance of the current model
         flush_cache() - put the model, and remove all cached copies
     
@@ -175,6 +537,8 @@ class Cacheable(db.Model):
     
     - Saving models to local storage and memcache where they can be retrieved quickly.
     - Throttled write-through to storage for high-volume, but delay-able writes.
+    - Optionally (settings.CACHE_WRITE_BEHIND), dirty models are written by background
+      workers - repeated changes to a model are coalesced into one write per flush.
 
     Issues:
     
@@ -194,7 +558,7 @@ class Cacheable(db.Model):
         self._cache_state = self.cache_state.clean
         self._is_memcached = False
         self._secs_put_last = 0
-        self._write_rate = timescore.RateLimit(30)   # Peak writes to store - once each 2 seconds
+        self._write_rate = None     # Created on first deferred write (see _is_put_due)
         super(Cacheable, self).__init__(*args, **kwargs)
     
     @classmethod
@@ -203,11 +567,12 @@ class Cacheable(db.Model):
         override the Model.get_by_key_name method, to look in local or memcache
         storage first.
         
-        All key_name(s) must be strings.
-        
-        TODO: Support list of key_names - will need to call super are partial list of those
-        keys that are not yet cached!
+        All key_name(s) must be strings.  If given a list of key_names, a list of models
+        is returned (None for those not found).
         """
+        if isinstance(key_name, (list, tuple)):
+            return cls._get_multi_by_key_name(key_name, parent)
+        
         model = cls._model_from_cache(key_name)
         if model is not None:
             return model
@@ -221,6 +586,23 @@ class Cacheable(db.Model):
 
         return model
     
+    @classmethod
+    def _get_multi_by_key_name(cls, key_names, parent=None):
+        mModels = cls._models_from_cache(key_names)
+        
+        # Read all the uncached models from storage in one batch
+        key_names_missing = [key_name for key_name in key_names if key_name not in mModels]
+        if key_names_missing:
+            if DEBUG:
+                logging.info("Reading %d from storage: %s" % (len(key_names_missing), cls.__name__))
+            models = super(Cacheable, cls).get_by_key_name(key_names_missing, parent)
+            models = [model for model in models if model is not None]
+            cls._write_multi_to_cache(models)
+            for model in models:
+                mModels[model.key().name()] = model
+            
+        return [mModels.get(key_name) for key_name in key_names]
+    
     @classmethod
     def get_or_insert(cls, key_name, **kwargs):
         # Look in cache first
@@ -264,9 +646,7 @@ class Cacheable(db.Model):
         self.ensure_cached()
         
         try:
-            # Write to storage if critical or dirty AND old
-            if self._cache_state == self.cache_state.critical or \
-                not self._write_rate.is_exceeded(reqfilter.get_request().secsNow):
+            if self._is_put_due(reqfilter.get_request().secsNow):
                 self.put()
         except Exception, e:
             logging.info("Failed to write deferred-write cache: %s (%s)" % (
@@ -275,6 +655,44 @@ class Cacheable(db.Model):
                          ))
             pass
 
+    def _is_put_due(self, secsNow):
+        # Write to storage if critical or dirty AND old
+        if self._cache_state == self.cache_state.clean:
+            return False
+        if self._cache_state == self.cache_state.critical:
+            return True
+        if self._write_rate is None:
+            self._write_rate = timescore.RateLimit(30)   # Peak writes to store - once each 2 seconds
+        return not self._write_rate.is_exceeded(secsNow)
+        
+    @classmethod
+    def put_multi(cls, models):
+        """
+        Write the models to storage (and cache) in one batch.  If the batch fails, each model
+        is tried on its own - so one failure does not hold back the others.
+        """
+        if not models:
+            return
+        try:
+            db.put(models)
+        except Exception, e:
+            logging.info("Failed batch write of %d models (%s) - writing individually" % (len(models), e))
+            for model in models:
+                try:
+                    model.put()
+                except Exception, e:
+                    logging.info("Failed to write deferred-write cache: %s (%s)" % (
+                                 model._model_cache_key(),
+                                 e
+                                 ))
+            return
+        
+        if DEBUG:
+            logging.info("Writing %d to storage" % len(models))
+        for model in models:
+            model._cache_state = model.cache_state.clean
+        Cacheable._write_multi_to_cache(models)
+        
     def ensure_cached(self):
         """
         ensures that this instance is in the cache.  If not, it will
@@ -306,22 +724,58 @@ class Cacheable(db.Model):
         
         # Check if in request-local store
         local_store = cls._local_store()
-        if sKey in local_store:
-            return local_store[sKey]
+        model = local_store.get(sKey)
+        if model is not None:
+            return model
         
         # Check if in memcache - and update local store
-        model = memcache.get(sKey)
+        secsStart = time.time()
+        model = cacheModels.get(sKey)
+        timing.add('cache', time.time() - secsStart)
         if model is not None:
             if DEBUG:
                 logging.info("Reading from global cache: %s" % sKey)
-            local_store[sKey] = model
             
             # Don't copy the cache_state from another instance/request
             model._cache_state = cls.cache_state.clean
-            model._in_memcache = True
+            model._is_memcached = True
+            local_store[sKey] = model
             return model
         
         return None
+    
+    @classmethod
+    def _models_from_cache(cls, key_names):
+        """
+        Return a dictionary (by key_name) of the models found in the request-local
+        store or memcache (read in one batch).
+        """
+        local_store = cls._local_store()
+        mModels = {}
+        mKeysMissing = {}
+        for key_name in key_names:
+            sKey = cls._cache_key(key_name)
+            model = local_store.get(sKey)
+            if model is not None:
+                mModels[key_name] = model
+            else:
+                mKeysMissing[sKey] = key_name
+                
+        if not mKeysMissing:
+            return mModels
+        
+        secsStart = time.time()
+        mCached = cacheModels.get_multi(mKeysMissing.keys())
+        timing.add('cache', time.time() - secsStart)
+        for sKey, model in mCached.items():
+            if DEBUG:
+                logging.info("Reading from global cache: %s" % sKey)
+            model._cache_state = cls.cache_state.clean
+            model._is_memcached = True
+            local_store[sKey] = model
+            mModels[mKeysMissing[sKey]] = model
+            
+        return mModels
   
     @staticmethod
     def _write_to_cache(model):
@@ -334,10 +788,33 @@ class Cacheable(db.Model):
             logging.info("Writing to cache: %s" % sKey)
         
         model._local_store()[sKey] = model
-        memcache.set(sKey, model)
+        secsStart = time.time()
+        cacheModels.set(sKey, model)
+        timing.add('cache', time.time() - secsStart)
         
         model._is_memcached = True
         
+    @staticmethod
+    def _write_multi_to_cache(models):
+        """
+        unconditionally write the models to the local and memcache stores (one memcache call)
+        """
+        if not models:
+            return
+        local_store = Cacheable._local_store()
+        mModels = {}
+        for model in models:
+            sKey = model._model_cache_key()
+            local_store[sKey] = model
+            mModels[sKey] = model
+            
+        secsStart = time.time()
+        cacheModels.set_multi(mModels)
+        timing.add('cache', time.time() - secsStart)
+        
+        for model in models:
+            model._is_memcached = True
+        
     def _model_cache_key(self):
         return self._cache_key(self.key().name())
 
@@ -351,19 +828,131 @@ class Cacheable(db.Model):
     
     @staticmethod    
     def _local_store():
-        return local.cache_storage
+        store = getattr(local, 'cache_storage', None)
+        if store is None:
+            # Outside of a request (or in a new thread)
+            store = local.cache_storage = RequestStore()
+        return store
+
+class RequestStore(object):
+    """
+    Request-local identity map of cached models (by cache key).
+    
+    Clean models are kept in an LRU cache of (at most) max_items models.  Dirty models
+    are also held until they are written to storage, so pending writes are never evicted.
+    
+    Counters: hits, misses, evictions
+    """
+    def __init__(self, max_items=None):
+        if max_items is None:
+            max_items = getattr(settings, 'CACHE_REQUEST_MAX_MODELS', 1000)
+        self.models = cache.LRUCache(max_items)
+        self.dirty = {}
+        
+    def get(self, sKey):
+        model = self.dirty.get(sKey)
+        if model is not None:
+            self.models.hits += 1
+            return model
+        return self.models.get(sKey)
+    
+    def __setitem__(self, sKey, model):
+        self.models.set(sKey, model)
+        if model._cache_state != model.cache_state.clean:
+            self.dirty[sKey] = model
+        else:
+            self.dirty.pop(sKey, None)
+            
+    def dirty_models(self):
+        """ Return the models waiting to be written to storage. """
+        for sKey, model in self.dirty.items():
+            if model._cache_state == model.cache_state.clean:
+                del self.dirty[sKey]
+        return self.dirty.values()
+    
+    def stats(self):
+        return {'models': len(self.models), 'dirty': len(self.dirty), 'hits': self.models.hits,
+                'misses': self.models.misses, 'evictions': self.models.evictions}
 
 class CacheFilter(object):
+    """
+    Middleware to manage the request-local model store - must follow ReqFilter in
+    MIDDLEWARE_CLASSES.
+    """
+    def process_request(self, req):
+        begin_request()
+        
     def process_response(self, req, resp):
-        write_deferred_cache()
+        try:
+            write_deferred_cache()
+        finally:
+            end_request()
         return resp
+    
+def begin_request():
+    """ Start a new (empty) request-local model store """
+    local.cache_storage = RequestStore()
+    
+def end_request():
+    """ Release the request-local model store - adding its counters to the process totals """
+    store = getattr(local, 'cache_storage', None)
+    if store is None:
+        return
+    local.cache_storage = None
+    _stats_lock.acquire()
+    try:
+        mStats = store.stats()
+        _stats['requests'] += 1
+        for name in ('hits', 'misses', 'evictions'):
+            _stats[name] += mStats[name]
+        _stats['models_max'] = max(_stats['models_max'], mStats['models'])
+    finally:
+        _stats_lock.release()
+        
+def cache_stats():
+    """ Return the (process-wide) request-local store counters """
+    _stats_lock.acquire()
+    try:
+        return dict(_stats)
+    finally:
+        _stats_lock.release()
+        
+_stats = {'requests': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'models_max': 0}
+_stats_lock = threading.Lock()
         
+@timing.timed('deferred')
 def write_deferred_cache():
-    for key,model in local.cache_storage.items():
-        model.deferred_put()
+    """
+    Write all the dirty (and due) models of this request to storage - in one batch.
+    
+    With the write-behind queue enabled, dirty models are handed to the queue instead (so a
+    model dirtied by concurrent requests is written once), and the queue is drained before
+    the request is over - App Engine does not keep threads running between requests.
+    """
+    models = Cacheable._local_store().dirty_models()
+    queue = writebehind.get_queue()
+    if queue is not None:
+        models_critical = []
+        for model in models:
+            sKey = model._model_cache_key()
+            if model._cache_state == model.cache_state.critical:
+                queue.cancel(sKey)
+                models_critical.append(model)
+                continue
+            # The cached copy is current - the queue brings storage up to date
+            queue.put(sKey, model)
+            model._cache_state = model.cache_state.clean
+        Cacheable.put_multi(models_critical)
+        queue.drain()
+        return
+    
+    if not models:
+        return
+    secsNow = reqfilter.get_request().secsNow
+    models = [model for model in models if model._is_put_due(secsNow)]
+    Cacheable.put_multi(models)
             
 local = threading.local()
-local.cache_storage = {}
 
 def unique_models(models):
     """
@@ -387,4 +976,17 @@ def exclude_models(models, models_exclude):
     keys_exclude = set((model.key().id_or_name() for model in models_exclude))
     results = [model for model in models if model.key().id_or_name() not in keys_exclude]
     return results
-        
\ No newline at end of file
+        
+
+def put_models(models):
+    """
+    Write the models to storage in one batch (raising on failure).  db.put doesn't call the
+    Cacheable put() - so the cached copies of Cacheable models are replaced here.
+    """
+    if not models:
+        return
+    db.put(models)
+    models = [model for model in models if isinstance(model, Cacheable)]
+    for model in models:
+        model._cache_state = model.cache_state.clean
+    Cacheable._write_multi_to_cache(models)
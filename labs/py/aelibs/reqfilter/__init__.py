@@ -2,3 +2,4 @@ from filter import Error, HttpJSON, HttpRSS, HasRSS, \
     RaiseNotFound, RaiseNYI, AddToResponse, \
     JavaScriptEncoder, get_request, RenderResponse, GetContext, json_urls, ReqFilter, \
     admin_only
+from routing import Router, request_kind
@@ -0,0 +1,90 @@
+"""
+Micro-benchmarks for reqfilter request dispatch.
+
+Compares, for a typical set of url patterns:
+
+    - the ReqFilter suffix classification vs. the regular expressions it replaced
+    - Router.resolve vs. trying each pattern in order (as Django's resolver does)
+
+Usage (from the application directory, so settings and Django can be imported):
+
+    python reqfilter/bench.py [iterations]
+"""
+
+import os
+import sys
+import re
+import timeit
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+from django.conf.urls.defaults import patterns
+from django.core.urlresolvers import Resolver404
+
+import routing
+
+def view(req, **kwargs):
+    pass
+
+def sample_patterns():
+    return patterns('',
+        (r'^init.json$', view),
+        (r'^get-result.json$', view),
+        (r'^loopback-test.json$', view),
+        (r'^admin/timings.json$', view),
+        (r'^admin/profile.json$', view),
+        (r'^$', view),
+        (r'^about$', view),
+        (r'^tag/(?P<tag>[\w-]+)$', view),
+        (r'^user/(?P<user>[\w-]+)(\.rss)?$', view),
+        (r'^scripts/(?P<name>[a-zA-Z0-9_]+)(-(?P<version>.+)-(?P<debug>[01]))?.js$', view),
+        )
+
+def resolve_linear(urlpatterns, path):
+    for pattern in urlpatterns:
+        match = pattern.resolve(path)
+        if match:
+            return match
+    return None
+
+def resolve_router(router, path):
+    try:
+        return router.resolve(path)
+    except Resolver404:
+        return None
+
+regJSON = re.compile(r".*\.json$")
+regRSS = re.compile(r".*\.rss$")
+
+def kind_regex(path):
+    if regJSON.match(path) is not None:
+        return 'json'
+    if regRSS.match(path) is not None:
+        return 'rss'
+    return 'html'
+
+def report(sName, secs, n):
+    print "%-40s %8.2f usec/call" % (sName, secs * 1e6 / n)
+
+def main(n=100000):
+    urlpatterns = sample_patterns()
+    router = routing.Router(urlpatterns)
+    paths = ['init.json', 'admin/profile.json', 'about', 'tag/python', 'scripts/main-12-0.js',
+             'no/such/page/anywhere/on/the/site/at/all/really']
+
+    for path in paths:
+        if resolve_linear(urlpatterns, path) != resolve_router(router, path):
+            raise AssertionError("Router mismatch for %s" % path)
+
+    for path in paths:
+        print path
+        report("  kind (regex)", timeit.Timer(lambda: kind_regex(path)).timeit(n), n)
+        report("  kind (suffix)", timeit.Timer(lambda: routing.request_kind(path)).timeit(n), n)
+        report("  resolve (pattern list)", timeit.Timer(lambda: resolve_linear(urlpatterns, path)).timeit(n), n)
+        report("  resolve (Router)", timeit.Timer(lambda: resolve_router(router, path)).timeit(n), n)
+
+if __name__ == '__main__':
+    n = 100000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    main(n)
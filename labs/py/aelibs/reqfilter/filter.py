@@ -5,10 +5,10 @@ from django.conf.urls.defaults import patterns
 from django.utils.cache import patch_response_headers
 from django.utils.http import http_date
 
-from google.appengine.api import memcache
 from google.appengine.api import users
 
 from hashlib import sha1
+import hmac
 import re
 import random
 from datetime import datetime
@@ -23,6 +23,11 @@ import os
 import time
 
 import settings
+import cache
+import limiter
+import results
+import timing
+import routing
 
 def json_urls():
     return patterns('',
@@ -30,34 +35,156 @@ def json_urls():
         (r'^init.json$', InitAPI),
         (r'^get-result.json$', get_result),
         (r'^loopback-test.json$', Loopback),
+        (r'^admin/timings.json$', TimingsAPI),
+        (r'^admin/profile.json$', ProfileAPI),
     )
 
 """
 Signed and verified strings can only come from the server
+
+Strings are signed with an HMAC (SHA-1) of the current server secret (settings.sSecretName).
+Signatures made with a previous secret (settings.SECRET_NAMES_PREVIOUS) are still accepted,
+so the secret can be rotated without invalidating outstanding cookies and API keys.
 """
 
+def _utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+def FEqualConstant(s1, s2):
+    """ Compare strings in constant time (for the length) - signatures can't be guessed a character at a time """
+    if len(s1) != len(s2):
+        return False
+    result = 0
+    for ch1, ch2 in zip(s1, s2):
+        result |= ord(ch1) ^ ord(ch2)
+    return result == 0
+
+class Signer(object):
+    """ Sign strings with one secret - the HMAC key schedule is computed once. """
+    def __init__(self, sSecret):
+        self.sSecret = sSecret
+        # Secrets read from the datastore are unicode - hmac needs a byte string key
+        self._hmac = hmac.new(_utf8(sSecret), digestmod=sha1)
+        
+    def hash(self, type, s):
+        h = self._hmac.copy()
+        h.update(_utf8('%s~%s' % (type, s)))
+        return h.hexdigest().upper()
+    
+    def legacy_hash(self, type, s):
+        # Signature scheme used before HMAC signing
+        return sha1(_utf8('~'.join((type, s, self.sSecret)))).hexdigest().upper()
+    
+    def verify(self, type, s, sHash):
+        return FEqualConstant(self.hash(type, s), sHash)
+    
+    def verify_legacy(self, type, s, sHash):
+        return FEqualConstant(self.legacy_hash(type, s), sHash)
+    
+class SecretCache(object):
+    """
+    Process-local cache of the signing secrets (read via Globals.SGet).
+    
+    Secrets are re-read every secsTTL seconds; the first Signer returned is for the
+    current secret, followed by those for any previous secrets still accepted.
+    """
+    def __init__(self, secsTTL=60):
+        self.secsTTL = secsTTL
+        self.rgSigners = None
+        self.secsExpires = 0
+        self._lock = threading.Lock()
+        
+    def signers(self):
+        if self.rgSigners is None or time.time() >= self.secsExpires:
+            self._lock.acquire()
+            try:
+                if self.rgSigners is None or time.time() >= self.secsExpires:
+                    self.rgSigners = self._load()
+                    self.secsExpires = time.time() + self.secsTTL
+            finally:
+                self._lock.release()
+        return self.rgSigners
+    
+    def current(self):
+        return self.signers()[0]
+    
+    def flush(self):
+        self.rgSigners = None
+    
+    def _load(self):
+        rgSigners = [self._signer(globals.Globals.SGet(settings.sSecretName, "test server key"))]
+        for name in getattr(settings, 'SECRET_NAMES_PREVIOUS', ()):
+            sSecret = globals.Globals.SGet(name)
+            if sSecret:
+                rgSigners.append(self._signer(sSecret))
+        return rgSigners
+    
+    def _signer(self, sSecret):
+        # Keep the precomputed Signer when a secret is unchanged
+        if self.rgSigners is not None:
+            for signer in self.rgSigners:
+                if signer.sSecret == sSecret:
+                    return signer
+        return Signer(sSecret)
+    
+secrets = SecretCache(getattr(settings, 'SECRET_CACHE_SECS', 60))
+
+def _signers(sSecret=None):
+    # Signers to use - for an explicitly given secret, or the cached server secrets
+    if sSecret is None:
+        return secrets.signers()
+    signer = _mSigners.get(sSecret)
+    if signer is None:
+        signer = _mSigners[sSecret] = Signer(sSecret)
+    return [signer]
+
+_mSigners = {}
+
 def SSign(req, type, s, sSecret=None):
     # Sign the string using the server secret key
     # type is a short string that is used to distinguish one type of signed content vs. another
     # (e.g. user auth from).
-    if sSecret is None:
-        sSecret = req.sSecret
-    hash = sha1('~'.join((type, str(s), sSecret))).hexdigest().upper()
-    return '~'.join((type, str(s), hash))
+    s = str(s)
+    return '~'.join((type, s, _signers(sSecret)[0].hash(type, s)))
+
+regSigned = re.compile(r"^([\w-]+)~(.*)~([0-9A-F]{40})$")
 
-regSigned = re.compile(r"^([\w-]+)~(.*)~[0-9A-F]{40}$")
+def SVerify(req, type, s, sSecret=None):
+    """
+    Return (original string, fCurrent) if s is a valid signed string of the correct type, or
+    (None, False) if not.  fCurrent is False if s was not signed with the current secret
+    (and should be re-signed).
+    """
+    if not isinstance(s, basestring):
+        return (None, False)
+    m = regSigned.match(s)
+    if m is None or m.group(1) != type:
+        return (None, False)
+    
+    sValue = m.group(2)
+    sHash = m.group(3)
+    rgSigners = _signers(sSecret)
+    for signer in rgSigners:
+        if signer.verify(type, sValue, sHash):
+            return (sValue, signer is rgSigners[0])
+        
+    if getattr(settings, 'SECRET_LEGACY_SIGNATURES', True):
+        for signer in rgSigners:
+            if signer.verify_legacy(type, sValue, sHash):
+                return (sValue, False)
+            
+    return (None, False)
 
 def SGetSigned(req, type, s, sSecret=None, sError="Failed Authentication"):
     # Raise exception if s is not a valid signed string of the correct type.  Returns
     # original (unsigned) string if succeeds.
-    try:
-        m = regSigned.match(s)
-        if type == m.group(1) and SSign(req, type, m.group(2), sSecret) == s:
-            return m.group(2)
-    except:
-        pass
+    sValue, fCurrent = SVerify(req, type, s, sSecret)
+    if sValue is not None:
+        return sValue
 
-    if m and s != '' and type == m.group(1):
+    if isinstance(s, basestring) and s != '' and s.startswith(type + '~'):
         logging.warning("Signed failure: %s: %s" % (type, s))
 
     raise Error(sError, 'Fail/Auth/%s' % type)
@@ -87,27 +214,27 @@ def RaiseNYI(req):
 """
 Django request filter middle-ware
 """
-regJSON = re.compile(r".*\.json$")
-regRSS = re.compile(r".*\.rss$")
-
 class ReqFilter(object):
     def process_request(self, req):
         local.req = req
+        timing.begin(req)
 
         req.mCookies = {}
-        req.mResponse = {}
+        req.mResponse = LazyContext(StaticContext())
         req.mAllow = set()
+        req.fLimited = False
         req.ipAddress = req.META['REMOTE_ADDR']
         req.sHost = "http://%s" % req.META["HTTP_HOST"]
         req.dtNow = datetime.now()
         req.secsNow = secs_from_datetime(req.dtNow)
-        req.sSecret = globals.Globals.SGet(settings.sSecretName, "test server key")
         req.secsCache = settings.CACHE_MIDDLEWARE_SECONDS
         
         def Require_Closure(*sKeys):
             return Require(req, *sKeys)
         def once_closure(sKey):
             return once_per_user(req, sKey)
+        def once_multi_closure(sKeys):
+            return once_per_user_multi(req, sKeys)
         def FAllow_Closure(*sKeys):
             return FAllow(req, *sKeys)
         def AddToResponse_Closure(m):
@@ -125,14 +252,42 @@ class ReqFilter(object):
         
         req.Require = Require_Closure
         req.FOnce = once_closure
+        req.FOnceMulti = once_multi_closure
         req.FAllow = FAllow_Closure
         req.AddToResponse = AddToResponse_Closure
         req.SetCacheTime = SetCacheTime_Closure
         
+        if req.method == 'GET':
+            req.mParams = req.GET
+        else:
+            req.mParams = req.POST
+            req.mAllow.add('post')
+        
+        # Requre that json calls have .json terminator
+        req.sKind = routing.request_kind(req.path)
+        req.fJSON = req.sKind == 'json'
+        if req.fJSON:
+            req.mAllow.add('json')
+            
+        req.fRSS = req.sKind == 'rss'
+        
+        # Shed abusive clients before doing any further work
+        rpmIP = limiter.ip_rpm()
+        if rpmIP is not None and \
+           limiter.get_limiter().is_exceeded('ip~%s' % req.ipAddress, rpmIP, req.secsNow):
+            return HttpRateLimited(req)
+        
+        req.sSecret = secrets.current().sSecret
+        
         # Generate a (relatively) unique user-tracking cookie from the original IP address    
         try:
             req.uidSigned = req.COOKIES['user-tracking']
-            req.uid = SGetSigned(req, 'uid', req.uidSigned)
+            req.uid, fCurrent = SVerify(req, 'uid', req.uidSigned)
+            if req.uid is None:
+                raise Error("Invalid tracking cookie")
+            # Re-sign cookies from a previous secret
+            if not fCurrent:
+                req.uidSigned = SSign(req, 'uid', req.uid)
             req.mAllow.add('tracking')
         except:
             req.uid = "~".join((req.ipAddress, req.dtNow.strftime('%m/%d/%Y %H:%M'), str(random.randint(0, 10000))))
@@ -140,28 +295,30 @@ class ReqFilter(object):
             logging.info("New tracking cookie: %s" % req.uid)
         req.mCookies['user-tracking'] = req.uidSigned
         
-        if req.method == 'GET':
-            req.mParams = req.GET
-        else:
-            req.mParams = req.POST
-            req.mAllow.add('post')
-        
         if 'csrf' in req.mParams:
             if req.mParams['csrf'] == req.uid:
                 req.mAllow.update(['api', 'write'])
             else:
                 logging.info("CSRF DOES NOT MATCH %s != %s" % (req.mParams.get('csrf',''), req.uid))
         
+        # Client apikey: ip~rate (requests per minute)
+        try:
+            sAPI = SGetSigned(req, 'api-IP', req.mParams['apikey'])
+
+            rgAPI = sAPI.split('~')
+            ip = str(rgAPI[0])
+            rate = int(rgAPI[1])
+            if req.ipAddress == ip:
+                req.mAllow.update(['api', 'write'])
+        except:
+            sAPI = None
+            
+        if sAPI is not None and rateLimiter.is_exceeded('api~%s' % sAPI, rate, req.secsNow):
+            return HttpRateLimited(req)
+        
         if 'adult-content-ok' in req.COOKIES:
             req.mAllow.add('adult');
         
-        # Requre that json calls have .json terminator
-        req.fJSON = regJSON.match(req.path) is not None
-        if req.fJSON:
-            req.mAllow.add('json')
-            
-        req.fRSS = regRSS.match(req.path) is not None
-        
         req.user = users.get_current_user()
         if (req.user):
             req.mAllow.add('user')
@@ -169,50 +326,44 @@ class ReqFilter(object):
         if req.fAdmin:
             req.mAllow.add('admin')
 
-        # Client apikey: ip~rate
-        # TODO: Not rate-limiting yet
-        try:
-            sAPI = SGetSigned(req, 'api-IP', req.mParams['apikey'])
-
-            rgAPI = sAPI.split('~')
-            ip = str(rgAPI[0])
-            rate = int(rgAPI[1])
-            if req.ipAddress == ip:
-                req.mAllow.update(['api', 'write'])
-        except: pass
-        
+        # Values are only computed if a template (or view) reads them
         AddToResponse(req, {
             # Elapsed time evaluates when USED
             'elapsed': req.sResponseTime,
             'now': req.dtNow,
             'host': req.sHost,
             'request': req,
-            'app_version': os.environ['CURRENT_VERSION_ID'],
     
             'csrf': req.uid,
             'user': req.user,
-            'is_admin': req.FAllow('admin'),
-            'is_user': req.FAllow('user'),
-            'is_adult': req.FAllow('adult'),
-            'is_debug': settings.DEBUG,
-    
-            'site_name': settings.sSiteName,
-            'site_host': settings.sSiteHost,
-            'site_domain': settings.sSiteDomain,
-            'site_title': settings.sSiteTitle,
-            'site_tagline': settings.sSiteTagline,
-            'site_admin': "%s (%s)" % (settings.ADMINS[0][1], settings.ADMINS[0][0]),
-            'twitter_source': settings.sTwitterSource,
-            'twitter_user': settings.sTwitterUser,
-    
-            'analytics_code': settings.sAnalyticsCode,
-            'ad_publisher_id': settings.sAdPublisherID,
+            'is_admin': Lazy(req.FAllow, 'admin'),
+            'is_user': Lazy(req.FAllow, 'user'),
+            'is_adult': Lazy(req.FAllow, 'adult'),
             
-            'logout': users.create_logout_url(req.get_full_path()),
-            'login': users.create_login_url(req.get_full_path())
+            'logout': Lazy(lambda: users.create_logout_url(req.get_full_path())),
+            'login': Lazy(lambda: users.create_login_url(req.get_full_path()))
         })
         
+    def process_view(self, req, view_func, args, kwargs):
+        timing.begin_view(req, view_func)
+        if not timing.should_profile():
+            return None
+        
+        try:
+            return timing.profile_call(req, view_func, req, *args, **kwargs)
+        except Exception, e:
+            # Exceptions raised by process_view are not passed to process_exception
+            resp = self.process_exception(req, e)
+            if resp is None:
+                raise
+            return resp
+        
     def process_response(self, req, resp):
+        if req.fLimited:
+            patch_response_headers(resp, 0)
+            timing.finish(req)
+            return resp
+
         req.mCookies['user-tracking'] = req.uidSigned
 
         for name in req.mCookies:
@@ -223,16 +374,18 @@ class ReqFilter(object):
                 
         # Save POST-AJAX requests to memcache so they can be picked up by /get-results
         # method on a subsequent request.
-        if req.fJSON and req.method == 'POST':
-            if 'sid' in req.mParams and 'rid' in req.mParams:
-                key = "get-result~%s~%s" % (req.mParams['sid'], req.mParams['rid'])
-                logging.info("save for: %s" % key)
-                memcache.set(key, resp, 60)
-                return HttpJSON(req, {'message':'/get-result.json?sid:%s&ridPost:%s available for 60 secs' %
-                                      (req.mParams['sid'], req.mParams['rid'])})
+        if FDeferredResult(req):
+            store = results.get_store()
+            logging.info("save for: %s~%s" % (req.mParams['sid'], req.mParams['rid']))
+            store.save(req.mParams['sid'], req.mParams['rid'], resp)
+            resp = HttpJSON(req, {'message':'/get-result.json?sid:%s&ridPost:%s available for %d secs' %
+                                  (req.mParams['sid'], req.mParams['rid'], store.secs)})
+            timing.finish(req)
+            return resp
         
         patch_response_headers(resp, req.secsCache)
         resp['Expires'] = http_date(time.time() + req.secsCache)
+        timing.finish(req)
         return resp
         
     def process_exception(self, req, e):
@@ -299,12 +452,17 @@ def admin_only(func):
 
     return _admin_only
 
+@timing.timed('cache')
 def once_per_user(req, sKey):
-    sMemKey = 'user.once.%s.%s' % (req.uid, sKey)
-    if memcache.get(sMemKey):
-        return False
-    memcache.set(sMemKey, True)
-    return True
+    # add() is atomic - only the first caller for the key succeeds
+    return cache.get_cache('once').add('user.once.%s.%s' % (req.uid, sKey), True)
+
+@timing.timed('cache')
+def once_per_user_multi(req, sKeys):
+    """ Return the subset of sKeys not seen before for this user (one memcache call) """
+    sPrefix = 'user.once.%s.' % req.uid
+    rgNotSet = cache.get_cache('once').add_multi(dict([(sKey, True) for sKey in sKeys]), key_prefix=sPrefix)
+    return set(sKeys) - set(rgNotSet)
 
 def SGenUID():
     # Generate a unique user ID: IP~Date~Random
@@ -326,19 +484,73 @@ def Loopback(req):
     return HttpJSON(req, mData)
     
 def get_result(req):
+    """
+    Return deferred result(s) of earlier POST-AJAX calls.
+    
+        ?sid=...&ridPost=rid - returns the saved response itself
+        ?sid=...&rids=rid1,rid2,... - returns {results: {rid: result, ...}, missing: [rid, ...]}
+    """
     if (req.method != 'GET'):
         raise Error("/get-result must use GET method")
-
-    resp = None
+    
+    sid = req.mParams.get('sid')
+    store = results.get_store()
+    
+    if 'rids' in req.mParams:
+        rids = [rid for rid in req.mParams['rids'].split(',') if rid]
+        logging.info("recall for sid: %s rids: %r" % (sid, rids))
+        mRecords = store.load_multi(sid, rids)
+        mResults = {}
+        for rid in mRecords:
+            sJSON = results.json_body(mRecords[rid])
+            if sJSON is not None:
+                mResults[rid] = JavaScript(sJSON)
+        return HttpJSON(req, {'results': mResults,
+                              'missing': [rid for rid in rids if rid not in mResults]})
+
+    rid = req.mParams.get('ridPost')
+    logging.info("recall for sid: %s rid: %s" % (sid, rid))
+    record = store.load(sid, rid)
+    if record is None:
+        raise Error("Deferred result for sid:%s&rid:%s not available." % (sid, rid))
+    raise DirectResponse(results.response(record))
+
+def TimingsAPI(req):
+    """
+    Admin-only: per-view request latency percentiles and recent profiles.
+    
+        ?reset=1 - clear the histograms (after reading them)
+    """
+    Require(req, 'admin')
+    mTimings = {'views': timing.stats.summary(),
+                'since': datetime.fromtimestamp(timing.stats.dtReset),
+                'profile_rate': timing.profile_rate(),
+                'profiles': timing.profiles,
+                'cache': cache.stats(),
+                }
+    if req.mParams.get('reset'):
+        timing.stats.reset()
+    return HttpJSON(req, mTimings)
+
+def ProfileAPI(req):
+    """
+    Admin-only: set the fraction of requests to run under the profiler (all instances).
+    
+        ?rate=0.01 - profile 1% of requests (0 to disable)
+    """
+    Require(req, 'admin')
     try:
-        key = "get-result~%s~%s" % (req.mParams['sid'], req.mParams['ridPost'])
-        logging.info("recall for key: %s" % key)
-        resp = memcache.get(key)
-    except: pass
-    if resp == None:
-        raise Error("Deferred result for sid:%s&rid:%s not available." %
-                    (req.mParams['sid'], req.mParams['ridPost']))
-    raise DirectResponse(resp)
+        rate = float(req.mParams['rate'])
+    except:
+        raise Error("Missing or invalid rate parameter.")
+    if rate < 0 or rate > 1:
+        raise Error("Profile rate must be between 0 and 1.")
+    timing.set_profile_rate(rate)
+    return HttpJSON(req, {'profile_rate': rate})
+
+def FDeferredResult(req):
+    """ POST-AJAX requests with a sid and rid have their results saved for /get-result.json """
+    return req.fJSON and req.method == 'POST' and 'sid' in req.mParams and 'rid' in req.mParams
 
 def HttpError(req, sError, obj=None):
     if obj is None:
@@ -358,17 +570,78 @@ def HttpError(req, sError, obj=None):
     logging.info("Error: %r" % obj)
     AddToResponse(req, obj)
     AddToResponse(req, {'status_major': obj['status'].split('/')[0]})
-    resp = HttpResponse(t.render(RequestContext(req)))
+    secsStart = time.time()
+    sHTML = t.render(RequestContext(req))
+    timing.add('render', time.time() - secsStart)
+    resp = HttpResponse(sHTML)
     resp.status_code = http_status
     return resp
 
-def HttpJSON(req, obj=None):
+def HttpJSON(req, obj=None, fStream=None):
+    """
+    Return obj as a JSONP response: callback(obj);
+    
+    Compact JSON (no whitespace) is returned unless pretty-printing is enabled for debugging
+    (settings.JSON_COMPACT defaults to not DEBUG).
+    
+    If fStream is True (default: settings.JSON_STREAM), the response content is an iterator
+    over the encoded JSON - the response is never held in memory as a single string.
+    """
     if obj is None:
         obj = {}
     if 'status' not in obj:
         obj['status'] = 'OK'
     req.SetCacheTime(0)
-    resp = HttpResponse("%s(%s);" % (req.mParams.get("callback", "Callback"), simplejson.dumps(obj, cls=JavaScriptEncoder, indent=4)), mimetype="application/x-javascript")
+    sCallback = req.mParams.get("callback", "Callback")
+    
+    if getattr(settings, 'JSON_COMPACT', not settings.DEBUG):
+        encoder = JavaScriptEncoder(separators=(',', ':'))
+    else:
+        encoder = JavaScriptEncoder(indent=4)
+        
+    if fStream is None:
+        fStream = getattr(settings, 'JSON_STREAM', False)
+    # Deferred results are saved as a whole - no need to stream them
+    if fStream and not FDeferredResult(req):
+        return HttpResponse(JSONPChunks(sCallback, encoder.iterencode(obj)), mimetype="application/x-javascript")
+    
+    secsStart = time.time()
+    sJSON = encoder.encode(obj)
+    timing.add('json', time.time() - secsStart)
+    resp = HttpResponse("%s(%s);" % (sCallback, sJSON), mimetype="application/x-javascript")
+    # Kept for the deferred result store (results.json_body)
+    resp.sCallback = sCallback
+    resp.sJSON = sJSON
+    return resp
+
+def JSONPChunks(sCallback, chunks, cbChunk=8192):
+    """
+    Wrap the encoded JSON chunks in a JSONP callback - coalescing the (many, tiny) encoder
+    chunks into strings of about cbChunk bytes.
+    """
+    rgBuffer = [sCallback, '(']
+    cb = 0
+    for chunk in chunks:
+        rgBuffer.append(chunk)
+        cb += len(chunk)
+        if cb >= cbChunk:
+            yield ''.join(rgBuffer)
+            rgBuffer = []
+            cb = 0
+    rgBuffer.append(');')
+    yield ''.join(rgBuffer)
+
+def HttpRateLimited(req):
+    """
+    Reject a request from a client over its rate limit - without rendering any template.
+    """
+    req.fLimited = True
+    if req.fJSON:
+        return HttpJSON(req, {'status': 'Fail/RateLimit', 'message': "Rate limit exceeded."})
+    
+    resp = HttpResponse("Rate limit exceeded - please try again later.", mimetype="text/plain")
+    resp.status_code = 503
+    resp['Retry-After'] = '60'
     return resp
 
 regRSSExt = re.compile(r".rss$")
@@ -406,6 +679,84 @@ def SetCacheTime(req, secs):
 def GetContext(req):
     return req.mResponse
 
+class Lazy(object):
+    """
+    A context value which is computed (by calling func(*args)) only when it is first read
+    from a LazyContext.
+    """
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        
+class LazyContext(dict):
+    """
+    Context dictionary which evaluates (and memoizes) Lazy values when they are read.
+    
+    Keys not set in this dictionary are read from base - shared by all requests and
+    never modified.
+    """
+    def __init__(self, base=None):
+        dict.__init__(self)
+        if base is None:
+            base = {}
+        self.base = base
+        
+    def __getitem__(self, key):
+        try:
+            value = dict.__getitem__(self, key)
+        except KeyError:
+            value = self.base[key]
+        if isinstance(value, Lazy):
+            value = value.func(*value.args)
+            dict.__setitem__(self, key, value)
+        return value
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+        
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.base
+    
+    has_key = __contains__
+    
+    def keys(self):
+        keys = set(self.base)
+        keys.update(dict.keys(self))
+        return list(keys)
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+    
+def StaticContext():
+    """ Context values derived from settings - computed once per process. """
+    global _static_context
+    if _static_context is None:
+        _static_context = {
+            'app_version': os.environ['CURRENT_VERSION_ID'],
+            'is_debug': settings.DEBUG,
+            
+            'site_name': settings.sSiteName,
+            'site_host': settings.sSiteHost,
+            'site_domain': settings.sSiteDomain,
+            'site_title': settings.sSiteTitle,
+            'site_tagline': settings.sSiteTagline,
+            'site_admin': "%s (%s)" % (settings.ADMINS[0][1], settings.ADMINS[0][0]),
+            'twitter_source': settings.sTwitterSource,
+            'twitter_user': settings.sTwitterUser,
+    
+            'analytics_code': settings.sAnalyticsCode,
+            'ad_publisher_id': settings.sAdPublisherID,
+            }
+    return _static_context
+
+_static_context = None
+
 """
 JSON encoder helpers
 """
@@ -430,6 +781,7 @@ class JavaScript(simplejson.encoder.Atomic):
     def __str__(self):
         return self.st;
     
+@timing.timed('render')
 def RenderResponse(sTemplate, mVars=None, mimetype=None):
     req = get_request()
     return render_to_response(sTemplate, dictionary=mVars, context_instance=RequestContext(req), mimetype=mimetype)
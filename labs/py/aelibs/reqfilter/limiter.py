@@ -0,0 +1,123 @@
+"""
+Request rate limiting for ReqFilter.
+
+Each client (IP address or API key) is tracked by a decaying rate accumulator
+(timescore.calc.RateLimit), kept in a pluggable store:
+
+    LocalRateStore - process-local, LRU bounded (no network round-trips)
+    MemcacheRateStore - shared by all instances through atomic memcache counters
+        (timescore.calc.MemRate)
+
+Optional settings.py values:
+
+    RATE_LIMIT_BACKEND = 'local'    # or 'memcache'
+    RATE_LIMIT_IP_RPM = 300         # Requests per minute per IP address (default None - off)
+    RATE_LIMIT_SECS_HALF = 60       # Half-life of the rate accumulators
+    RATE_LIMIT_MAX_CLIENTS = 10000  # Size of the local store
+"""
+
+import threading
+import logging
+
+import settings
+import cache
+import timing
+
+def _calc():
+    # timescore imports reqfilter - import on first use
+    from timescore import calc
+    return calc
+
+def threshold_from_rpm(rpm, secs_half):
+    """ Return the RateLimit threshold which admits a steady stream of rpm requests per minute """
+    return _calc().threshold_from_rpm(rpm, secs_half)
+
+def _new_rate(threshold, secs_half):
+    return _calc().RateLimit(threshold, secs_half)
+
+class LocalRateStore(object):
+    """ Rate accumulators held in this process only """
+    def __init__(self, max_items=10000):
+        self.rates = cache.LRUCache(max_items)
+        self._lock = threading.Lock()
+
+    def is_exceeded(self, key, threshold, secs_half, secs):
+        self._lock.acquire()
+        try:
+            rate = self.rates.get(key)
+            if rate is None:
+                rate = _new_rate(threshold, secs_half)
+                self.rates.set(key, rate)
+            rate.threshold = threshold
+            # Requests (with whole-second times) can reach the lock out of order - a request
+            # from an earlier second is counted at the latest time seen
+            return rate.is_exceeded(max(secs, rate.secs_last))
+        finally:
+            self._lock.release()
+
+class MemcacheRateStore(object):
+    """
+    Rate accumulators shared through memcache - see timescore.calc.MemRate.
+
+    client defaults to the shared cache (cache.get_client()) - pass a cache.LocalMemcache()
+    to run locally.
+    """
+    def __init__(self, client=None, prefix='limit~'):
+        if client is None:
+            client = cache.get_cache('rate')
+        self.client = client
+        self.prefix = prefix
+
+    @timing.timed('cache')
+    def is_exceeded(self, key, threshold, secs_half, secs):
+        rate = _calc().MemRate(self.prefix + key, secs_half=secs_half, client=self.client,
+                               threshold=threshold)
+        return rate.is_exceeded(secs)
+
+class Limiter(object):
+    """
+    Enforce requests-per-minute limits for named clients.
+
+    Usage:
+
+        limiter = Limiter(LocalRateStore())
+        if limiter.is_exceeded('ip~%s' % req.ipAddress, 300, req.secsNow):
+            ...reject the request
+    """
+    def __init__(self, store, secs_half=60):
+        self.store = store
+        self.secs_half = secs_half
+        self._thresholds = {}
+
+    def is_exceeded(self, key, rpm, secs):
+        """
+        Record a request for key at time secs, returning True if it would exceed
+        rpm requests per minute (the request is not counted in that case).
+        """
+        if not rpm:
+            return False
+        threshold = self._thresholds.get(rpm)
+        if threshold is None:
+            threshold = self._thresholds[rpm] = threshold_from_rpm(rpm, self.secs_half)
+        if self.store.is_exceeded(key, threshold, self.secs_half, secs):
+            logging.info("Rate limit exceeded: %s (%s rpm)" % (key, rpm))
+            return True
+        return False
+
+def get_limiter():
+    """ Return the process-wide Limiter, configured from settings. """
+    global _limiter
+    if _limiter is None:
+        backend = getattr(settings, 'RATE_LIMIT_BACKEND', 'local')
+        if backend == 'memcache':
+            store = MemcacheRateStore()
+        else:
+            store = LocalRateStore(getattr(settings, 'RATE_LIMIT_MAX_CLIENTS', 10000))
+        _limiter = Limiter(store, getattr(settings, 'RATE_LIMIT_SECS_HALF', 60))
+    return _limiter
+
+_limiter = None
+
+def ip_rpm():
+    """ The per-IP address limit - None (no limit) unless RATE_LIMIT_IP_RPM is set """
+    return getattr(settings, 'RATE_LIMIT_IP_RPM', None)
@@ -0,0 +1,122 @@
+"""
+Deferred results for POST-AJAX calls (picked up via /get-result.json).
+
+Only the response status, headers and body are saved - bodies larger than cbCompress
+bytes are zlib compressed.  The JSON of a JSONP response (HttpJSON) is saved apart from
+its callback, so it can be returned as is in a combined result.  Several results can be
+read back in one cache round-trip.
+
+Optional settings.py values:
+
+    DEFERRED_RESULT_BACKEND = 'memcache'    # or 'local' (in-process, for testing)
+    DEFERRED_RESULT_SECS = 60               # Time a result is available
+    DEFERRED_RESULT_MAX_BYTES = 8*1024*1024 # Size of the 'local' store
+"""
+
+import zlib
+
+from django.http import HttpResponse
+
+import settings
+import cache
+import timing
+
+class ResultStore(object):
+    """
+    Save and recall deferred results in a memcache(-like) client.
+
+    client defaults to the shared cache (cache.get_client()).
+    """
+    def __init__(self, client=None, secs=60, cbCompress=1024, prefix='get-result~'):
+        if client is None:
+            client = cache.get_cache('get-result')
+        self.client = client
+        self.secs = secs
+        self.cbCompress = cbCompress
+        self.prefix = prefix
+
+    @timing.timed('cache')
+    def save(self, sid, rid, resp):
+        self.client.set(self._key(sid, rid), self.record(resp), self.secs)
+
+    def load(self, sid, rid):
+        """ Return the saved record for sid/rid - or None if not available. """
+        return self.load_multi(sid, [rid]).get(rid)
+
+    @timing.timed('cache')
+    def load_multi(self, sid, rids):
+        """ Return a dictionary of the available records for the given rids. """
+        mRecords = self.client.get_multi([self._key(sid, rid) for rid in rids])
+        mResults = {}
+        for rid in rids:
+            record = mRecords.get(self._key(sid, rid))
+            if record is not None:
+                mResults[rid] = record
+        return mResults
+
+    def record(self, resp):
+        """
+        Return a compact (picklable) record of the response:
+        (status, headers, body, fCompressed, callback).
+        
+        For a JSONP response (with sCallback and sJSON set by HttpJSON) the body is the JSON
+        alone - otherwise callback is None.
+        """
+        sCallback = getattr(resp, 'sCallback', None)
+        if sCallback is not None:
+            sBody = resp.sJSON
+        else:
+            sBody = resp.content
+        fCompressed = len(sBody) > self.cbCompress
+        if fCompressed:
+            sBody = zlib.compress(sBody)
+        return (resp.status_code, resp.items(), sBody, fCompressed, sCallback)
+
+    def _key(self, sid, rid):
+        return "%s%s~%s" % (self.prefix, sid, rid)
+
+def body(record):
+    """ Return the body of the saved response. """
+    sBody = _saved_body(record)
+    sCallback = _callback(record)
+    if sCallback is not None:
+        sBody = "%s(%s);" % (sCallback, sBody)
+    return sBody
+
+def response(record):
+    """ Rebuild an HttpResponse from a saved record. """
+    resp = HttpResponse(body(record))
+    resp.status_code = record[0]
+    for sHeader, sValue in record[1]:
+        resp[sHeader] = sValue
+    return resp
+
+def json_body(record):
+    """ Return the JSON (without the JSONP callback wrapper) of a saved JSON response - else None. """
+    if _callback(record) is None:
+        return None
+    return _saved_body(record)
+
+def _saved_body(record):
+    sBody = record[2]
+    if record[3]:
+        sBody = zlib.decompress(sBody)
+    return sBody
+
+def _callback(record):
+    # (Records saved before callbacks were kept apart have only 4 fields)
+    if len(record) < 5:
+        return None
+    return record[4]
+
+def get_store():
+    """ Return the process-wide ResultStore, configured from settings. """
+    global _store
+    if _store is None:
+        client = None
+        if getattr(settings, 'DEFERRED_RESULT_BACKEND', 'memcache') == 'local':
+            client = cache.LocalMemcache(max_bytes=getattr(settings, 'DEFERRED_RESULT_MAX_BYTES', 8*1024*1024))
+        _store = ResultStore(client, getattr(settings, 'DEFERRED_RESULT_SECS', 60))
+    return _store
+
+_store = None
@@ -0,0 +1,96 @@
+"""
+Request classification and fast URL dispatch.
+
+Router wraps a list of Django url patterns and is used as the (only) entry in urls.py:
+
+    urlpatterns = [reqfilter.Router(
+        reqfilter.json_urls() +
+        patterns('',
+            (r'^$', views.home),
+            (jscomposer.ScriptPattern(), jscomposer.ScriptFile),
+            ...
+        ))]
+
+Patterns which match one literal path (e.g. r'^init.json$') are dispatched with a single
+dictionary lookup; the remaining patterns are tried in order (as Django does).  The first
+matching pattern (in the original order) is always the one selected.
+
+Router is a RegexURLResolver (for the pattern '^') - so reverse() and {% url %} find the
+named patterns and views inside it, and a path no pattern matches raises Resolver404.
+"""
+
+import re
+
+from django.core.urlresolvers import RegexURLResolver, Resolver404
+
+def request_kind(path):
+    """ Classify a request path as 'json', 'rss' or 'html' (by suffix) """
+    if path.endswith('.json'):
+        return 'json'
+    if path.endswith('.rss'):
+        return 'rss'
+    return 'html'
+
+# ^literal$ - where literal can include escaped \. and un-escaped . (matches itself, too)
+regLiteral = re.compile(r"^\^((?:[\w\-/~,]|\\\.|\.)*)\$$")
+
+def literal_path(sPattern):
+    """ Return the single path matched by a url pattern - or None if it matches more than one """
+    m = regLiteral.match(sPattern)
+    if m is None:
+        return None
+    return m.group(1).replace('\\.', '.')
+
+class Router(RegexURLResolver):
+    def __init__(self, urlpatterns):
+        self.urlpatterns = list(urlpatterns)
+        RegexURLResolver.__init__(self, r'^', self.urlpatterns)
+        # path -> first pattern (in order) that matches the literal path
+        self.mExact = {}
+        # Patterns that can match other than a single literal path (in order)
+        self.rgPatterns = []
+
+        for pattern in self.urlpatterns:
+            sPattern = pattern.regex.pattern
+            sPath = literal_path(sPattern)
+            if sPath is not None and sPath not in self.mExact:
+                # An earlier pattern could also match this path (and would take precedence)
+                for patternBefore in self.rgPatterns:
+                    if patternBefore.regex.search(sPath):
+                        self.mExact[sPath] = patternBefore
+                        break
+                else:
+                    self.mExact[sPath] = pattern
+            # An un-escaped '.' matches other characters as well
+            if sPath is None or '.' in sPattern.replace('\\.', ''):
+                self.rgPatterns.append(pattern)
+
+    def resolve(self, path):
+        """ Return (view, args, kwargs) for the path - raises Resolver404 if no pattern matches. """
+        rgPatterns = self.rgPatterns
+        pattern = self.mExact.get(path)
+        if pattern is not None:
+            try:
+                match = pattern.resolve(path)
+            except Resolver404:
+                match = None
+            if match:
+                return match
+            # (An included resolver which matched the prefix only) - try every pattern in order
+            rgPatterns = self.urlpatterns
+
+        rgTried = []
+        for pattern in rgPatterns:
+            try:
+                match = pattern.resolve(path)
+            except Resolver404, e:
+                rgSubTried = e.args[0].get('tried')
+                if rgSubTried is None:
+                    rgTried.append(pattern.regex.pattern)
+                else:
+                    rgTried.extend([pattern.regex.pattern + '   ' + sTried for sTried in rgSubTried])
+                continue
+            if match:
+                return match
+            rgTried.append(pattern.regex.pattern)
+        raise Resolver404, {'tried': rgTried, 'path': path}
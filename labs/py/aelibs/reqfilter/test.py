@@ -0,0 +1,260 @@
+"""
+Tests for reqfilter - run from the reqfilter directory, with the application (settings.py)
+on the path:
+
+    PYTHONPATH=<app dir> python test.py
+"""
+import sys
+
+import unittest
+
+# cache is in the parent (aelibs) directory
+sys.path.insert(0, '..')
+
+import limiter
+
+_missing = object()
+
+class TestLimiter(unittest.TestCase):
+    def admitted(self, store, threshold, secs, n=1000):
+        cAdmitted = 0
+        for i in range(n):
+            if not store.is_exceeded('ip~1', threshold, 60, secs):
+                cAdmitted += 1
+        return cAdmitted
+
+    def test_burst(self):
+        # A same-second burst is admitted up to the threshold (about 1.44 minutes of requests)
+        for rpm, cBurst in ((60, 87), (300, 433)):
+            store = limiter.LocalRateStore()
+            threshold = limiter.threshold_from_rpm(rpm, 60)
+            self.assertEqual(self.admitted(store, threshold, 1000), cBurst)
+            # Half has decayed a half-life later
+            self.assertEqual(self.admitted(store, threshold, 1060), cBurst // 2)
+            # ... and (nearly) all of it after 10 half-lives
+            self.assertEqual(self.admitted(store, threshold, 1660), cBurst - 1)
+
+    def test_steady(self):
+        # Requests evenly spaced at the limit are all admitted - one more each second is not
+        store = limiter.LocalRateStore()
+        threshold = limiter.threshold_from_rpm(60, 60)
+        for i in range(600):
+            self.assertFalse(store.is_exceeded('ip~1', threshold, 60, 1000 + i))
+        self.assertEqual(self.admitted(store, threshold, 1600, 2), 1)
+
+    def test_ip_rpm(self):
+        # The per-IP limit is off unless set
+        import settings
+        rpmSaved = getattr(settings, 'RATE_LIMIT_IP_RPM', _missing)
+        try:
+            if rpmSaved is not _missing:
+                del settings.RATE_LIMIT_IP_RPM
+            self.assertEqual(limiter.ip_rpm(), None)
+            settings.RATE_LIMIT_IP_RPM = 300
+            self.assertEqual(limiter.ip_rpm(), 300)
+        finally:
+            if rpmSaved is _missing:
+                del settings.RATE_LIMIT_IP_RPM
+            else:
+                settings.RATE_LIMIT_IP_RPM = rpmSaved
+
+    def test_out_of_order(self):
+        # A request from the previous second, reaching the store after a newer one, is counted
+        store = limiter.LocalRateStore()
+        threshold = limiter.threshold_from_rpm(60, 60)
+        self.assertFalse(store.is_exceeded('ip~1', threshold, 60, 1001))
+        self.assertFalse(store.is_exceeded('ip~1', threshold, 60, 1000))
+        self.assertFalse(store.is_exceeded('ip~1', threshold, 60, 1001))
+        rate = store.rates.get('ip~1')
+        self.assertEqual(rate.secs_last, 1001)
+        self.assertAlmostEqual(rate.value, 3.0)
+
+class TestSigner(unittest.TestCase):
+    # filter needs Django and the App Engine SDK - imported by these tests only
+    def test_unicode_secret(self):
+        import filter
+        # Globals.SGet returns the (datastore) secret as unicode
+        signer = filter.Signer(u'test server key')
+        sHash = signer.hash('uid', 'user~1')
+        self.assertEqual(sHash, filter.Signer('test server key').hash('uid', 'user~1'))
+        self.assert_(signer.verify('uid', 'user~1', sHash))
+        self.assertFalse(signer.verify('uid', 'user~2', sHash))
+        self.assert_(filter.Signer(u'cl\xe9').verify('uid', u'\xe9', filter.Signer(u'cl\xe9').hash('uid', u'\xe9')))
+
+    def test_equal_constant(self):
+        import filter
+        self.assert_(filter.FEqualConstant('ABC', 'ABC'))
+        self.assertFalse(filter.FEqualConstant('ABC', 'ABD'))
+        self.assertFalse(filter.FEqualConstant('ABC', 'AB'))
+
+class TestLazyContext(unittest.TestCase):
+    # filter needs Django and the App Engine SDK - imported by these tests only
+    def setUp(self):
+        import filter
+        self.filter = filter
+        self.rgCalls = []
+
+    def value(self, sName):
+        self.rgCalls.append(sName)
+        return sName.upper()
+
+    def context(self):
+        filter = self.filter
+        mBase = {'site': 'base', 'static': filter.Lazy(self.value, 'static')}
+        ctx = filter.LazyContext(mBase)
+        ctx.update({'a': filter.Lazy(self.value, 'a'), 'b': filter.Lazy(self.value, 'b'), 'c': 1})
+        return ctx, mBase
+
+    def test_lazy(self):
+        ctx, mBase = self.context()
+        self.assertEqual(self.rgCalls, [])
+        self.assertEqual(ctx['a'], 'A')
+        self.assertEqual(ctx['a'], 'A')
+        self.assertEqual(ctx.get('a'), 'A')
+        self.assertEqual(self.rgCalls, ['a'])
+        self.assertEqual(ctx['c'], 1)
+        self.assertEqual(ctx['site'], 'base')
+        self.assertRaises(KeyError, ctx.__getitem__, 'missing')
+        self.assertEqual(ctx.get('missing', 2), 2)
+        # A lazy base value is memoized for this context only - the shared base is never modified
+        self.assertEqual(ctx['static'], 'STATIC')
+        self.assertEqual(ctx['static'], 'STATIC')
+        self.assertEqual(self.rgCalls, ['a', 'static'])
+        self.assert_(isinstance(mBase['static'], self.filter.Lazy))
+        self.assertEqual(self.context()[0]['static'], 'STATIC')
+        self.assertEqual(self.rgCalls, ['a', 'static', 'static'])
+
+    def test_contains(self):
+        ctx, mBase = self.context()
+        for key in ('a', 'c', 'site', 'static'):
+            self.assert_(key in ctx, key)
+            self.assert_(ctx.has_key(key), key)
+        self.failIf('missing' in ctx)
+        # Testing for a key does not evaluate it
+        self.assertEqual(self.rgCalls, [])
+        self.assertEqual(sorted(ctx.keys()), ['a', 'b', 'c', 'site', 'static'])
+        self.assertEqual(dict(ctx.items())['b'], 'B')
+
+    def test_django_context(self):
+        # As RequestContext - the context processor returns the LazyContext
+        from django.template import Context, Template
+        ctx, mBase = self.context()
+        context = Context()
+        context.update(ctx)
+        self.assert_('a' in context)
+        self.assert_('static' in context)
+        self.failIf('missing' in context)
+        self.assertEqual(context['a'], 'A')
+        self.assertEqual(context.get('static'), 'STATIC')
+        self.assertEqual(Template("{{ a }} {{ site }} {% if c %}{{ missing }}{% endif %}").render(context),
+                         "A base ")
+        # b is never used - never computed
+        self.assertEqual(sorted(self.rgCalls), ['a', 'static'])
+
+    def test_static(self):
+        import os
+        import settings
+        filter = self.filter
+        os.environ.setdefault('CURRENT_VERSION_ID', '1.1')
+        filter._static_context = None
+        mStatic = filter.StaticContext()
+        self.assert_(filter.StaticContext() is mStatic)
+        ctx = filter.LazyContext(mStatic)
+        ctx['site_name'] = 'other'
+        self.assertEqual(ctx['site_name'], 'other')
+        self.assertEqual(ctx['is_debug'], mStatic['is_debug'])
+        self.assertEqual(filter.StaticContext()['site_name'], settings.sSiteName)
+
+class TestResults(unittest.TestCase):
+    # results needs Django (and settings) - imported by these tests only
+    def setUp(self):
+        import cache
+        import results
+        self.results = results
+        self.client = cache.LocalMemcache()
+        self.store = results.ResultStore(self.client)
+
+    def json_response(self, sCallback, sJSON):
+        # As filter.HttpJSON
+        from django.http import HttpResponse
+        resp = HttpResponse("%s(%s);" % (sCallback, sJSON), mimetype="application/x-javascript")
+        resp.sCallback = sCallback
+        resp.sJSON = sJSON
+        return resp
+
+    def test_compress(self):
+        from django.http import HttpResponse
+        results = self.results
+        sBig = 'x' * 1025
+        resp = HttpResponse(sBig, mimetype="text/plain")
+        resp.status_code = 202
+        self.store.save('s', 'big', resp)
+        self.store.save('s', 'small', HttpResponse('x' * 1024))
+        # Only the larger body is stored compressed
+        sStored = self.client.get(self.store._key('s', 'big'))[2]
+        self.assert_(len(sStored) < 100)
+        self.assertEqual(self.client.get(self.store._key('s', 'small'))[2], 'x' * 1024)
+        record = self.store.load('s', 'big')
+        self.assertEqual(results.body(record), sBig)
+        self.assertEqual(results.json_body(record), None)
+        respLoaded = results.response(record)
+        self.assertEqual(respLoaded.status_code, 202)
+        self.assertEqual(respLoaded.content, sBig)
+        self.assertEqual(respLoaded['Content-Type'], 'text/plain')
+
+    def test_json(self):
+        results = self.results
+        sJSON = '{"status":"OK","items":["%s"]}' % ('y' * 2000)
+        for sCallback in ('Callback', 'jQuery-1[2]', 'cb\n'):
+            self.store.save('s', 'r', self.json_response(sCallback, sJSON))
+            record = self.store.load('s', 'r')
+            self.assertEqual(results.json_body(record), sJSON)
+            self.assertEqual(results.body(record), "%s(%s);" % (sCallback, sJSON))
+            self.assertEqual(results.response(record).content, "%s(%s);" % (sCallback, sJSON))
+        # A record saved with the body whole has no separate JSON
+        self.assertEqual(results.json_body((200, [], 'Callback({});', False)), None)
+        self.assertEqual(results.body((200, [], 'Callback({});', False)), 'Callback({});')
+
+    def test_load_multi(self):
+        for rid in ('a', 'b', 'c'):
+            self.store.save('s', rid, self.json_response('Callback', '{"rid":"%s"}' % rid))
+        self.store.save('t', 'd', self.json_response('Callback', '{}'))
+        mRecords = self.store.load_multi('s', ['a', 'c', 'd', 'e'])
+        self.assertEqual(sorted(mRecords.keys()), ['a', 'c'])
+        self.assertEqual(self.results.json_body(mRecords['c']), '{"rid":"c"}')
+        self.assertEqual(self.store.load('s', 'e'), None)
+        self.assertEqual(self.store.load_multi('s', []), {})
+
+def view(req, **kwargs):
+    pass
+
+class TestRouter(unittest.TestCase):
+    # routing needs Django (and settings) - imported by these tests only
+    def resolver(self):
+        from django.conf.urls.defaults import patterns, url
+        from django.core.urlresolvers import RegexURLResolver
+        import routing
+        # As the root urls.py: urlpatterns = [Router(...)]
+        return RegexURLResolver(r'^/', [routing.Router(patterns('',
+            url(r'^init.json$', view, name='init'),
+            url(r'^about$', view, name='about'),
+            url(r'^tag/(?P<tag>[\w-]+)$', view, name='tag'),
+            ))])
+
+    def test_resolve(self):
+        resolver = self.resolver()
+        self.assertEqual(resolver.resolve('/about'), (view, (), {}))
+        self.assertEqual(resolver.resolve('/tag/python'), (view, (), {'tag': 'python'}))
+
+    def test_not_found(self):
+        from django.core.urlresolvers import Resolver404
+        self.assertRaises(Resolver404, self.resolver().resolve, '/no/such/page')
+
+    def test_reverse(self):
+        resolver = self.resolver()
+        self.assertEqual(resolver.reverse('about'), 'about')
+        self.assertEqual(resolver.reverse('tag', tag='python'), 'tag/python')
+        self.assertEqual(resolver.reverse(view, tag='python'), 'tag/python')
+
+if __name__ == '__main__':
+    unittest.main()
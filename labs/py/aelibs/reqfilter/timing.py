@@ -0,0 +1,226 @@
+"""
+Request timing and (sampled) profiling for ReqFilter.
+
+The time spent in each phase of a request is accumulated in req.mTimings:
+
+    setup - ReqFilter.process_request
+    view - the view function (includes the render, json and cache time spent within it)
+    render - template rendering
+    json - JSON encoding
+    cache - cache (memcache) calls
+    deferred - CacheFilter deferred writes to the store
+    total - the whole request (as seen by ReqFilter)
+
+When the request is done, timings are added to process-local, per-view latency histograms
+- available to admins from /admin/timings.json.
+
+A fraction of requests can be run under cProfile (the profile is logged and kept for
+/admin/timings.json).  The sample rate is set at runtime via /admin/profile.json?rate=0.01
+and shared by all instances through memcache.
+"""
+
+import threading
+import time
+import math
+import random
+import logging
+import cProfile
+import pstats
+import StringIO
+
+import cache
+
+PHASES = ('setup', 'view', 'render', 'json', 'cache', 'deferred', 'total')
+
+class Histogram(object):
+    """
+    Latency histogram with logarithmic buckets (each 10% wider than the last, starting
+    at 0.1 ms) - percentiles are accurate to within 10%.
+    """
+    secsMin = 0.0001
+    logGrowth = math.log(1.1)
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.secsTotal = 0.0
+        self.secsMax = 0.0
+
+    def add(self, secs):
+        i = 0
+        if secs > self.secsMin:
+            i = int(math.log(secs/self.secsMin)/self.logGrowth)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.count += 1
+        self.secsTotal += secs
+        self.secsMax = max(self.secsMax, secs)
+
+    def percentile(self, pct):
+        """ Return the (upper bound) latency of the pct'th percentile """
+        if self.count == 0:
+            return 0.0
+        nTarget = self.count * pct / 100.0
+        n = 0
+        for i in sorted(self.counts):
+            n += self.counts[i]
+            if n >= nTarget:
+                return min(self.secsMin * math.exp(self.logGrowth * (i + 1)), self.secsMax)
+        return self.secsMax
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.count and self.secsTotal / self.count,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'max': self.secsMax}
+
+class Stats(object):
+    """ Per-view histograms for each request phase """
+    def __init__(self):
+        self.mViews = {}
+        self.dtReset = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, sView, mTimings):
+        self._lock.acquire()
+        try:
+            mHists = self.mViews.get(sView)
+            if mHists is None:
+                mHists = self.mViews[sView] = {}
+            for sPhase, secs in mTimings.items():
+                hist = mHists.get(sPhase)
+                if hist is None:
+                    hist = mHists[sPhase] = Histogram()
+                hist.add(secs)
+        finally:
+            self._lock.release()
+
+    def summary(self):
+        self._lock.acquire()
+        try:
+            mSummary = {}
+            for sView, mHists in self.mViews.items():
+                mSummary[sView] = dict([(sPhase, hist.summary()) for sPhase, hist in mHists.items()])
+            return mSummary
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.mViews = {}
+            self.dtReset = time.time()
+        finally:
+            self._lock.release()
+
+stats = Stats()
+
+"""
+Per-request timing
+"""
+
+def begin(req):
+    req.mTimings = {}
+    req.secsStart = time.time()
+    req.secsView = None
+    req.sView = None
+    local.req = req
+
+def add(sPhase, secs, req=None):
+    """ Add secs to the time spent in sPhase by the current request """
+    if req is None:
+        req = getattr(local, 'req', None)
+        if req is None:
+            return
+    mTimings = getattr(req, 'mTimings', None)
+    if mTimings is not None:
+        mTimings[sPhase] = mTimings.get(sPhase, 0.0) + secs
+
+def timed(sPhase):
+    """
+    Function decorator to add the time spent in the function to a request phase.
+
+    Usage:
+
+        @timed('render')
+        def my_function()
+            ...
+    """
+    def _decorator(func):
+        def _timed(*args, **kwargs):
+            secsStart = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add(sPhase, time.time() - secsStart)
+        _timed.__name__ = func.__name__
+        _timed.__doc__ = func.__doc__
+        return _timed
+    return _decorator
+
+def begin_view(req, view_func):
+    req.secsView = time.time()
+    add('setup', req.secsView - req.secsStart, req)
+    req.sView = view_name(view_func)
+
+def finish(req):
+    """ Record the timings of a completed request """
+    if getattr(req, 'mTimings', None) is None:
+        return
+    secsNow = time.time()
+    if req.secsView is not None:
+        add('view', secsNow - req.secsView, req)
+    elif 'setup' not in req.mTimings:
+        add('setup', secsNow - req.secsStart, req)
+    add('total', secsNow - req.secsStart, req)
+    stats.record(req.sView or 'unknown', req.mTimings)
+    local.req = None
+
+def view_name(view_func):
+    return "%s.%s" % (getattr(view_func, '__module__', ''), getattr(view_func, '__name__', repr(view_func)))
+
+"""
+Sampled profiling
+"""
+
+sProfileKey = 'reqfilter.profile-rate'
+secsProfileCheck = 10
+_profile_rate = [0.0, 0]
+
+def profile_rate():
+    """ Fraction of requests to profile (re-read from memcache every secsProfileCheck seconds) """
+    rate, secsExpires = _profile_rate
+    secsNow = time.time()
+    if secsNow >= secsExpires:
+        rate = cache.get_cache('profile').get(sProfileKey) or 0.0
+        _profile_rate[:] = [rate, secsNow + secsProfileCheck]
+    return rate
+
+def set_profile_rate(rate):
+    cache.get_cache('profile').set(sProfileKey, float(rate))
+    _profile_rate[:] = [float(rate), time.time() + secsProfileCheck]
+
+def should_profile():
+    rate = profile_rate()
+    return rate > 0 and random.random() < rate
+
+def profile_call(req, func, *args, **kwargs):
+    """ Call func under cProfile - log and save the (top of the) profile for the request """
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func, *args, **kwargs)
+    finally:
+        stream = StringIO.StringIO()
+        pstat = pstats.Stats(prof, stream=stream)
+        pstat.sort_stats('cumulative')
+        pstat.print_stats(40)
+        sProfile = stream.getvalue()
+        logging.info("Profile of %s:\n%s" % (req.path, sProfile))
+        profiles.insert(0, {'path': req.path, 'view': req.sView, 'time': time.time(), 'profile': sProfile})
+        del profiles[cProfilesSaved:]
+
+cProfilesSaved = 10
+profiles = []
+
+local = threading.local()
@@ -0,0 +1,236 @@
+"""
+Micro-benchmark for the simplejson encoder.
+
+Compares JSONEncoder.encode (one-shot, accumulating a list) and JSONEncoder.iterencode
+(generators) with a copy of the earlier, method-based encoder (using the same string
+encoder) - on a typical API response.
+
+Usage (from the simplejson directory):
+
+    python bench.py [iterations]
+"""
+
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, '..')
+import simplejson
+from simplejson import encoder
+
+class ISODate(encoder.Atomic):
+    def __init__(self, dt):
+        self.dt = dt
+
+    def __str__(self):
+        return "namespace.ISODate(\"%sZ\")" % self.dt.isoformat()
+
+class LegacyJSONEncoder(simplejson.JSONEncoder):
+    """ The encoder as it was before _make_iterencode (methods and instance indent state) """
+    def __init__(self, *args, **kwargs):
+        simplejson.JSONEncoder.__init__(self, *args, **kwargs)
+        self.current_indent_level = 0
+
+    def _newline_indent(self):
+        return '\n' + (' ' * (self.indent * self.current_indent_level))
+
+    def _iterencode_list(self, lst, markers=None):
+        if not lst:
+            yield '[]'
+            return
+        if markers is not None:
+            markerid = id(lst)
+            if markerid in markers:
+                raise ValueError("Circular reference detected")
+            markers[markerid] = lst
+        yield '['
+        if self.indent is not None:
+            self.current_indent_level += 1
+            newline_indent = self._newline_indent()
+            separator = self.item_separator + newline_indent
+            yield newline_indent
+        else:
+            newline_indent = None
+            separator = self.item_separator
+        first = True
+        for value in lst:
+            if first:
+                first = False
+            else:
+                yield separator
+            for chunk in self._iterencode(value, markers):
+                yield chunk
+        if newline_indent is not None:
+            self.current_indent_level -= 1
+            yield self._newline_indent()
+        yield ']'
+        if markers is not None:
+            del markers[markerid]
+
+    def _iterencode_dict(self, dct, markers=None):
+        if not dct:
+            yield '{}'
+            return
+        if markers is not None:
+            markerid = id(dct)
+            if markerid in markers:
+                raise ValueError("Circular reference detected")
+            markers[markerid] = dct
+        yield '{'
+        key_separator = self.key_separator
+        if self.indent is not None:
+            self.current_indent_level += 1
+            newline_indent = self._newline_indent()
+            item_separator = self.item_separator + newline_indent
+            yield newline_indent
+        else:
+            newline_indent = None
+            item_separator = self.item_separator
+        first = True
+        if self.ensure_ascii:
+            encoder_ = encoder.encode_basestring_ascii
+        else:
+            encoder_ = encoder.encode_basestring
+        allow_nan = self.allow_nan
+        if self.sort_keys:
+            keys = dct.keys()
+            keys.sort()
+            items = [(k, dct[k]) for k in keys]
+        else:
+            items = dct.iteritems()
+        _encoding = self.encoding
+        _do_decode = (_encoding is not None
+            and not (_encoding == 'utf-8'))
+        for key, value in items:
+            if isinstance(key, str):
+                if _do_decode:
+                    key = key.decode(_encoding)
+            elif isinstance(key, basestring):
+                pass
+            # JavaScript is weakly typed for these, so it makes sense to
+            # also allow them.  Many encoders seem to do something like this.
+            elif isinstance(key, float):
+                key = encoder.floatstr(key, allow_nan)
+            elif isinstance(key, (int, long)):
+                key = str(key)
+            elif key is True:
+                key = 'true'
+            elif key is False:
+                key = 'false'
+            elif key is None:
+                key = 'null'
+            elif self.skipkeys:
+                continue
+            else:
+                raise TypeError("key %r is not a string" % (key,))
+            if first:
+                first = False
+            else:
+                yield item_separator
+            yield encoder_(key)
+            yield key_separator
+            for chunk in self._iterencode(value, markers):
+                yield chunk
+        if newline_indent is not None:
+            self.current_indent_level -= 1
+            yield self._newline_indent()
+        yield '}'
+        if markers is not None:
+            del markers[markerid]
+
+    def _iterencode(self, o, markers=None):
+        if isinstance(o, basestring):
+            if self.ensure_ascii:
+                encoder_ = encoder.encode_basestring_ascii
+            else:
+                encoder_ = encoder.encode_basestring
+            _encoding = self.encoding
+            if (_encoding is not None and isinstance(o, str)
+                    and not (_encoding == 'utf-8')):
+                o = o.decode(_encoding)
+            yield encoder_(o)
+        elif o is None:
+            yield 'null'
+        elif o is True:
+            yield 'true'
+        elif o is False:
+            yield 'false'
+        elif isinstance(o, (int, long)):
+            yield str(o)
+        elif isinstance(o, float):
+            yield encoder.floatstr(o, self.allow_nan)
+        elif isinstance(o, encoder.Atomic):
+            yield str(o)
+        elif isinstance(o, (list, tuple)):
+            for chunk in self._iterencode_list(o, markers):
+                yield chunk
+        elif isinstance(o, dict):
+            for chunk in self._iterencode_dict(o, markers):
+                yield chunk
+        else:
+            if markers is not None:
+                markerid = id(o)
+                if markerid in markers:
+                    raise ValueError("Circular reference detected")
+                markers[markerid] = o
+            for chunk in self._iterencode_default(o, markers):
+                yield chunk
+            if markers is not None:
+                del markers[markerid]
+
+    def _iterencode_default(self, o, markers=None):
+        newobj = self.default(o)
+        return self._iterencode(newobj, markers)
+
+
+    def encode(self, o):
+        return ''.join(list(self.iterencode(o)))
+
+    def iterencode(self, o):
+        if self.check_circular:
+            markers = {}
+        else:
+            markers = None
+        return self._iterencode(o, markers)
+
+def default(o):
+    if isinstance(o, datetime):
+        return ISODate(o)
+    raise TypeError("%r is not JSON serializable" % (o,))
+
+def response(cItems=50):
+    """ A list of models, as returned by an API call """
+    dt = datetime(2009, 11, 24, 12, 30)
+    return {'status': 'OK',
+            'items': [{'id': i,
+                       'title': u'Item number %d - <b>title</b>' % i,
+                       'url': 'http://example.com/items/%d' % i,
+                       'score': i * 1.25,
+                       'tags': ['one', 'two', 'three'],
+                       'flagged': i % 7 == 0,
+                       'owner': None,
+                       'created': dt,
+                       'stats': {'views': i * 100, 'votes': i, 'ratio': 0.5},
+                       } for i in xrange(cItems)],
+            'cursor': 'abc123',
+            }
+
+def report(sName, fn, n):
+    # Best of 5 runs
+    secs = min(timeit.Timer(fn).repeat(5, n))
+    print "%-40s %8.1f usec/call" % (sName, secs * 1e6 / n)
+
+def main(n=200):
+    obj = response()
+    legacy = LegacyJSONEncoder(default=default)
+    current = simplejson.JSONEncoder(default=default)
+    assert legacy.encode(obj) == current.encode(obj) == ''.join(current.iterencode(obj))
+    report("legacy encode", lambda: legacy.encode(obj), n)
+    report("iterencode (generators)", lambda: ''.join(current.iterencode(obj)), n)
+    report("encode (one-shot list)", lambda: current.encode(obj), n)
+
+if __name__ == '__main__':
+    n = 200
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    main(n)
@@ -48,33 +48,35 @@ def floatstr(o, allow_nan=True):
 
     return text
 
+def _replace(match):
+    return ESCAPE_DCT[match.group(0)]
+
 def encode_basestring(s):
     """
     Return a JSON representation of a Python string
     """
-    def replace(match):
-        return ESCAPE_DCT[match.group(0)]
-    return '"' + ESCAPE.sub(replace, s) + '"'
+    return '"' + ESCAPE.sub(_replace, s) + '"'
+
 
+def _replace_ascii(match):
+    s = match.group(0)
+    try:
+        return ESCAPE_DCT[s]
+    except KeyError:
+        n = ord(s)
+        if n < 0x10000:
+            return '\\u%04x' % (n,)
+        else:
+            # surrogate pair
+            n -= 0x10000
+            s1 = 0xd800 | ((n >> 10) & 0x3ff)
+            s2 = 0xdc00 | (n & 0x3ff)
+            return '\\u%04x\\u%04x' % (s1, s2)
 
 def py_encode_basestring_ascii(s):
     if isinstance(s, str) and HAS_UTF8.search(s) is not None:
         s = s.decode('utf-8')
-    def replace(match):
-        s = match.group(0)
-        try:
-            return ESCAPE_DCT[s]
-        except KeyError:
-            n = ord(s)
-            if n < 0x10000:
-                return '\\u%04x' % (n,)
-            else:
-                # surrogate pair
-                n -= 0x10000
-                s1 = 0xd800 | ((n >> 10) & 0x3ff)
-                s2 = 0xdc00 | (n & 0x3ff)
-                return '\\u%04x\\u%04x' % (s1, s2)
-    return '"' + str(ESCAPE_ASCII.sub(replace, s)) + '"'
+    return '"' + str(ESCAPE_ASCII.sub(_replace_ascii, s)) + '"'
 
 
 try:
@@ -169,17 +171,133 @@ class JSONEncoder(object):
         self.allow_nan = allow_nan
         self.sort_keys = sort_keys
         self.indent = indent
-        self.current_indent_level = 0
         if separators is not None:
             self.item_separator, self.key_separator = separators
         if default is not None:
             self.default = default
         self.encoding = encoding
 
-    def _newline_indent(self):
-        return '\n' + (' ' * (self.indent * self.current_indent_level))
+    def default(self, o):
+        """
+        Implement this method in a subclass such that it returns
+        a serializable object for ``o``, or calls the base implementation
+        (to raise a ``TypeError``).
+
+        For example, to support arbitrary iterators, you could
+        implement default like this::
+            
+            def default(self, o):
+                try:
+                    iterable = iter(o)
+                except TypeError:
+                    pass
+                else:
+                    return list(iterable)
+                return JSONEncoder.default(self, o)
+        """
+        raise TypeError("%r is not JSON serializable" % (o,))
+
+    def encode(self, o):
+        """
+        Return a JSON string representation of a Python data structure.
 
-    def _iterencode_list(self, lst, markers=None):
+        >>> JSONEncoder().encode({"foo": ["bar", "baz"]})
+        '{"foo": ["bar", "baz"]}'
+        """
+        # This is for extremely simple cases and benchmarks.
+        if isinstance(o, basestring):
+            if isinstance(o, str):
+                _encoding = self.encoding
+                if (_encoding is not None 
+                        and not (_encoding == 'utf-8')):
+                    o = o.decode(_encoding)
+            if self.ensure_ascii:
+                return encode_basestring_ascii(o)
+            else:
+                return encode_basestring(o)
+        # This doesn't pass the iterator directly to ''.join() because the
+        # exceptions aren't as detailed.  The list call should be roughly
+        # equivalent to the PySequence_Fast that ''.join() would do.
+        chunks = self.iterencode(o, _one_shot=True)
+        if not isinstance(chunks, (list, tuple)):
+            chunks = list(chunks)
+        return ''.join(chunks)
+
+    def iterencode(self, o, _one_shot=False):
+        """
+        Encode the given object and yield each string
+        representation as available.
+        
+        For example::
+            
+            for chunk in JSONEncoder().iterencode(bigobject):
+                mysocket.write(chunk)
+
+        With _one_shot (as used by encode), the chunks are returned as a list.
+        """
+        if self.check_circular:
+            markers = {}
+        else:
+            markers = None
+        if self.ensure_ascii:
+            _encoder = encode_basestring_ascii
+        else:
+            _encoder = encode_basestring
+        if self.encoding is not None and self.encoding != 'utf-8':
+            def _encoder(o, _orig_encoder=_encoder, _encoding=self.encoding):
+                if isinstance(o, str):
+                    o = o.decode(_encoding)
+                return _orig_encoder(o)
+
+        def _floatstr(o, allow_nan=self.allow_nan, _repr=FLOAT_REPR, _inf=INFINITY, _neginf=-INFINITY):
+            # As floatstr - with the settings bound
+            if o != o:
+                text = 'NaN'
+            elif o == _inf:
+                text = 'Infinity'
+            elif o == _neginf:
+                text = '-Infinity'
+            else:
+                return _repr(o)
+            if not allow_nan:
+                raise ValueError("Out of range float values are not JSON compliant: %r"
+                    % (o,))
+            return text
+
+        if _one_shot:
+            _make = _make_listencode
+        else:
+            _make = _make_iterencode
+        _iterencode = _make(markers, self.default, _encoder, self.indent, _floatstr,
+            self.key_separator, self.item_separator, self.sort_keys, self.skipkeys)
+        return _iterencode(o, 0)
+
+def _make_iterencode(markers, _default, _encoder, _indent, _floatstr, _key_separator,
+        _item_separator, _sort_keys, _skipkeys,
+        ## HACK: hand-optimized bytecode; turn globals into locals
+        False=False,
+        True=True,
+        Atomic=Atomic,
+        TypeError=TypeError,
+        ValueError=ValueError,
+        basestring=basestring,
+        dict=dict,
+        float=float,
+        id=id,
+        int=int,
+        isinstance=isinstance,
+        list=list,
+        long=long,
+        str=str,
+        tuple=tuple,
+    ):
+    """
+    Return a generator function encoding an object (and an indent level) as chunks of JSON -
+    all encoder settings (and the indent level) are bound as locals, so an encoder can be
+    used by several threads (or from within its default method).
+    """
+
+    def _iterencode_list(lst, _current_indent_level):
         if not lst:
             yield '[]'
             return
@@ -188,31 +306,51 @@ class JSONEncoder(object):
             if markerid in markers:
                 raise ValueError("Circular reference detected")
             markers[markerid] = lst
-        yield '['
-        if self.indent is not None:
-            self.current_indent_level += 1
-            newline_indent = self._newline_indent()
-            separator = self.item_separator + newline_indent
-            yield newline_indent
+        buf = '['
+        if _indent is not None:
+            _current_indent_level += 1
+            newline_indent = '\n' + (' ' * (_indent * _current_indent_level))
+            separator = _item_separator + newline_indent
+            buf += newline_indent
         else:
             newline_indent = None
-            separator = self.item_separator
+            separator = _item_separator
         first = True
         for value in lst:
             if first:
                 first = False
             else:
-                yield separator
-            for chunk in self._iterencode(value, markers):
-                yield chunk
+                buf = separator
+            if isinstance(value, basestring):
+                yield buf + _encoder(value)
+            elif value is None:
+                yield buf + 'null'
+            elif value is True:
+                yield buf + 'true'
+            elif value is False:
+                yield buf + 'false'
+            elif isinstance(value, (int, long)):
+                yield buf + str(value)
+            elif isinstance(value, float):
+                yield buf + _floatstr(value)
+            else:
+                yield buf
+                if isinstance(value, (list, tuple)):
+                    chunks = _iterencode_list(value, _current_indent_level)
+                elif isinstance(value, dict):
+                    chunks = _iterencode_dict(value, _current_indent_level)
+                else:
+                    chunks = _iterencode(value, _current_indent_level)
+                for chunk in chunks:
+                    yield chunk
         if newline_indent is not None:
-            self.current_indent_level -= 1
-            yield self._newline_indent()
+            _current_indent_level -= 1
+            yield '\n' + (' ' * (_indent * _current_indent_level))
         yield ']'
         if markers is not None:
             del markers[markerid]
 
-    def _iterencode_dict(self, dct, markers=None):
+    def _iterencode_dict(dct, _current_indent_level):
         if not dct:
             yield '{}'
             return
@@ -222,40 +360,28 @@ class JSONEncoder(object):
                 raise ValueError("Circular reference detected")
             markers[markerid] = dct
         yield '{'
-        key_separator = self.key_separator
-        if self.indent is not None:
-            self.current_indent_level += 1
-            newline_indent = self._newline_indent()
-            item_separator = self.item_separator + newline_indent
+        if _indent is not None:
+            _current_indent_level += 1
+            newline_indent = '\n' + (' ' * (_indent * _current_indent_level))
+            item_separator = _item_separator + newline_indent
             yield newline_indent
         else:
             newline_indent = None
-            item_separator = self.item_separator
+            item_separator = _item_separator
         first = True
-        if self.ensure_ascii:
-            encoder = encode_basestring_ascii
-        else:
-            encoder = encode_basestring
-        allow_nan = self.allow_nan
-        if self.sort_keys:
+        if _sort_keys:
             keys = dct.keys()
             keys.sort()
             items = [(k, dct[k]) for k in keys]
         else:
             items = dct.iteritems()
-        _encoding = self.encoding
-        _do_decode = (_encoding is not None
-            and not (_encoding == 'utf-8'))
         for key, value in items:
-            if isinstance(key, str):
-                if _do_decode:
-                    key = key.decode(_encoding)
-            elif isinstance(key, basestring):
+            if isinstance(key, basestring):
                 pass
             # JavaScript is weakly typed for these, so it makes sense to
             # also allow them.  Many encoders seem to do something like this.
             elif isinstance(key, float):
-                key = floatstr(key, allow_nan)
+                key = _floatstr(key)
             elif isinstance(key, (int, long)):
                 key = str(key)
             elif key is True:
@@ -264,7 +390,7 @@ class JSONEncoder(object):
                 key = 'false'
             elif key is None:
                 key = 'null'
-            elif self.skipkeys:
+            elif _skipkeys:
                 continue
             else:
                 raise TypeError("key %r is not a string" % (key,))
@@ -272,28 +398,39 @@ class JSONEncoder(object):
                 first = False
             else:
                 yield item_separator
-            yield encoder(key)
-            yield key_separator
-            for chunk in self._iterencode(value, markers):
-                yield chunk
+            yield _encoder(key)
+            yield _key_separator
+            if isinstance(value, basestring):
+                yield _encoder(value)
+            elif value is None:
+                yield 'null'
+            elif value is True:
+                yield 'true'
+            elif value is False:
+                yield 'false'
+            elif isinstance(value, (int, long)):
+                yield str(value)
+            elif isinstance(value, float):
+                yield _floatstr(value)
+            else:
+                if isinstance(value, (list, tuple)):
+                    chunks = _iterencode_list(value, _current_indent_level)
+                elif isinstance(value, dict):
+                    chunks = _iterencode_dict(value, _current_indent_level)
+                else:
+                    chunks = _iterencode(value, _current_indent_level)
+                for chunk in chunks:
+                    yield chunk
         if newline_indent is not None:
-            self.current_indent_level -= 1
-            yield self._newline_indent()
+            _current_indent_level -= 1
+            yield '\n' + (' ' * (_indent * _current_indent_level))
         yield '}'
         if markers is not None:
             del markers[markerid]
 
-    def _iterencode(self, o, markers=None):
+    def _iterencode(o, _current_indent_level):
         if isinstance(o, basestring):
-            if self.ensure_ascii:
-                encoder = encode_basestring_ascii
-            else:
-                encoder = encode_basestring
-            _encoding = self.encoding
-            if (_encoding is not None and isinstance(o, str)
-                    and not (_encoding == 'utf-8')):
-                o = o.decode(_encoding)
-            yield encoder(o)
+            yield _encoder(o)
         elif o is None:
             yield 'null'
         elif o is True:
@@ -303,14 +440,14 @@ class JSONEncoder(object):
         elif isinstance(o, (int, long)):
             yield str(o)
         elif isinstance(o, float):
-            yield floatstr(o, self.allow_nan)
+            yield _floatstr(o)
         elif isinstance(o, Atomic):
             yield str(o)
         elif isinstance(o, (list, tuple)):
-            for chunk in self._iterencode_list(o, markers):
+            for chunk in _iterencode_list(o, _current_indent_level):
                 yield chunk
         elif isinstance(o, dict):
-            for chunk in self._iterencode_dict(o, markers):
+            for chunk in _iterencode_dict(o, _current_indent_level):
                 yield chunk
         else:
             if markers is not None:
@@ -318,73 +455,197 @@ class JSONEncoder(object):
                 if markerid in markers:
                     raise ValueError("Circular reference detected")
                 markers[markerid] = o
-            for chunk in self._iterencode_default(o, markers):
+            for chunk in _iterencode(_default(o), _current_indent_level):
                 yield chunk
             if markers is not None:
                 del markers[markerid]
 
-    def _iterencode_default(self, o, markers=None):
-        newobj = self.default(o)
-        return self._iterencode(newobj, markers)
+    return _iterencode
+
+def _make_listencode(markers, _default, _encoder, _indent, _floatstr, _key_separator,
+        _item_separator, _sort_keys, _skipkeys,
+        ## HACK: hand-optimized bytecode; turn globals into locals
+        False=False,
+        True=True,
+        Atomic=Atomic,
+        TypeError=TypeError,
+        ValueError=ValueError,
+        basestring=basestring,
+        dict=dict,
+        float=float,
+        id=id,
+        int=int,
+        isinstance=isinstance,
+        list=list,
+        long=long,
+        str=str,
+        tuple=tuple,
+    ):
+    """
+    As _make_iterencode - but the returned function appends all of the chunks to a list
+    (without generators) and returns it.
+    """
 
-    def default(self, o):
-        """
-        Implement this method in a subclass such that it returns
-        a serializable object for ``o``, or calls the base implementation
-        (to raise a ``TypeError``).
+    def _listencode(o, _current_indent_level):
+        chunks = []
+        _append = chunks.append
 
-        For example, to support arbitrary iterators, you could
-        implement default like this::
-            
-            def default(self, o):
-                try:
-                    iterable = iter(o)
-                except TypeError:
-                    pass
+        def _encode_list(lst, _current_indent_level):
+            if not lst:
+                _append('[]')
+                return
+            if markers is not None:
+                markerid = id(lst)
+                if markerid in markers:
+                    raise ValueError("Circular reference detected")
+                markers[markerid] = lst
+            buf = '['
+            if _indent is not None:
+                _current_indent_level += 1
+                newline_indent = '\n' + (' ' * (_indent * _current_indent_level))
+                separator = _item_separator + newline_indent
+                buf += newline_indent
+            else:
+                newline_indent = None
+                separator = _item_separator
+            first = True
+            for value in lst:
+                if first:
+                    first = False
                 else:
-                    return list(iterable)
-                return JSONEncoder.default(self, o)
-        """
-        raise TypeError("%r is not JSON serializable" % (o,))
-
-    def encode(self, o):
-        """
-        Return a JSON string representation of a Python data structure.
+                    buf = separator
+                if isinstance(value, basestring):
+                    _append(buf + _encoder(value))
+                elif value is None:
+                    _append(buf + 'null')
+                elif value is True:
+                    _append(buf + 'true')
+                elif value is False:
+                    _append(buf + 'false')
+                elif isinstance(value, (int, long)):
+                    _append(buf + str(value))
+                elif isinstance(value, float):
+                    _append(buf + _floatstr(value))
+                else:
+                    _append(buf)
+                    if isinstance(value, (list, tuple)):
+                        _encode_list(value, _current_indent_level)
+                    elif isinstance(value, dict):
+                        _encode_dict(value, _current_indent_level)
+                    else:
+                        _encode(value, _current_indent_level)
+            if newline_indent is not None:
+                _current_indent_level -= 1
+                _append('\n' + (' ' * (_indent * _current_indent_level)))
+            _append(']')
+            if markers is not None:
+                del markers[markerid]
 
-        >>> JSONEncoder().encode({"foo": ["bar", "baz"]})
-        '{"foo": ["bar", "baz"]}'
-        """
-        # This is for extremely simple cases and benchmarks.
-        if isinstance(o, basestring):
-            if isinstance(o, str):
-                _encoding = self.encoding
-                if (_encoding is not None 
-                        and not (_encoding == 'utf-8')):
-                    o = o.decode(_encoding)
-            if self.ensure_ascii:
-                return encode_basestring_ascii(o)
+        def _encode_dict(dct, _current_indent_level):
+            if not dct:
+                _append('{}')
+                return
+            if markers is not None:
+                markerid = id(dct)
+                if markerid in markers:
+                    raise ValueError("Circular reference detected")
+                markers[markerid] = dct
+            _append('{')
+            if _indent is not None:
+                _current_indent_level += 1
+                newline_indent = '\n' + (' ' * (_indent * _current_indent_level))
+                item_separator = _item_separator + newline_indent
+                _append(newline_indent)
             else:
-                return encode_basestring(o)
-        # This doesn't pass the iterator directly to ''.join() because the
-        # exceptions aren't as detailed.  The list call should be roughly
-        # equivalent to the PySequence_Fast that ''.join() would do.
-        chunks = list(self.iterencode(o))
-        return ''.join(chunks)
+                newline_indent = None
+                item_separator = _item_separator
+            first = True
+            if _sort_keys:
+                keys = dct.keys()
+                keys.sort()
+                items = [(k, dct[k]) for k in keys]
+            else:
+                items = dct.iteritems()
+            for key, value in items:
+                if isinstance(key, basestring):
+                    pass
+                elif isinstance(key, float):
+                    key = _floatstr(key)
+                elif isinstance(key, (int, long)):
+                    key = str(key)
+                elif key is True:
+                    key = 'true'
+                elif key is False:
+                    key = 'false'
+                elif key is None:
+                    key = 'null'
+                elif _skipkeys:
+                    continue
+                else:
+                    raise TypeError("key %r is not a string" % (key,))
+                if first:
+                    first = False
+                else:
+                    _append(item_separator)
+                _append(_encoder(key))
+                _append(_key_separator)
+                if isinstance(value, basestring):
+                    _append(_encoder(value))
+                elif value is None:
+                    _append('null')
+                elif value is True:
+                    _append('true')
+                elif value is False:
+                    _append('false')
+                elif isinstance(value, (int, long)):
+                    _append(str(value))
+                elif isinstance(value, float):
+                    _append(_floatstr(value))
+                elif isinstance(value, (list, tuple)):
+                    _encode_list(value, _current_indent_level)
+                elif isinstance(value, dict):
+                    _encode_dict(value, _current_indent_level)
+                else:
+                    _encode(value, _current_indent_level)
+            if newline_indent is not None:
+                _current_indent_level -= 1
+                _append('\n' + (' ' * (_indent * _current_indent_level)))
+            _append('}')
+            if markers is not None:
+                del markers[markerid]
 
-    def iterencode(self, o):
-        """
-        Encode the given object and yield each string
-        representation as available.
-        
-        For example::
-            
-            for chunk in JSONEncoder().iterencode(bigobject):
-                mysocket.write(chunk)
-        """
-        if self.check_circular:
-            markers = {}
-        else:
-            markers = None
-        return self._iterencode(o, markers)
+        def _encode(o, _current_indent_level):
+            if isinstance(o, basestring):
+                _append(_encoder(o))
+            elif o is None:
+                _append('null')
+            elif o is True:
+                _append('true')
+            elif o is False:
+                _append('false')
+            elif isinstance(o, (int, long)):
+                _append(str(o))
+            elif isinstance(o, float):
+                _append(_floatstr(o))
+            elif isinstance(o, Atomic):
+                _append(str(o))
+            elif isinstance(o, (list, tuple)):
+                _encode_list(o, _current_indent_level)
+            elif isinstance(o, dict):
+                _encode_dict(o, _current_indent_level)
+            else:
+                if markers is not None:
+                    markerid = id(o)
+                    if markerid in markers:
+                        raise ValueError("Circular reference detected")
+                    markers[markerid] = o
+                _encode(_default(o), _current_indent_level)
+                if markers is not None:
+                    del markers[markerid]
+
+        _encode(o, _current_indent_level)
+        return chunks
+
+    return _listencode
 
 __all__ = ['JSONEncoder']
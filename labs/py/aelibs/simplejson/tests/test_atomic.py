@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+import simplejson as S
+from simplejson.encoder import Atomic
+
+class Date(Atomic):
+    def __init__(self, secs):
+        self.secs = secs
+
+    def __str__(self):
+        return "new Date(%d)" % self.secs
+
+class TestAtomic(TestCase):
+    def test_atomic(self):
+        self.assertEquals(S.dumps([Date(1), {'d': Date(2)}]), '[new Date(1), {"d": new Date(2)}]')
+
+    def test_default_atomic(self):
+        self.assertEquals(S.dumps({'d': 3j}, default=lambda o: Date(4)), '{"d": new Date(4)}')
+
+    def test_one_shot(self):
+        h = [Date(1), {'a': [1, 2.5, None, True], 'b': {}, 'c': []}, (u'x', 'y<')]
+        for kw in ({}, {'indent': 2, 'sort_keys': True}, {'separators': (',', ':')}):
+            encoder = S.JSONEncoder(**kw)
+            self.assertEquals(encoder.encode(h), ''.join(encoder.iterencode(h)))
+
+    def test_reentrant(self):
+        # An encoder can be used again while encoding (here, by its default method)
+        class Raw(Atomic):
+            def __init__(self, s):
+                self.s = s
+            def __str__(self):
+                return self.s
+        def default(o):
+            return Raw(encoder.encode([1]))
+        encoder = S.JSONEncoder(indent=2, default=default)
+        self.assertEquals(encoder.encode([[3j]]), '[\n  [\n    [\n  1\n]\n  ]\n]')
@@ -0,0 +1,385 @@
+"""
+Tests for the aelibs modules - run from the aelibs directory.  TestWriteBehind needs the
+application (settings.py) on the path, and TestRequestStore, TestMigratable and TestGlobals
+the App Engine SDK, too:
+
+    PYTHONPATH=<SDK dir>:<app dir> python test.py
+"""
+import unittest
+
+import cache
+
+class TestLocalMemcache(unittest.TestCase):
+    def test_incr_decr(self):
+        client = cache.LocalMemcache()
+        self.assertEqual(client.incr('k', 1), None)
+        client.set('k', 5)
+        self.assertEqual(client.incr('k', 2), 7)
+        self.assertEqual(client.decr('k', 3), 4)
+        # Decrementing stops at 0
+        self.assertEqual(client.decr('k', 10), 0)
+        # As memcache - a negative delta is an error
+        self.assertRaises(ValueError, client.incr, 'k', -1)
+        self.assertRaises(ValueError, client.decr, 'k', -1)
+
+class Clock(object):
+    def __init__(self, secs=1000.0):
+        self.secs = secs
+
+    def __call__(self):
+        return self.secs
+
+class TestLRUCache(unittest.TestCase):
+    def test_evict_count(self):
+        lru = cache.LRUCache(3)
+        for key in 'abc':
+            lru.set(key, key.upper())
+        # Using 'a' makes 'b' the least recently used
+        self.assertEqual(lru.get('a'), 'A')
+        lru.set('d', 'D')
+        self.assertEqual(lru.keys(), ['d', 'a', 'c'])
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.stats(), {'items': 3, 'bytes': 0, 'hits': 1, 'misses': 1, 'evictions': 1})
+
+    def test_evict_bytes(self):
+        lru = cache.LRUCache(100, max_bytes=10)
+        lru.set('a', 'x' * 4)
+        lru.set('b', 'x' * 4)
+        self.assertEqual(lru.bytes, 8)
+        lru.set('c', 'x' * 4)
+        self.assertEqual(lru.keys(), ['c', 'b'])
+        self.assertEqual(lru.bytes, 8)
+        # Replacing a value re-counts its size
+        lru.set('b', 'x')
+        self.assertEqual(lru.bytes, 5)
+        # A value larger than the cache is not stored (and replaces nothing)
+        self.assertEqual(lru.set('c', 'x' * 11), False)
+        self.assertEqual(lru.keys(), ['b'])
+        self.assertEqual(lru.bytes, 1)
+        self.assertEqual(lru.evictions, 1)
+
+    def test_expires(self):
+        clock = Clock()
+        lru = cache.LRUCache(10, clock=clock)
+        lru.set('a', 1, time=60)
+        lru.set('b', 2)
+        clock.secs += 59
+        self.assert_('a' in lru)
+        clock.secs += 1
+        self.failIf('a' in lru)
+        self.assertEqual(lru.get('b'), 2)
+        self.assertEqual(len(lru), 1)
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.client = cache.LocalMemcache()
+        self.cache = cache.Cache('test', local_items=2, local_secs=60, client=self.client, clock=self.clock)
+
+    def test_local(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.stats()['local_hits'], 1)
+        # A value set by another instance is read from the client, then kept locally
+        self.client.set('b', 2)
+        self.assertEqual(self.cache.get('b'), 2)
+        self.assertEqual(self.cache.get('b'), 2)
+        self.assertEqual(self.cache.stats(), {'local_hits': 2, 'hits': 1, 'misses': 1, 'sets': 1,
+                                              'local_items': 2, 'local_evictions': 0})
+        # Local values expire after local_secs - and are read again from the client
+        self.client.set('b', 3)
+        self.assertEqual(self.cache.get('b'), 2)
+        self.clock.secs += 60
+        self.assertEqual(self.cache.get('b'), 3)
+
+    def test_local_evict(self):
+        self.cache.set_multi({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(len(self.cache.local), 2)
+        self.assertEqual(self.cache.get_multi(['a', 'b', 'c', 'd']), {'a': 1, 'b': 2, 'c': 3})
+        mStats = self.cache.stats()
+        self.assertEqual(mStats['local_items'], 2)
+        self.assertEqual(mStats['local_hits'] + mStats['hits'], 3)
+        self.assertEqual(mStats['misses'], 1)
+        self.assert_(mStats['local_evictions'] >= 1)
+
+    def test_delete(self):
+        self.cache.set('a', 1)
+        self.cache.delete('a')
+        self.assertEqual(self.client.get('a'), None)
+        self.assertEqual(self.cache.get('a'), None)
+        self.failIf('a' in self.cache.local)
+        # incr and decr go to the client - the local copy is dropped
+        self.cache.set('n', 5)
+        self.assertEqual(self.cache.incr('n', 2), 7)
+        self.assertEqual(self.cache.get('n'), 7)
+
+    def test_no_local(self):
+        nolocal = cache.Cache('test', client=self.client)
+        nolocal.set('a', 1)
+        self.assertEqual(nolocal.get('a'), 1)
+        self.assertEqual(nolocal.get('b'), None)
+        self.assertEqual(nolocal.stats(), {'local_hits': 0, 'hits': 1, 'misses': 1, 'sets': 1})
+
+class Backend(object):
+    """ Write-behind backend which records the batches written - failing the first cFail """
+    def __init__(self, cFail=0):
+        self.cFail = cFail
+        self.batches = []
+
+    def put_multi(self, items):
+        if self.cFail:
+            self.cFail -= 1
+            raise IOError("write failed")
+        self.batches.append(sorted(items))
+
+class TestWriteBehind(unittest.TestCase):
+    # writebehind needs the application (settings.py) on the path - imported by these tests only
+    def queue(self, backend, **kwargs):
+        import writebehind
+        return writebehind.WriteBehind(backend, **kwargs)
+
+    def test_coalesce(self):
+        backend = Backend()
+        queue = self.queue(backend, workers=0)
+        queue.put('a', 1)
+        queue.put('b', 2)
+        queue.put('a', 3)
+        self.assertEqual(backend.batches, [])
+        queue.drain()
+        self.assertEqual(backend.batches, [[2, 3]])
+        mStats = queue.stats()
+        self.assertEqual((mStats['queued'], mStats['coalesced'], mStats['written'], mStats['pending']),
+                         (2, 1, 2, 0))
+        queue.cancel('x')
+        queue.put('c', 4)
+        queue.cancel('c')
+        queue.drain()
+        self.assertEqual(backend.batches, [[2, 3]])
+
+    def test_retry(self):
+        backend = Backend(cFail=2)
+        queue = self.queue(backend, workers=0, max_retries=3)
+        queue.put('a', 1)
+        queue.drain()
+        self.assertEqual(backend.batches, [[1]])
+        mStats = queue.stats()
+        self.assertEqual((mStats['retries'], mStats['written'], mStats['dropped']), (2, 1, 0))
+
+    def test_retries_exhausted(self):
+        backend = Backend(cFail=10)
+        queue = self.queue(backend, workers=0, max_retries=2)
+        queue.put('a', 1)
+        queue.drain()
+        self.assertEqual(backend.batches, [])
+        mStats = queue.stats()
+        self.assertEqual((mStats['retries'], mStats['batches'], mStats['written'], mStats['dropped'],
+                          mStats['pending']), (2, 3, 0, 1, 0))
+
+    def test_retry_replaced(self):
+        # An item queued while the failed batch was being written replaces it
+        queue = self.queue(None, workers=0)
+        class ReplacingBackend(object):
+            def put_multi(self, items):
+                if items == [1]:
+                    queue.put('a', 2)
+                    raise IOError("write failed")
+                self.items = items
+        queue.backend = backend = ReplacingBackend()
+        queue.put('a', 1)
+        queue.drain()
+        self.assertEqual(backend.items, [2])
+        self.assertEqual(queue.stats()['retries'], 0)
+
+    def test_workers(self):
+        backend = Backend()
+        queue = self.queue(backend, workers=2, max_pending=10, secs_flush=60)
+        for i in range(25):
+            queue.put('k%d' % i, i)
+        queue.stop()
+        self.assertEqual(sorted(sum(backend.batches, [])), range(25))
+        self.assert_(max([len(batch) for batch in backend.batches]) <= 10)
+        self.assertEqual(queue.stats()['pending'], 0)
+        self.assertEqual(queue.stats()['in_flight'], 0)
+        # Stopped - later items are written by drain
+        queue.put('z', 99)
+        self.assertEqual(queue.stats()['pending'], 1)
+        queue.drain()
+        self.assertEqual(backend.batches[-1], [99])
+
+    def test_flush_secs(self):
+        import threading
+        backend = Backend()
+        queue = self.queue(backend, workers=1, secs_flush=0.05)
+        queue.put('a', 1)
+        for i in range(100):
+            if backend.batches:
+                break
+            threading.Event().wait(0.05)
+        self.assertEqual(backend.batches, [[1]])
+        queue.stop()
+
+class Model(object):
+    """ Stands in for a Cacheable model in the request-local store """
+    def __init__(self, cache_state, state):
+        self.cache_state = cache_state
+        self._cache_state = state
+
+class TestRequestStore(unittest.TestCase):
+    # mixins needs the App Engine SDK - imported by these tests only
+    def setUp(self):
+        import mixins
+        self.mixins = mixins
+        self.state = mixins.Cacheable.cache_state
+
+    def model(self, state=None):
+        if state is None:
+            state = self.state.clean
+        return Model(self.state, state)
+
+    def test_evict(self):
+        store = self.mixins.RequestStore(3)
+        mClean = dict([('c%d' % i, self.model()) for i in range(5)])
+        modelDirty = self.model(self.state.dirty)
+        store['d'] = modelDirty
+        for sKey in sorted(mClean):
+            store[sKey] = mClean[sKey]
+        # Clean models are evicted (least recently used first) - the dirty model is kept
+        self.assertEqual(store.get('c0'), None)
+        self.assertEqual(store.get('c1'), None)
+        self.assert_(store.get('c4') is mClean['c4'])
+        self.assert_(store.get('d') is modelDirty)
+        self.assertEqual(store.dirty_models(), [modelDirty])
+        self.assertEqual(store.stats(), {'models': 3, 'dirty': 1, 'hits': 2, 'misses': 2, 'evictions': 3})
+        # Once written (clean) the model is no longer held
+        modelDirty._cache_state = self.state.clean
+        self.assertEqual(store.dirty_models(), [])
+        self.assertEqual(store.get('d'), None)
+        # Storing a clean copy replaces a dirty one
+        store['e'] = self.model(self.state.critical)
+        store['e'] = self.model()
+        self.assertEqual(store.stats()['dirty'], 0)
+
+    def test_requests(self):
+        mixins = self.mixins
+        mStats = mixins.cache_stats()
+        mixins.begin_request()
+        store = mixins.Cacheable._local_store()
+        store['a'] = self.model()
+        store.get('a')
+        store.get('b')
+        mixins.end_request()
+        mStatsEnd = mixins.cache_stats()
+        self.assertEqual(mStatsEnd['requests'], mStats['requests'] + 1)
+        self.assertEqual(mStatsEnd['hits'], mStats['hits'] + 1)
+        self.assertEqual(mStatsEnd['misses'], mStats['misses'] + 1)
+        self.assert_(mStatsEnd['models_max'] >= 1)
+        # The next request starts with an empty store
+        mixins.begin_request()
+        store = mixins.Cacheable._local_store()
+        self.assertEqual(store.get('a'), None)
+        self.assertEqual(store.stats()['models'], 0)
+        mixins.end_request()
+        mixins.end_request()
+        self.assertEqual(mixins.cache_stats()['requests'], mStats['requests'] + 2)
+
+class TestGlobals(unittest.TestCase):
+    # globals needs the App Engine SDK - imported by these tests only
+    def setUp(self):
+        from google.appengine.ext import testbed
+        import globals
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        globals._mIdBlocks.clear()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_count(self):
+        import globals
+        globals.Globals.CountIncr('count', 5)
+        self.assertEqual(globals.Globals.CountGet('count'), 5)
+        # The cached total is decremented, too
+        globals.Globals.CountIncr('count', -2)
+        self.assertEqual(globals.Globals.CountGet('count'), 3)
+        globals.Globals.CountIncr('count', -4)
+        self.assertEqual(globals.Globals.CountGet('count'), -1)
+
+    def test_ids(self):
+        import settings
+        import globals
+        cBlock = getattr(settings, 'GLOBALS_ID_BLOCK', 10)
+        self.assertEqual(globals.Globals.IdGet('id', 100), 99)
+        self.assertEqual(globals.Globals.IdNameNext('id', 100), 100)
+        self.assertEqual(globals.Globals.IdNameNext('id', 100), 101)
+        # IdGet is the highest id reserved - the end of this process's block
+        self.assertEqual(globals.Globals.IdGet('id', 100), 99 + cBlock)
+        for i in range(cBlock - 2):
+            globals.Globals.IdNameNext('id', 100)
+        # The next block is reserved when this one is used up
+        self.assertEqual(globals.Globals.IdNameNext('id', 100), 100 + cBlock)
+        self.assertEqual(globals.Globals.IdGet('id', 100), 99 + 2 * cBlock)
+
+def migratable_classes():
+    """ Return (and define, once) models which are both Migratable and Cacheable - in either order """
+    global _rgMigratable
+    if _rgMigratable is None:
+        from google.appengine.ext import db
+        import mixins
+
+        class MigrateCached(mixins.Migratable, mixins.Cacheable):
+            name = db.StringProperty(default='')
+
+            def migrate(self, schemaNext):
+                self.name = self.name + '-%d' % schemaNext
+
+        class CachedMigrate(mixins.Cacheable, mixins.Migratable):
+            name = db.StringProperty(default='')
+            migrate = MigrateCached.migrate.im_func
+
+        _rgMigratable = [MigrateCached, CachedMigrate]
+    return _rgMigratable
+
+_rgMigratable = None
+
+class TestMigratable(unittest.TestCase):
+    # mixins needs the App Engine SDK - imported by these tests only
+    def setUp(self):
+        import os
+        from google.appengine.ext import testbed
+        import mixins
+        os.environ.setdefault('CURRENT_VERSION_ID', '1.1')
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        mixins.begin_request()
+
+    def tearDown(self):
+        import mixins
+        mixins.end_request()
+        for cls in migratable_classes():
+            cls.schema_current = 1
+        self.testbed.deactivate()
+
+    def test_get_by_key_name(self):
+        from google.appengine.ext import db
+        import mixins
+        for cls in migratable_classes():
+            db.put([cls(key_name=sName, name=sName) for sName in ('a', 'b', 'c')])
+            cls.schema_current = 2
+            models = cls.get_by_key_name(['a', 'missing', 'b'])
+            self.assertEqual(models[1], None)
+            self.assertEqual([(model.name, model.schema) for model in models if model is not None],
+                             [('a-2', 2), ('b-2', 2)])
+            # The migrated models were written
+            self.assertEqual([model.name for model in db.get([db.Key.from_path(cls.kind(), 'a'),
+                                                               db.Key.from_path(cls.kind(), 'b')])],
+                             ['a-2', 'b-2'])
+            # A single key name is migrated, too
+            self.assertEqual(cls.get_by_key_name('c').name, 'c-2')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Micro-benchmarks for timescore.calc.
+
+Compares the slotted Score and RateLimit classes (and the pure float functions) with
+copies of the earlier implementations - time per operation and pickled size.
+
+Also measures MemRate checks per second (against a cache.LocalMemcache) from several threads.
+
+Usage (from the timescore directory):
+
+    python bench.py [iterations]
+"""
+
+import sys
+import math
+import time
+import timeit
+import threading
+import cPickle as pickle
+
+import calc
+
+sys.path.insert(0, '..')
+import cache
+
+class LegacyScore():
+    """ Score as it was before __slots__ and the shared constants """
+    def __init__(self, time_half=1.0, log_score=0.0, time_last=0.0):
+        self.time_half = float(time_half)
+        self.k = 0.5 ** (1.0/self.time_half)
+        self.time_last = float(time_last)
+        self.log_score = float(log_score)
+        self.increment(0, self.time_last)
+
+    def increment(self, value=0.0, time_now=None):
+        value = float(value)
+        if time_now is None:
+            time_now = self.time_last
+        else:
+            time_now = float(time_now)
+        if time_now > self.time_last:
+            self.score = 2.0 ** (self.log_score - time_now/self.time_half)
+            self.score += value
+            self.time_last = time_now
+        else:
+            self.score = 2.0 ** (self.log_score - self.time_last/self.time_half)
+            self.score += (self.k ** (self.time_last - time_now)) * value
+        try:
+            self.log_score = math.log(self.score)/math.log(2) + self.time_last/self.time_half
+        except:
+            self.score = 0.0
+            self.log_score = 0.0
+
+class LegacyRateLimit(object):
+    """ RateLimit as it was before __slots__ and the shared constants """
+    def __init__(self, threshold, secs_half=60):
+        self.value = 0.0
+        self.threshold = threshold
+        self.k = 0.5 ** (1.0/secs_half)
+        self.secs_last = 0
+
+    def is_exceeded(self, secs, value=1.0):
+        if secs < self.secs_last:
+            return True
+        _is_exceeded = self.current_value(secs) + value > self.threshold
+        if not _is_exceeded:
+            self.value += value
+        return _is_exceeded
+
+    def current_value(self, secs, value=0):
+        if secs < self.secs_last:
+            return self.value
+        self.value *= (self.k ** (secs - self.secs_last))
+        self.secs_last = secs
+        self.value += value
+        return self.value
+
+def report(sName, secs, n):
+    print "%-40s %8.3f usec/call" % (sName, secs * 1e6 / n)
+
+def score_now(cls):
+    # What models.score_now does for each model and half-life
+    ts = cls(24, 1234.5, 29000.0)
+    ts.increment(0, 29010.0)
+    return ts.score
+
+def rate_check(cls):
+    rate = cls(30, 30)
+    rate.is_exceeded(100)
+    return rate
+
+def memrate_throughput(cThreads, n):
+    """ Return MemRate checks per second with cThreads threads each making n checks """
+    client = cache.LocalMemcache()
+    def worker(iThread):
+        for i in xrange(n):
+            calc.MemRate('user~%d' % (i % 100), rpmMax=60, client=client).is_exceeded(1000 + i * 0.01)
+    threads = [threading.Thread(target=worker, args=(iThread,)) for iThread in xrange(cThreads)]
+    secsStart = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return cThreads * n / (time.time() - secsStart)
+
+def main(n=100000):
+    report("Score (legacy)", timeit.Timer(lambda: score_now(LegacyScore)).timeit(n), n)
+    report("Score (slotted)", timeit.Timer(lambda: score_now(calc.Score)).timeit(n), n)
+    report("current_score (function)",
+           timeit.Timer(lambda: calc.current_score(1234.5, 29000.0, 24.0, 29010.0)).timeit(n), n)
+    report("RateLimit (legacy)", timeit.Timer(lambda: rate_check(LegacyRateLimit)).timeit(n), n)
+    report("RateLimit (slotted)", timeit.Timer(lambda: rate_check(calc.RateLimit)).timeit(n), n)
+
+    for sName, obj in (("Score (legacy)", LegacyScore(24, 1234.5, 29000.0)),
+                       ("Score (slotted)", calc.Score(24, 1234.5, 29000.0)),
+                       ("RateLimit (legacy)", rate_check(LegacyRateLimit)),
+                       ("RateLimit (slotted)", rate_check(calc.RateLimit))):
+        print "%-40s %8d bytes pickled" % (sName, len(pickle.dumps(obj, 2)))
+
+    for cThreads in (1, 4, 16):
+        print "%-40s %8.0f checks/sec" % ("MemRate (%d threads)" % cThreads,
+                                          memrate_throughput(cThreads, n / 10 / cThreads))
+
+if __name__ == '__main__':
+    n = 100000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    main(n)
@@ -1,8 +1,71 @@
 from datetime import datetime
 import math
+import time
 import logging
 
-class Score():
+# NumPy is optional - used (when available) to score large batches
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Shared constants - the decay factor (per time unit) of each half-life is computed once.
+"""
+
+LOG2 = math.log(2)
+
+_mDecay = {}
+
+def decay(time_half):
+    """ Return 0.5 ** (1/time_half) - the fraction of a value remaining after one time unit """
+    k = _mDecay.get(time_half)
+    if k is None:
+        k = _mDecay[time_half] = 0.5 ** (1.0/time_half)
+    return k
+
+"""
+Pure (float) functions - Score and RateLimit arithmetic without creating objects.
+"""
+
+def increment(log_score, time_last, time_half, value=0.0, time_now=None):
+    """
+    Add value (at time_now) to a timescore - returns the new (score, log_score, time_last).
+    
+    See Score.increment.
+    """
+    if time_now is not None and time_now > time_last:
+        score = 2.0 ** (log_score - time_now/time_half) + value
+        time_last = time_now
+    else:
+        score = 2.0 ** (log_score - time_last/time_half)
+        if value:
+            if time_now is not None:
+                value *= decay(time_half) ** (time_last - time_now)
+            score += value
+
+    try:
+        log_score = math.log(score)/LOG2 + time_last/time_half
+    except ValueError:
+        # Even on underflow, we want to advance the time_last to the present.
+        # The score for an underflow value will be zero, we also set the log to zero
+        # to sort it last among its cohorts.
+        return 0.0, 0.0, time_last
+    return score, log_score, time_last
+
+def current_score(log_score, time_last, time_half, time_now=None):
+    """ Return the score at time_now (or time_last, if later) """
+    if time_now is not None and time_now > time_last:
+        return 2.0 ** (log_score - time_now/time_half)
+    return 2.0 ** (log_score - time_last/time_half)
+
+def rate_value(value, secs_last, secs_half, secs):
+    """ Return the value of a rate accumulator (see RateLimit) decayed to time secs """
+    if secs <= secs_last:
+        return value
+    return value * decay(secs_half) ** (secs - secs_last)
+
+class Score(object):
     """
     Base functions for calculating half-life values from a stream of scoring events.
     
@@ -11,6 +74,7 @@ class Score():
     The Net score is valid at a particular time, time_last.  log_score is globally comparable as it is
     based at time t = 0.
     """
+    __slots__ = ('time_half', 'time_last', 'log_score', 'score')
     
     def __init__(self, time_half=1.0, log_score=0.0, time_last=0.0):
         """
@@ -19,10 +83,13 @@ class Score():
         than 1 at time = 0 - these are not allowed.
         """
         self.time_half = float(time_half)
-        self.k = 0.5 ** (1.0/self.time_half)
         self.time_last = float(time_last)
-        self.log_score = float(log_score)
-        self.increment(0, self.time_last)
+        self.score, self.log_score, self.time_last = \
+            increment(float(log_score), self.time_last, self.time_half)
+        
+    @property
+    def k(self):
+        return decay(self.time_half)
         
     def increment(self, value=0.0, time_now=None):
         """
@@ -31,37 +98,68 @@ class Score():
         
         Note that self.score is an output variable only (calculated from log_score).
         """
-        value = float(value)
-        
-        if time_now is None:
-            time_now = self.time_last
-        else:
+        if time_now is not None:
             time_now = float(time_now)
-        
-        if time_now > self.time_last:
-            self.score = 2.0 ** (self.log_score - time_now/self.time_half)
-            self.score += value
-            self.time_last = time_now
-        else:
-            self.score = 2.0 ** (self.log_score - self.time_last/self.time_half)
-            self.score += (self.k ** (self.time_last - time_now)) * value
-
-        try:    
-            self.log_score = math.log(self.score)/math.log(2) + self.time_last/self.time_half
-        except:
-            # Even on underflow, we want to advance the time_last to the present.
-            # The score for an underflow value will be zero, we also set the log to zero
-            # to sort it last among its cohorts.
-            """
-            logging.info("Timescore underflow [%.2fL @ %.2f] + [%.2f @ %.2f] T=%.0f => [0L @ %.2f]" %
-                         (self.log_score, self.time_last,
-                          value, time_now,
-                          self.time_half,
-                          self.time_last))
-            """
-            self.score = 0.0
-            self.log_score = 0.0
+        self.score, self.log_score, self.time_last = \
+            increment(self.log_score, self.time_last, self.time_half, float(value), time_now)
             
+    def __getstate__(self):
+        return (self.time_half, self.time_last, self.log_score, self.score)
+    
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled by the earlier (un-slotted) class
+            state = (state['time_half'], state['time_last'], state['log_score'], state['score'])
+        self.time_half, self.time_last, self.log_score, self.score = state
+            
+"""
+Batch scoring - the current score of many (log_score, time_last) pairs at once.
+
+The result is the same as Score(time_half, log_score, time_last).increment(0, time_now) - i.e.
+2 ** (log_score - max(time_now, time_last)/time_half).
+"""
+
+# Below this size, the NumPy call overhead outweighs the savings
+cBatchMin = 32
+
+def batch_scores(log_scores, times_last, time_half, time_now=None):
+    """ Return a list of the current scores for parallel sequences of log_scores and times_last """
+    if numpy is not None and len(log_scores) >= cBatchMin:
+        return _batch_scores_numpy([log_scores], times_last, [time_half], time_now)[0]
+    return _batch_scores_loop(log_scores, times_last, float(time_half), time_now)
+
+def batch_scores_multi(mLogScores, times_last, time_now=None):
+    """
+    Return the current scores for several half-lives at once.
+    
+    mLogScores is a dictionary of half-life -> sequence of log_scores (each parallel to
+    times_last) - returns a dictionary of half-life -> list of scores.
+    """
+    half_lives = mLogScores.keys()
+    if numpy is not None and len(times_last) * len(half_lives) >= cBatchMin:
+        rgScores = _batch_scores_numpy([mLogScores[half] for half in half_lives],
+                                       times_last, half_lives, time_now)
+        return dict(zip(half_lives, rgScores))
+    return dict([(half, _batch_scores_loop(mLogScores[half], times_last, float(half), time_now))
+                 for half in half_lives])
+
+def _batch_scores_loop(log_scores, times_last, time_half, time_now=None):
+    if time_now is None:
+        return [2.0 ** (log_score - time_last/time_half)
+                for log_score, time_last in zip(log_scores, times_last)]
+    time_now = float(time_now)
+    return [2.0 ** (log_score - max(time_last, time_now)/time_half)
+            for log_score, time_last in zip(log_scores, times_last)]
+
+def _batch_scores_numpy(rgLogScores, times_last, half_lives, time_now=None):
+    # One row per half-life
+    times = numpy.asarray(times_last, dtype=float)
+    if time_now is not None:
+        times = numpy.maximum(times, float(time_now))
+    logs = numpy.asarray(rgLogScores, dtype=float)
+    halves = numpy.asarray(half_lives, dtype=float).reshape(-1, 1)
+    return numpy.exp2(logs - times / halves).tolist()
+
 class RateLimit(object):
     """
     Rate accumulator - using exponential decay over time.
@@ -70,12 +168,18 @@ class RateLimit(object):
     a specified threshold.  In the absence of updated values, the value of the level will
     drop by half each secs_half seconds.
     """
+    __slots__ = ('value', 'threshold', 'secs_half', 'secs_last')
+    
     def __init__(self, threshold, secs_half=60):
         self.value = 0.0
         self.threshold = threshold
-        self.k = 0.5 ** (1.0/secs_half)
+        self.secs_half = secs_half
         self.secs_last = 0
         
+    @property
+    def k(self):
+        return decay(self.secs_half)
+        
     def is_exceeded(self, secs, value=1.0):
         """
         Update and return the current value of the accumulator IFF the accumulated
@@ -104,40 +208,121 @@ class RateLimit(object):
             return self.value
         
         # Decay current value
-        self.value *= (self.k ** (secs - self.secs_last))
+        self.value = self.value * decay(self.secs_half) ** (secs - self.secs_last) + value
         self.secs_last = secs
-        self.value += value
         
         return self.value
+    
+    def __getstate__(self):
+        return (self.value, self.threshold, self.secs_half, self.secs_last)
+    
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled by the earlier (un-slotted) class - which kept k rather than secs_half
+            state = (state['value'], state['threshold'],
+                     round(math.log(0.5)/math.log(state['k']), 6), state['secs_last'])
+        self.value, self.threshold, self.secs_half, self.secs_last = state
+
+def threshold_from_rpm(rpm, secs_half):
+    """
+    Return the RateLimit threshold which admits a steady stream of rpm requests per minute.
+
+    For evenly spaced requests, the accumulated value converges to 1/(1-k), where k is the
+    decay factor between requests.  Bursts of up to (about) that many requests are admitted.
+    """
+    k = 0.5 ** ((60.0/rpm)/secs_half)
+    return 1.0/(1.0 - k)
 
 class MemRate(object):
-    """ Rate-limiter persisted to memcache """
-    def __init__(self, key, rpmMax=10, secsAge=300):
-        self.rate = None
+    """
+    Rate-limiter shared through memcache - holds across all server instances.
+    
+    Usage:
+    
+        if MemRate('user~%s' % req.uid, rpmMax=30).exceeded():
+            ...reject the request
+    
+    Requests are counted in time buckets (of secs_half/4 seconds) with atomic memcache
+    increments - there is no read-modify-write of shared state.  The rate is the sum of the
+    recent bucket counts, each decayed (like RateLimit) by the age of the middle of its bucket,
+    over cBuckets buckets (4 half-lives).  A request which would exceed the threshold is not counted (its increment
+    is undone), so concurrent callers can never admit more than the threshold allows.
+    
+    client defaults to the shared cache (cache.get_cache('rate')) - pass a cache.LocalMemcache()
+    to run locally.  threshold (if given) overrides rpmMax.
+    """
+    cBuckets = 16
+    
+    def __init__(self, key, rpmMax=10, secs_half=60, client=None, threshold=None):
+        if client is None:
+            client = _cache()
+        if threshold is None:
+            threshold = threshold_from_rpm(rpmMax, secs_half)
+        self.client = client
         self.key = key
         self.rpmMax = rpmMax
-        self.secsAge = secsAge
+        self.secs_half = secs_half
+        self.threshold = threshold
+        self.secsBucket = secs_half / 4.0
+        self.value = None
         self.fExceeded = None
         
     def exceeded(self):
-        if self.fExceeded is not None:
-            return self.fExceeded
-
-        self.EnsureRate()
-        self.fExceeded = self.rate.exceeded()
-        memcache.set('rate.%s' % self.key, self.rate, self.secsAge)
-        if self.fExceeded:
-            logging.info('MemRate exceeded: %1.2f/%d for %s (%s)' % (self.rate.S*60, self.rpmMax, self.key, self.fExceeded))
+        """ Count this request (once per MemRate) - returns True if the limit is exceeded """
+        if self.fExceeded is None:
+            self.fExceeded = self.is_exceeded(time.time())
+            if self.fExceeded:
+                logging.info('MemRate exceeded: %1.2f/%d for %s' % (self.rpm(), self.rpmMax, self.key))
         return self.fExceeded
     
+    def is_exceeded(self, secs, value=1):
+        """
+        Count value (an integer) at time secs, returning True if the accumulated rate would
+        exceed the threshold (the value is not counted in that case).
+        """
+        iBucket = int(secs // self.secsBucket)
+        sKey = self._bucket_key(iBucket)
+        count = self.client.incr(sKey, value)
+        if count is None:
+            # First request in this bucket - add() is atomic, so only one caller creates it
+            self.client.add(sKey, 0, time=int(self.cBuckets * self.secsBucket) + 1)
+            count = self.client.incr(sKey, value)
+            if count is None:
+                # Cache unavailable - fail open
+                return False
+        
+        # Requests in the current bucket are not given more than their full weight
+        weight = min(1.0, decay(self.secs_half) ** (secs - (iBucket + 0.5) * self.secsBucket))
+        history = self._history(iBucket, secs)
+        self.value = count * weight + history
+        if self.value > self.threshold:
+            self.client.decr(sKey, value)
+            self.value = (count - value) * weight + history
+            return True
+        return False
+    
     def rpm(self):
-        # Return current number of requests per minute
-        if self.rate is None:
+        # Return the current number of requests per minute (as of the last check)
+        if self.value is None:
             return 0.0
-        return self.rate.S * 60.0
+        return self.value * (1.0 - decay(self.secs_half)) * 60.0
+    
+    def _history(self, iBucket, secs):
+        # Decayed sum of the counts of the earlier buckets
+        mCounts = self.client.get_multi([self._bucket_key(i) for i in
+                                         xrange(iBucket - self.cBuckets + 1, iBucket)])
+        k = decay(self.secs_half)
+        value = 0.0
+        for i in xrange(iBucket - self.cBuckets + 1, iBucket):
+            count = mCounts.get(self._bucket_key(i))
+            if count:
+                value += int(count) * k ** (secs - (i + 0.5) * self.secsBucket)
+        return value
     
-    def ensure_rate(self):
-        if self.rate is None:
-            self.rate = memcache.get('rate.%s' % self.key)
-        if self.rate is None:
-            self.rate = Rate(self.rpmMax, 60)
\ No newline at end of file
+    def _bucket_key(self, iBucket):
+        return 'rate.%s.%d' % (self.key, iBucket)
+
+def _cache():
+    # timescore is also used stand-alone - import the cache on first use
+    import cache
+    return cache.get_cache('rate')
@@ -0,0 +1,119 @@
+"""
+In-memory top-K leaderboard of (log_score, key) entries.
+
+log_scores (for one half-life) are comparable at any time, so ordering by log_score is
+ordering by current score - entries never need to be re-scored as time passes.
+
+Usage:
+
+    board = Leaderboard(100)
+    board.update('key', log_score)
+    for log_score, key in board.top(20):
+        ...
+    snapshot = board.snapshot()
+    board.restore(snapshot)
+
+The lowest entry is found with a min-heap.  Replaced entries are left in the heap and
+skipped when they reach the top (lazy deletion) - the heap is rebuilt when it holds more
+than twice as many entries as the board.
+
+A key whose log_score is lowered can be left on the board above keys which are not on it
+- log_scores only increase in normal scoring.
+"""
+
+import heapq
+import threading
+
+class Leaderboard(object):
+    def __init__(self, size=100):
+        self.size = size
+        self.mScores = {}
+        self.heap = []
+        self._top = None
+        self._lock = threading.Lock()
+
+    def update(self, key, log_score):
+        """ Record the current log_score of key - returns True if the board changed """
+        self._lock.acquire()
+        try:
+            return self._update(key, log_score)
+        finally:
+            self._lock.release()
+
+    def remove(self, key):
+        self._lock.acquire()
+        try:
+            if self.mScores.pop(key, None) is not None:
+                self._top = None
+        finally:
+            self._lock.release()
+
+    def top(self, n=None):
+        """ Return the (first n) entries as (log_score, key) - highest first """
+        top = self._top
+        if top is None:
+            self._lock.acquire()
+            try:
+                top = self._top = sorted([(log_score, key) for key, log_score in self.mScores.items()],
+                                         reverse=True)
+            finally:
+                self._lock.release()
+        if n is None:
+            return top
+        return top[:n]
+
+    def snapshot(self):
+        """ Return the entries as a (picklable) list """
+        return list(self.top())
+
+    def restore(self, snapshot):
+        """ Merge entries from a snapshot (or another board) - keeping the higher log_score of each key """
+        self._lock.acquire()
+        try:
+            for log_score, key in snapshot:
+                log_score_old = self.mScores.get(key)
+                if log_score_old is None or log_score > log_score_old:
+                    self._update(key, log_score)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.mScores = {}
+            self.heap = []
+            self._top = None
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self.mScores)
+
+    def _update(self, key, log_score):
+        # (with the lock held)
+        log_score_old = self.mScores.get(key)
+        if log_score_old is None:
+            if len(self.mScores) >= self.size:
+                if log_score <= self._min()[0]:
+                    return False
+                log_score_min, key_min = heapq.heappop(self.heap)
+                del self.mScores[key_min]
+        elif log_score_old == log_score:
+            return False
+        self.mScores[key] = log_score
+        heapq.heappush(self.heap, (log_score, key))
+        if len(self.heap) > 2 * self.size:
+            self._rebuild_heap()
+        self._top = None
+        return True
+
+    def _min(self):
+        # Lowest current entry - discarding replaced entries from the top of the heap
+        heap = self.heap
+        while self.mScores.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def _rebuild_heap(self):
+        self.heap = [(log_score, key) for key, log_score in self.mScores.items()]
+        heapq.heapify(self.heap)
@@ -1,12 +1,24 @@
+"""
+Optional settings.py values:
+
+    TIMESCORE_LEADERBOARD_SIZE = 100        # Models kept on each leaderboard (0 disables)
+    TIMESCORE_LEADERBOARD_SNAPSHOT_SECS = 60    # Time between leaderboard snapshots
+"""
+
 from google.appengine.ext import db
 
 from datetime import datetime, timedelta
 import logging
 import math
+import threading
+import time
 import reqfilter
 import mixins
+import settings
+import cache
 
 import calc
+import leaderboard
 
 hrsDay = 24
 hrsWeek = 7*hrsDay
@@ -40,6 +52,16 @@ def scorable(half_lives=None):
         set_timescore_results(results, half_life, [datetime])
         score_now(half_life, [datetime], [increment])
         named_scores([datetime])
+        
+    To score a list of models at once, use the module functions:
+    
+        set_timescore_results(results, half_life, [datetime])
+        batch_named_scores(models, [datetime])
+        
+    The highest scoring models (for each half-life) are kept on in-memory leaderboards (by key),
+    updated by update_scores when a value is added to a (put) model:
+    
+        top_models(cls, half_life, [n], [datetime])
     
     The following attributes will be added to the class:
     
@@ -101,6 +123,13 @@ def scorable(half_lives=None):
         # If we've updated score - we want to persist the model (eventually)
         if value > 0:    
             self.set_dirty()
+            # (a model without a key can't be read back from the leaderboard)
+            if self.has_key():
+                for half_life in self.TS_half_lives:
+                    board = get_leaderboard(type(self), half_life)
+                    if board is not None:
+                        board.update(str(self.key()), getattr(self, halflife_attr(half_life)))
+                snapshot_leaderboards()
     
     def score_now(self, half_life, dt=None, value=0):
         """
@@ -118,10 +147,7 @@ def scorable(half_lives=None):
         Return a dictionary of timescore values for the current time.  It is assumed
         that dt is >= any past scoring time for this model.
         """
-        mScores = {}
-        for half_life in self.TS_half_lives:
-            mScores[halflife_name(half_life)] = self.score_now(half_life, dt).score
-        return mScores
+        return batch_named_scores([self], dt)[0]
     
     def is_new_score(self):
         """
@@ -147,11 +173,32 @@ def set_timescore_results(results, half_life, dt=None):
     list of results, corresponding to the current (time-based) score
     for the given half_life.
     """
-    for model in results:
-        if model is None:
-            continue
-        model.timescore = model.score_now(half_life, dt).score
+    models = [model for model in results if model is not None]
+    scores = calc.batch_scores([getattr(model, halflife_attr(half_life)) for model in models],
+                               [model.TS_hrs for model in models],
+                               half_life, hours_from_datetime(dt))
+    for model, score in zip(models, scores):
+        model.timescore = score
     return results
+
+def batch_named_scores(models, dt=None):
+    """
+    Return a list of the named_scores() dictionaries of each model (all of the same class)
+    - computed together for all half-lives.
+    """
+    if not models:
+        return []
+    half_lives = models[0].TS_half_lives
+    mLogScores = dict([(half_life, [getattr(model, halflife_attr(half_life)) for model in models])
+                       for half_life in half_lives])
+    mScores = calc.batch_scores_multi(mLogScores, [model.TS_hrs for model in models],
+                                      hours_from_datetime(dt))
+    rgNamed = [{} for model in models]
+    for half_life in half_lives:
+        sName = halflife_name(half_life)
+        for mNamed, score in zip(rgNamed, mScores[half_life]):
+            mNamed[sName] = score
+    return rgNamed
             
 def hours_from_datetime(dt=None):
     if dt is None:
@@ -170,3 +217,89 @@ def halflife_name(half_life):
 
 def halflife_attr(half_life):
     return 'TS_%s_score' % halflife_name(half_life)
+
+"""
+Leaderboards - the top scoring models of each class and half-life, kept in memory.
+
+Each instance keeps its own boards.  They are periodically merged with the snapshot in the
+shared cache (so all instances converge), and can be rebuilt from the datastore.
+"""
+
+def get_leaderboard(cls, half_life):
+    """ Return the leaderboard for the class and half-life - None if disabled """
+    size = getattr(settings, 'TIMESCORE_LEADERBOARD_SIZE', 100)
+    if not size:
+        return None
+    sKey = _leaderboard_key(cls, half_life)
+    board = _mBoards.get(sKey)
+    if board is None:
+        _lockBoards.acquire()
+        try:
+            board = _mBoards.get(sKey)
+            if board is None:
+                board = leaderboard.Leaderboard(size)
+                board.restore(_cache().get(sKey) or [])
+                _mBoards[sKey] = board
+        finally:
+            _lockBoards.release()
+    return board
+
+def top_models(cls, half_life, n=None, dt=None):
+    """
+    Return the (first n) models on the leaderboard - highest score first - with the
+    timescore attribute set (as set_timescore_results does).
+    """
+    board = get_leaderboard(cls, half_life)
+    if board is None:
+        return []
+    keys = [db.Key(sKey) for log_score, sKey in board.top(n)]
+    # Models with (root) key names are read through the Cacheable cache
+    rgNamed = [key for key in keys if key.name() is not None and key.parent() is None]
+    rgOther = [key for key in keys if key.name() is None or key.parent() is not None]
+    mModels = dict(zip(rgNamed, cls.get_by_key_name([key.name() for key in rgNamed])))
+    mModels.update(zip(rgOther, db.get(rgOther)))
+    models = [mModels[key] for key in keys if mModels[key] is not None]
+    return set_timescore_results(models, half_life, dt)
+
+def rebuild_leaderboard(cls, half_life):
+    """ Re-build a leaderboard from the datastore """
+    board = get_leaderboard(cls, half_life)
+    if board is None:
+        return
+    board.clear()
+    attr = halflife_attr(half_life)
+    for model in order_by_score(cls.all(), half_life).fetch(board.size):
+        board.update(str(model.key()), getattr(model, attr))
+    _cache().set(_leaderboard_key(cls, half_life), board.snapshot())
+
+def snapshot_leaderboards(fForce=False):
+    """ Merge (every TIMESCORE_LEADERBOARD_SNAPSHOT_SECS) each leaderboard with the shared snapshot """
+    secsNow = time.time()
+    if not fForce and secsNow < _secsSnapshot[0]:
+        return
+    # Only one thread (per period) merges the snapshots
+    _lockBoards.acquire()
+    try:
+        if not fForce and secsNow < _secsSnapshot[0]:
+            return
+        _secsSnapshot[0] = secsNow + getattr(settings, 'TIMESCORE_LEADERBOARD_SNAPSHOT_SECS', 60)
+    finally:
+        _lockBoards.release()
+    if not _mBoards:
+        return
+    mSnapshots = _cache().get_multi(_mBoards.keys())
+    for sKey, board in _mBoards.items():
+        board.restore(mSnapshots.get(sKey) or [])
+        mSnapshots[sKey] = board.snapshot()
+    _cache().set_multi(mSnapshots)
+
+def _leaderboard_key(cls, half_life):
+    # Entries are (log_score, str(key)) - snapshots of key names were kept under 'leaderboard~'
+    return 'leaderboard.keys~%s~%s' % (cls.__name__, halflife_name(half_life))
+
+def _cache():
+    return cache.get_cache('leaderboard')
+
+_mBoards = {}
+_lockBoards = threading.Lock()
+_secsSnapshot = [0]
@@ -0,0 +1,109 @@
+"""
+Replay (backfill) timescores from a history of scoring events.
+
+Used when a half-life is added to a @scorable class (existing models start at 0.0), or to
+recompute scores after a change in scoring.  Events are (key_name, value, hours) tuples -
+hours as returned by timescore.hours_from_datetime.
+
+Usage (e.g. through the remote api, or a task):
+
+    mScores = replay(events, [hrsDay, hrsWeek], processes=4)
+    apply_scores(MyModel, mScores)
+
+Events are sorted by key and time, and folded with the same arithmetic as Score.increment
+(calc.increment) - each key starts from a new score (log_score 0 at time 0).  Keys are split
+among worker processes when multiprocessing is available.
+"""
+
+import logging
+
+import calc
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python 2.5
+    multiprocessing = None
+
+def fold(events, half_lives):
+    """
+    Return a dictionary of key -> (log_scores, hours) for the events, where log_scores is
+    a tuple of the log_score for each half-life (in order) and hours is the latest event time.
+    """
+    mScores = {}
+    half_lives = [float(half_life) for half_life in half_lives]
+    events = sorted(events, key=lambda event: (event[0], event[2]))
+    keyLast = None
+    for key, value, hours in events:
+        if key != keyLast:
+            if keyLast is not None:
+                mScores[keyLast] = (tuple(log_scores), time_last)
+            keyLast = key
+            log_scores = [0.0] * len(half_lives)
+            time_last = 0.0
+        hours = float(hours)
+        value = float(value)
+        for i, half_life in enumerate(half_lives):
+            score, log_scores[i], time_last_new = calc.increment(log_scores[i], time_last, half_life,
+                                                                value, hours)
+        time_last = time_last_new
+    if keyLast is not None:
+        mScores[keyLast] = (tuple(log_scores), time_last)
+    return mScores
+
+def _fold_args(args):
+    return fold(*args)
+
+def replay(events, half_lives, processes=None):
+    """
+    Fold the events (see fold) - split by key among processes worker processes (default:
+    one per CPU) when multiprocessing is available.
+    """
+    if multiprocessing is None or processes == 1:
+        return fold(events, half_lives)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    rgChunks = [[] for i in xrange(processes)]
+    for event in events:
+        rgChunks[hash(event[0]) % processes].append(event)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        rgScores = pool.map(_fold_args, [(chunk, half_lives) for chunk in rgChunks])
+    finally:
+        pool.close()
+        pool.join()
+
+    mScores = {}
+    for mChunk in rgScores:
+        mScores.update(mChunk)
+    return mScores
+
+def apply_scores(cls, mScores, half_lives, batch=100):
+    """
+    Write replayed scores (from fold or replay, for the given half_lives) to the models of a
+    @scorable class - read and written in batches.  Returns the number of models updated.
+
+    Half-lives not replayed are left unchanged.
+    """
+    import models
+    import mixins
+
+    rgAttrs = [models.halflife_attr(half_life) for half_life in half_lives]
+    key_names = sorted(mScores.keys())
+    cUpdated = 0
+    for iBatch in xrange(0, len(key_names), batch):
+        rgModels = []
+        for model in cls.get_by_key_name(key_names[iBatch:iBatch + batch]):
+            if model is None:
+                continue
+            log_scores, hours = mScores[model.key().name()]
+            for attr, log_score in zip(rgAttrs, log_scores):
+                setattr(model, attr, log_score)
+            model.TS_hrs = max(model.TS_hrs, hours)
+            rgModels.append(model)
+        mixins.put_models(rgModels)
+        cUpdated += len(rgModels)
+        logging.info("Replayed scores: %d of %d %s" % (cUpdated, len(key_names), cls.__name__))
+    return cUpdated
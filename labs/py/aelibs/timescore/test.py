@@ -1,9 +1,18 @@
 import calc
+import leaderboard
+import replay
 import logging
+import random
+import pickle
 import sys
+import threading
 
 import unittest
 
+# cache (for MemRate) is in the parent (aelibs) directory
+sys.path.insert(0, '..')
+import cache
+
 class TestTimeScore(unittest.TestCase):
     def test_base(self):
         sc = calc.Score()
@@ -46,6 +55,51 @@ class TestTimeScore(unittest.TestCase):
         sc.increment(0, 1)
         self.assertEqual(sc.log_score, sLog)
 
+class TestBatchScores(unittest.TestCase):
+    def sample(self, half, n=200):
+        # log_score is (about) time_last/half plus the log of the score at time_last
+        rand = random.Random(half)
+        times_last = [rand.uniform(0, 20000) for i in xrange(n)]
+        log_scores = [time_last/half + rand.uniform(0, 10) for time_last in times_last]
+        return log_scores, times_last
+    
+    def expected(self, log_scores, times_last, half, time_now):
+        scores = []
+        for log_score, time_last in zip(log_scores, times_last):
+            sc = calc.Score(half, log_score, time_last)
+            sc.increment(0, time_now)
+            scores.append(sc.score)
+        return scores
+    
+    def assertScores(self, scores, expected):
+        self.assertEqual(len(scores), len(expected))
+        for score, score_expected in zip(scores, expected):
+            self.assertAlmostEqual(score, score_expected, delta=abs(score_expected) * 1e-9)
+    
+    def test_batch(self):
+        for half in (1, 24, 168):
+            log_scores, times_last = self.sample(half)
+            for time_now in (0, 10000, 30000):
+                self.assertScores(calc.batch_scores(log_scores, times_last, half, time_now),
+                                  self.expected(log_scores, times_last, half, time_now))
+            
+    def test_loop(self):
+        # The pure python path (used when NumPy is not available)
+        log_scores, times_last = self.sample(24)
+        self.assertScores(calc._batch_scores_loop(log_scores, times_last, 24.0, 15000),
+                          self.expected(log_scores, times_last, 24, 15000))
+        self.assertScores(calc._batch_scores_loop(log_scores, times_last, 24.0),
+                          self.expected(log_scores, times_last, 24, None))
+            
+    def test_multi(self):
+        log_scores, times_last = self.sample(24)
+        mLogScores = {24: log_scores, 168: [log_score / 7 for log_score in log_scores]}
+        mScores = calc.batch_scores_multi(mLogScores, times_last, 20000)
+        self.assertEqual(sorted(mScores.keys()), [24, 168])
+        for half in mLogScores:
+            self.assertScores(mScores[half], self.expected(mLogScores[half], times_last, half, 20000))
+        self.assertEqual(calc.batch_scores([], [], 24, 10), [])
+
 class TestRateLimit(unittest.TestCase):
     def test_base(self):
         rate = calc.RateLimit(0)
@@ -82,5 +136,153 @@ class TestRateLimit(unittest.TestCase):
             #print "Half life: %d -> %.2f" % (half, rate.current_value(x))           
             self.assertAlmostEqual(rate.current_value(x), limit, 0)
         
+class TestCompact(unittest.TestCase):
+    def test_pickle(self):
+        sc = calc.Score(24, 10.0, 100)
+        sc.increment(1, 120)
+        rate = calc.RateLimit(75, 30)
+        rate.is_exceeded(10)
+        for protocol in (0, 2):
+            sc2 = pickle.loads(pickle.dumps(sc, protocol))
+            self.assertEqual(sc2.__getstate__(), sc.__getstate__())
+            rate2 = pickle.loads(pickle.dumps(rate, protocol))
+            self.assertEqual(rate2.__getstate__(), rate.__getstate__())
+            
+    def test_legacy_state(self):
+        # State saved by the un-slotted RateLimit
+        rate = calc.RateLimit.__new__(calc.RateLimit)
+        rate.__setstate__({'value': 3.0, 'threshold': 75, 'k': 0.5 ** (1.0/30), 'secs_last': 10})
+        self.assertEqual(rate.secs_half, 30)
+        self.assertAlmostEqual(rate.current_value(40), 1.5)
+        
+    def test_pure(self):
+        sc = calc.Score(24, 5.0, 48)
+        sc.increment(2, 60)
+        score, log_score, time_last = calc.increment(5.0, 48.0, 24.0)
+        score, log_score, time_last = calc.increment(log_score, time_last, 24.0, 2.0, 60.0)
+        self.assertEqual((score, log_score, time_last), (sc.score, sc.log_score, sc.time_last))
+        self.assertAlmostEqual(calc.current_score(log_score, time_last, 24.0, 84.0), score / 2)
+        self.assertAlmostEqual(calc.rate_value(4.0, 10, 30, 70), 1.0)
+        
+class TestLeaderboard(unittest.TestCase):
+    def test_top(self):
+        board = leaderboard.Leaderboard(10)
+        rand = random.Random(2)
+        mScores = {}
+        for i in xrange(2000):
+            key = 'k%d' % rand.randrange(100)
+            log_score = mScores.get(key, 0.0) + rand.uniform(0, 5)
+            mScores[key] = log_score
+            board.update(key, log_score)
+        expected = sorted([(log_score, key) for key, log_score in mScores.items()], reverse=True)
+        self.assertEqual(board.top(), expected[:10])
+        self.assertEqual(board.top(3), expected[:3])
+        self.assert_(len(board.heap) <= 20)
+        
+    def test_snapshot(self):
+        board = leaderboard.Leaderboard(3)
+        for i in xrange(5):
+            board.update('k%d' % i, float(i))
+        board2 = leaderboard.Leaderboard(3)
+        board2.update('k4', 10.0)
+        board2.update('k0', 3.5)
+        board2.restore(board.snapshot())
+        self.assertEqual(board2.top(), [(10.0, 'k4'), (3.5, 'k0'), (3.0, 'k3')])
+        board2.remove('k4')
+        self.assertEqual(board2.top(), [(3.5, 'k0'), (3.0, 'k3')])
+        board2.update('k9', 1.0)
+        board2.update('k8', 2.0)
+        self.assertEqual([key for log_score, key in board2.top()], ['k0', 'k3', 'k8'])
+
+    def test_restore_threads(self):
+        # Restoring (a merge) while other threads update - the board stays consistent
+        board = leaderboard.Leaderboard(20)
+        snapshot = [(float(i % 97), 's%d' % i) for i in xrange(2000)]
+        def update(iThread):
+            for i in xrange(2000):
+                board.update('t%d~%d' % (iThread, i % 50), float(i % 89))
+        threads = [threading.Thread(target=update, args=(i,)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for i in range(5):
+            board.restore(snapshot)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(board), 20)
+        self.assertEqual(board.top()[0][0], 96.0)
+        self.assertEqual(sorted(board.mScores.items()), sorted([(key, log_score) for log_score, key in board.top()]))
+
+class TestReplay(unittest.TestCase):
+    def events(self, n=2000):
+        rand = random.Random(3)
+        return [('k%d' % rand.randrange(50), rand.choice((1, 1, 2, -1)), rand.uniform(0, 5000))
+                for i in xrange(n)]
+    
+    def test_fold(self):
+        events = self.events()
+        mScores = replay.fold(events, [24, 168])
+        self.assertEqual(len(mScores), 50)
+        for key, (log_scores, hours) in mScores.items():
+            rgEvents = sorted([event for event in events if event[0] == key], key=lambda event: event[2])
+            for half, log_score in zip((24, 168), log_scores):
+                sc = calc.Score(half)
+                for k, value, hrs in rgEvents:
+                    sc.increment(value, hrs)
+                self.assertEqual(sc.log_score, log_score)
+                self.assertEqual(sc.time_last, hours)
+                
+    def test_processes(self):
+        events = self.events()
+        self.assertEqual(replay.replay(events, [24, 168], processes=3), replay.fold(events, [24, 168]))
+
+class TestMemRate(unittest.TestCase):
+    # The middle of a (15 second) bucket - requests there are counted with full weight
+    secs = 997.5
+    
+    def rate(self, client, threshold=20.5):
+        return calc.MemRate('test', secs_half=60, client=client, threshold=threshold)
+    
+    def test_limit(self):
+        client = cache.LocalMemcache()
+        cAdmitted = 0
+        for i in xrange(100):
+            if not self.rate(client).is_exceeded(self.secs):
+                cAdmitted += 1
+        self.assertEqual(cAdmitted, 20)
+        
+        # Half the count has decayed after a half-life
+        cAdmitted = 0
+        for i in xrange(100):
+            if not self.rate(client).is_exceeded(self.secs + 60):
+                cAdmitted += 1
+        self.assertEqual(cAdmitted, 10)
+        
+    def test_steady(self):
+        # A steady stream at the limit is admitted
+        client = cache.LocalMemcache()
+        threshold = calc.threshold_from_rpm(60, 60)
+        for secs in xrange(1000, 1600):
+            self.assertFalse(self.rate(client, threshold).is_exceeded(secs))
+        
+    def test_threads(self):
+        client = cache.LocalMemcache()
+        results = []
+        def worker():
+            for i in xrange(200):
+                results.append(self.rate(client, 50.0).is_exceeded(self.secs))
+        threads = [threading.Thread(target=worker) for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 1600)
+        cAdmitted = results.count(False)
+        self.assert_(cAdmitted <= 50)
+        
+        # Rejected requests are not counted - the remainder can be used
+        while not self.rate(client, 50.0).is_exceeded(self.secs):
+            cAdmitted += 1
+        self.assertEqual(cAdmitted, 50)
+        
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
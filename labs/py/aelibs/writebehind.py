@@ -0,0 +1,240 @@
+"""
+Write-behind queue for deferred (dirty) model writes.
+
+Items are queued by key; queueing a key that is already waiting replaces the waiting item,
+so a model dirtied by many requests is written once per flush.  A pool of worker threads
+writes the pending items, in one batch, once max_pending items are waiting or the oldest
+has waited secs_flush seconds.  A failed batch is re-queued (and retried at the next flush)
+up to max_retries times.
+
+The storage backend is any object with a put_multi(items) method (raising an exception
+on failure) - DatastoreBackend writes models with db.put.
+
+On App Engine, threads started by a request can't be relied on once the request has
+returned (the instance may be frozen or shut down, and on the Python 2.5 runtime threads
+aren't available at all), so the workers are only an optimization: call drain() before
+the request ends (mixins.write_deferred_cache does) so nothing queued is lost.
+
+Usage:
+
+    queue = WriteBehind(DatastoreBackend())
+    queue.put(sKey, model)
+    ...
+    queue.drain()           # Write everything now (in the calling thread) - at request end
+    queue.stop()            # Write everything and stop the workers
+
+Optional settings.py values (see mixins.write_deferred_cache):
+
+    CACHE_WRITE_BEHIND = False          # Write dirty Cacheable models from worker threads
+    CACHE_WRITE_BEHIND_WORKERS = 2
+    CACHE_WRITE_BEHIND_MAX_PENDING = 100
+    CACHE_WRITE_BEHIND_SECS = 5
+    CACHE_WRITE_BEHIND_RETRIES = 3
+"""
+
+import threading
+import time
+import logging
+
+import settings
+
+# Offsets into a pending entry
+ITEM, RETRIES = range(2)
+
+class DatastoreBackend(object):
+    """ Write models to the App Engine datastore """
+    def put_multi(self, models):
+        from google.appengine.ext import db
+        db.put(models)
+
+class WriteBehind(object):
+    """
+    Coalescing write-behind queue, flushed by a pool of worker threads.
+
+    With workers=0 nothing is written until drain() is called.
+
+    Counters: queued, coalesced, written, batches, retries, dropped
+    """
+    def __init__(self, backend, workers=2, max_pending=100, secs_flush=5.0, max_retries=3,
+                 clock=time.time):
+        self.backend = backend
+        self.workers = workers
+        self.max_pending = max_pending
+        self.secs_flush = secs_flush
+        self.max_retries = max_retries
+        self.clock = clock
+        self.pending = {}
+        self.secsOldest = None
+        self.cInFlight = 0
+        self.fStopping = False
+        self.mStats = {'queued': 0, 'coalesced': 0, 'written': 0, 'batches': 0,
+                       'retries': 0, 'dropped': 0}
+        self._threads = []
+        self._cond = threading.Condition()
+
+    def put(self, key, item):
+        """ Queue item to be written - replacing any item waiting under the same key """
+        self._cond.acquire()
+        try:
+            entry = self.pending.get(key)
+            if entry is not None:
+                self.mStats['coalesced'] += 1
+                entry[ITEM] = item
+            else:
+                self.mStats['queued'] += 1
+                self.pending[key] = [item, 0]
+                if self.secsOldest is None:
+                    self.secsOldest = self.clock()
+            if len(self.pending) >= self.max_pending:
+                self._cond.notify()
+            if len(self._threads) < self.workers and not self.fStopping:
+                self._start_workers()
+        finally:
+            self._cond.release()
+
+    def cancel(self, key):
+        """ Remove a waiting item (e.g. because it is being written directly) """
+        self._cond.acquire()
+        try:
+            self.pending.pop(key, None)
+            if not self.pending:
+                self.secsOldest = None
+        finally:
+            self._cond.release()
+
+    def drain(self):
+        """
+        Write all the pending items in the calling thread (retrying failures up to
+        max_retries times), and wait for the batches the workers are writing.
+        """
+        while True:
+            self._cond.acquire()
+            try:
+                if not self.pending:
+                    while self.cInFlight:
+                        self._cond.wait()
+                    return
+                batch = self._take_batch()
+            finally:
+                self._cond.release()
+            self._write(batch)
+
+    def stop(self):
+        """ Write all the pending items and stop the workers """
+        self._cond.acquire()
+        try:
+            self.fStopping = True
+            self._cond.notifyAll()
+            threads = self._threads
+            self._threads = []
+        finally:
+            self._cond.release()
+        for thread in threads:
+            thread.join()
+        self.drain()
+
+    def stats(self):
+        self._cond.acquire()
+        try:
+            mStats = dict(self.mStats)
+            mStats['pending'] = len(self.pending)
+            mStats['in_flight'] = self.cInFlight
+            return mStats
+        finally:
+            self._cond.release()
+
+    def _start_workers(self):
+        # Called with the lock held
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name="WriteBehind-%d" % len(self._threads))
+            thread.setDaemon(True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _worker(self):
+        while True:
+            self._cond.acquire()
+            try:
+                while True:
+                    if self.fStopping:
+                        if not self.pending:
+                            return
+                        break
+                    if self.pending:
+                        if len(self.pending) >= self.max_pending:
+                            break
+                        secsWait = self.secsOldest + self.secs_flush - self.clock()
+                        if secsWait <= 0:
+                            break
+                    else:
+                        secsWait = self.secs_flush
+                    self._cond.wait(secsWait)
+                batch = self._take_batch()
+            finally:
+                self._cond.release()
+            self._write(batch)
+
+    def _take_batch(self):
+        # Called with the lock held - remove (up to) max_pending items for writing
+        if len(self.pending) <= self.max_pending:
+            batch = self.pending
+            self.pending = {}
+            self.secsOldest = None
+        else:
+            batch = {}
+            for key in self.pending.keys()[:self.max_pending]:
+                batch[key] = self.pending.pop(key)
+        self.cInFlight += 1
+        return batch
+
+    def _write(self, batch):
+        failed = {}
+        try:
+            self.backend.put_multi([entry[ITEM] for entry in batch.values()])
+        except Exception, e:
+            logging.info("Write-behind batch of %d failed (%s)" % (len(batch), e))
+            failed = batch
+
+        self._cond.acquire()
+        try:
+            self.cInFlight -= 1
+            self.mStats['batches'] += 1
+            self.mStats['written'] += len(batch) - len(failed)
+            for key, entry in failed.items():
+                # A newer item has been queued - it replaces the failed one
+                if key in self.pending:
+                    continue
+                if entry[RETRIES] >= self.max_retries:
+                    self.mStats['dropped'] += 1
+                    logging.warning("Write-behind dropped %s after %d retries" % (key, entry[RETRIES]))
+                    continue
+                self.mStats['retries'] += 1
+                entry[RETRIES] += 1
+                self.pending[key] = entry
+                if self.secsOldest is None:
+                    self.secsOldest = self.clock()
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+def get_queue():
+    """
+    Return the process-wide write-behind queue for Cacheable models, configured from settings
+    - or None if CACHE_WRITE_BEHIND is not enabled.
+    """
+    global _queue
+    if _queue is None and getattr(settings, 'CACHE_WRITE_BEHIND', False):
+        _lock.acquire()
+        try:
+            if _queue is None:
+                _queue = WriteBehind(DatastoreBackend(),
+                                     workers=getattr(settings, 'CACHE_WRITE_BEHIND_WORKERS', 2),
+                                     max_pending=getattr(settings, 'CACHE_WRITE_BEHIND_MAX_PENDING', 100),
+                                     secs_flush=getattr(settings, 'CACHE_WRITE_BEHIND_SECS', 5),
+                                     max_retries=getattr(settings, 'CACHE_WRITE_BEHIND_RETRIES', 3))
+        finally:
+            _lock.release()
+    return _queue
+
+_queue = None
+_lock = threading.Lock()